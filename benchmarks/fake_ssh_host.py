@@ -0,0 +1,213 @@
+"""
+Локальный SSH сервер на paramiko, изображающий VPN сервер с adduser.sh/removeuser.sh.
+
+Понимает ровно те команды, которые отправляет src/ovpn.py, и печатает те же
+строки-маркеры, что и настоящие скрипты. Задержка и доля ошибок настраиваются,
+поэтому на нём можно мерить создание и отзыв конфигов без сети и без VPN сервера.
+"""
+import random
+import re
+import shlex
+import socket
+import threading
+import time
+from collections import Counter
+
+import paramiko
+
+from benchmarks.common import fake_ovpn
+
+_ADDUSER = re.compile(r"^\./adduser\.sh (\S+)$")
+_REMOVEUSER = re.compile(r"^\./removeuser\.sh (\S+)$")
+_CAT = re.compile(r'^cat "?(/root/[^"]+\.ovpn)"?$')
+_REMOVE_LOOP = re.compile(r'^for c in (.+); do \./removeuser\.sh "\$c"; done$')
+
+class FakeOpenVPNHost(paramiko.ServerInterface):
+    def __init__(self, username: str = "root", password: str = "bench",
+                 adduser_latency: float = 0.3, removeuser_latency: float = 0.1,
+                 command_latency: float = 0.002, connect_latency: float = 0.0,
+                 jitter: float = 0.1, failure_rate: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        """
+        Фейковый VPN сервер, принимающий SSH подключения на host:port
+
+        Args:
+            username: Имя пользователя для входа по паролю
+            password: Пароль
+            adduser_latency: Время работы adduser.sh (генерация ключей easy-rsa) в секундах
+            removeuser_latency: Время работы removeuser.sh (отзыв и пересборка CRL) в секундах
+            command_latency: Время выполнения остальных команд (cat) в секундах
+            connect_latency: Задержка перед SSH рукопожатием, имитирует сетевой RTT
+            jitter: Случайная добавка к задержке: до jitter * задержка
+            failure_rate: Доля вызовов adduser.sh/removeuser.sh, которые завершаются ошибкой
+            host: Адрес для прослушивания
+            port: Порт (0 - выбрать свободный)
+        """
+        self.username = username
+        self.password = password
+        self.adduser_latency = adduser_latency
+        self.removeuser_latency = removeuser_latency
+        self.command_latency = command_latency
+        self.connect_latency = connect_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.host = host
+        self.port = port
+        self.stats = Counter()
+        self.files: dict[str, str] = {}
+        self._files_lock = threading.Lock()
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = None
+        self._transports: list[paramiko.Transport] = []
+        self._stopped = threading.Event()
+        # Ответы на exec-запросы: (transport, remote_chanid) -> Event
+        self._replies: dict[tuple, threading.Event] = {}
+
+    # paramiko.ServerInterface
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == self.username and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        self.stats["commands"] += 1
+        replied = self._replies[(channel.transport, channel.remote_chanid)] = threading.Event()
+        threading.Thread(target=self._run_command, args=(channel, command.decode("utf-8"), replied), daemon=True).start()
+        return True
+
+    # Эмуляция скриптов
+    def _sleep(self, latency: float) -> None:
+        time.sleep(latency * (1 + random.uniform(0, self.jitter)))
+
+    def _failed(self) -> bool:
+        return random.random() < self.failure_rate
+
+    def _adduser(self, client_name: str) -> tuple[int, str, str]:
+        self._sleep(self.adduser_latency)
+        if self._failed():
+            self.stats["adduser_failed"] += 1
+            return 1, "", f"Ошибка easy-rsa при создании сертификата {client_name}\n"
+        path = f"/root/{client_name}.ovpn"
+        with self._files_lock:
+            self.files[path] = fake_ovpn(client_name, self.host)
+        self.stats["adduser"] += 1
+        return 0, (
+            f"Создание сертификата для {client_name}...\n"
+            f"Конфигурационный файл создан: {path}\n"
+        ), ""
+
+    def _removeuser(self, client_name: str) -> tuple[int, str, str]:
+        self._sleep(self.removeuser_latency)
+        if self._failed():
+            self.stats["removeuser_failed"] += 1
+            return 1, "", f"Ошибка при отзыве сертификата {client_name}\n"
+        with self._files_lock:
+            self.files.pop(f"/root/{client_name}.ovpn", None)
+        self.stats["removeuser"] += 1
+        return 0, f"Пользователь {client_name} успешно удален\n", ""
+
+    def _execute(self, command: str) -> tuple[int, str, str]:
+        if match := _ADDUSER.match(command):
+            return self._adduser(match.group(1))
+        if match := _REMOVEUSER.match(command):
+            return self._removeuser(match.group(1))
+        if match := _REMOVE_LOOP.match(command):
+            stdout, stderr, exit_code = [], [], 0
+            for client_name in shlex.split(match.group(1)):
+                exit_code, out, err = self._removeuser(client_name)
+                stdout.append(out)
+                stderr.append(err)
+            return exit_code, "".join(stdout), "".join(stderr)
+        if match := _CAT.match(command):
+            self._sleep(self.command_latency)
+            with self._files_lock:
+                content = self.files.get(match.group(1))
+            if content is None:
+                return 1, "", f"cat: {match.group(1)}: No such file or directory\n"
+            return 0, content, ""
+        return 127, "", f"bash: {command}: command not found\n"
+
+    def _run_command(self, channel, command: str, replied: threading.Event) -> None:
+        # paramiko подтверждает exec-запрос уже после возврата из
+        # check_channel_exec_request; быстрая команда могла закрыть канал раньше
+        # подтверждения, и клиент получал "Channel closed". sshd так не делает.
+        replied.wait(5)
+        try:
+            exit_code, stdout, stderr = self._execute(command)
+            if stdout:
+                channel.sendall(stdout.encode("utf-8"))
+            if stderr:
+                channel.sendall_stderr(stderr.encode("utf-8"))
+            channel.send_exit_status(exit_code)
+        finally:
+            channel.close()
+
+    # Жизненный цикл сервера
+    def _serve_connection(self, client_socket) -> None:
+        self.stats["connections"] += 1
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        transport = paramiko.Transport(client_socket)
+        transport.add_server_key(self._host_key)
+        transport._send_user_message = self._track_replies(transport, transport._send_user_message)
+        self._transports.append(transport)
+        try:
+            transport.start_server(server=self)
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()
+
+    def _track_replies(self, transport, send):
+        def send_user_message(message):
+            send(message)
+            data = message.asbytes()
+            if data[:1] == paramiko.common.cMSG_CHANNEL_SUCCESS:
+                replied = self._replies.pop((transport, int.from_bytes(data[1:5], "big")), None)
+                if replied is not None:
+                    replied.set()
+        return send_user_message
+
+    def _accept_loop(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                client_socket, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self._serve_connection, args=(client_socket,), daemon=True).start()
+
+    def start(self) -> "FakeOpenVPNHost":
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(128)
+        self._socket.settimeout(0.5)
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._socket is not None:
+            self._socket.close()
+        for transport in self._transports:
+            transport.close()
+        self._transports.clear()
+
+    def ssh_params(self) -> dict:
+        """Параметры для ovpn.create_openvpn_user/revoke_openvpn_user(s)"""
+        return {"hostname": self.host, "username": self.username, "password": self.password, "port": self.port}
+
+    def __enter__(self):
+        # Уже запущенный через start() сервер повторно не слушает порт
+        return self if self._socket is not None else self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
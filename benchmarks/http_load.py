@@ -0,0 +1,166 @@
+"""
+Нагрузочный бенчмарк HTTP API.
+
+Приложение FastAPI запускается в этом же процессе (httpx + ASGITransport) поверх
+настоящего Postgres; Telegram бот заменён FakeBot, SSH — заглушкой. Фоновые циклы
+(startup_event) не запускаются, поэтому измеряется только обработка запросов.
+
+Пример:
+    POSTGRES_DB=bcpy_bench python -m benchmarks.http_load --seed --concurrency 64 --duration 60 --output result.json
+"""
+import argparse
+import asyncio
+import platform
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import UTC, datetime
+
+import httpx
+
+from benchmarks import common
+
+import main
+from src import telegram
+
+DEFAULT_MIX = "user=40,active_configs=40,buy=10,renew=10"
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Неизвестная операция '{name}', доступны: {', '.join(OPERATIONS)}")
+        mix[name] = int(weight)
+    return mix
+
+def op_user(dataset):
+    return "GET", f"/api/users/{random.choice(dataset['tg_ids'])}", None
+
+def op_active_configs(dataset):
+    return "GET", f"/api/configs/user/{random.choice(dataset['tg_ids'])}/active", None
+
+def op_buy(dataset):
+    return "POST", "/api/buy-config", {
+        "user_id": random.choice(dataset["tg_ids"]),
+        "server_id": random.choice(dataset["server_ids"]),
+        "protocol_id": dataset["protocol_id"],
+        "config_name": f"bench_{uuid.uuid4().hex[:12]}",
+        "amount": 100,
+        "duration_days": 30,
+    }
+
+def op_renew(dataset):
+    config_id, tg_id = random.choice(dataset["renewals"])
+    return "POST", "/api/renew-config", {
+        "config_id": config_id,
+        "user_id": tg_id,
+        "amount": 100,
+        "duration_days": 30,
+    }
+
+OPERATIONS = {
+    "user": op_user,
+    "active_configs": op_active_configs,
+    "buy": op_buy,
+    "renew": op_renew,
+}
+
+async def run_load(client: httpx.AsyncClient, dataset: dict, mix: dict[str, int],
+                   concurrency: int, duration: float, warmup: float) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    statuses = defaultdict(lambda: defaultdict(int))
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+
+    async def worker():
+        while (now := time.perf_counter()) < deadline:
+            name = random.choices(names, weights)[0]
+            method, path, params = OPERATIONS[name](dataset)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            # Запросы разогрева (прогрев кэшей и пула соединений) в статистику не попадают
+            if now < measure_from:
+                continue
+            statuses[name][str(status)] += 1
+            if status == 200:
+                latencies[name].append(elapsed)
+            else:
+                errors[name] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "overall": common.summarize(all_latencies, sum(errors.values()), duration),
+        "operations": {
+            name: {**common.summarize(latencies[name], errors[name], duration), "statuses": dict(statuses[name])}
+            for name in names
+        },
+    }
+
+async def run(args) -> dict:
+    seed_info = None
+    if args.seed:
+        seed_info = await common.seed(args.users, args.configs, args.purchases, args.servers, args.pool_per_server)
+    dataset = await common.sample_dataset()
+
+    fake_bot = common.FakeBot(latency=args.telegram_latency)
+    main.bot = telegram.bot = fake_bot
+    common.install_ssh_stub(latency=args.ssh_latency)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        results = await run_load(client, dataset, args.mix, args.concurrency, args.duration, args.warmup)
+
+    db_pool_size = main.async_engine.pool.size()
+    await main.async_engine.dispose()
+    return {
+        "benchmark": "http_load",
+        "started_at": datetime.now(UTC),
+        "python": platform.python_version(),
+        "parameters": {
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": args.mix,
+            "ssh_latency_s": args.ssh_latency,
+            "telegram_latency_s": args.telegram_latency,
+            "db_pool_size": db_pool_size,
+        },
+        "seed": seed_info,
+        **results,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк HTTP API")
+    parser.add_argument("--seed", action="store_true", help="Очистить и заново заполнить БД (только база с 'bench' в имени)")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--configs", type=int, default=300_000)
+    parser.add_argument("--purchases", type=int, default=1_000_000)
+    parser.add_argument("--servers", type=int, default=4)
+    parser.add_argument("--pool-per-server", type=int, default=5000, help="Готовых конфигов на сервер для /api/buy-config")
+    parser.add_argument("--concurrency", type=int, default=32, help="Число одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=30, help="Длительность замера в секундах")
+    parser.add_argument("--warmup", type=float, default=5, help="Разогрев перед замером в секундах")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Веса операций, по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--ssh-latency", type=float, default=0.5, help="Задержка заглушки SSH в секундах")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Задержка FakeBot в секундах")
+    parser.add_argument("--output", help="Файл для JSON отчёта")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    common.write_report(report, args.output)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,161 @@
+"""
+Бенчмарк создания и отзыва OpenVPN клиентов на локальном фейковом SSH сервере.
+
+Сравнивает исходный путь "новое SSH подключение на каждый вызов" с пулом
+соединений src/ssh.py и пакетным отзывом ovpn.revoke_openvpn_users.
+Сеть и настоящий VPN сервер не нужны.
+
+Пример:
+    python -m benchmarks.provisioning --operations 200 --concurrency 16 --output provisioning.json
+"""
+import argparse
+import platform
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import UTC, datetime
+from io import StringIO
+
+from benchmarks import common
+from benchmarks.fake_ssh_host import FakeOpenVPNHost
+from src import ovpn, ssh
+
+def create_connect_per_call(client_name, hostname, username, password, port=22):
+    """Исходная реализация: отдельное SSH подключение и рукопожатие на каждый вызов"""
+    client = ssh.SSHClient(hostname=hostname, username=username, password=password, port=port)
+    client.connect()
+    try:
+        exit_code, stdout, stderr = client.execute_command(f'./adduser.sh {client_name}')
+        match = re.search(r'Конфигурационный файл создан: (.+\.ovpn)', stdout + stderr)
+        remote_path = match.group(1).strip() if match else f'/root/{client_name}.ovpn'
+        exit_code, file_content, file_err = client.execute_command(f'cat "{remote_path}"')
+        if exit_code != 0:
+            raise Exception(f"Ошибка при чтении .ovpn файла: {file_err}")
+        return file_content
+    finally:
+        client.close()
+
+def revoke_connect_per_call(client_name, hostname, username, password, port=22):
+    """Исходная реализация отзыва: отдельное SSH подключение на каждого клиента"""
+    client = ssh.SSHClient(hostname=hostname, username=username, password=password, port=port)
+    client.connect()
+    try:
+        exit_code, stdout, stderr = client.execute_command(f'./removeuser.sh {client_name}')
+        return f'Пользователь {client_name} успешно удален' in stdout + stderr
+    finally:
+        client.close()
+
+def measure(call, items, concurrency: int, weight=lambda item: 1) -> dict:
+    """
+    Выполняет call(item) для всех items в пуле потоков (как воркеры src/jobs.py)
+    и возвращает задержки вызовов и пропускную способность в единицах weight(item) в секунду
+    """
+    latencies, errors = [], 0
+
+    def timed(item):
+        started = time.perf_counter()
+        result = call(item)
+        if result is False:
+            raise RuntimeError("операция вернула False")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    # ovpn печатает вывод скриптов в stdout, а отчёт должен остаться чистым JSON
+    with redirect_stdout(StringIO()), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, item) for item in items]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - started
+
+    summary = common.summarize(latencies, errors, elapsed)
+    summary["seconds"] = round(elapsed, 2)
+    summary["clients_per_second"] = round(sum(weight(item) for item in items) / elapsed, 2)
+    return summary
+
+def run(args) -> dict:
+    host = FakeOpenVPNHost(
+        adduser_latency=args.adduser_latency,
+        removeuser_latency=args.removeuser_latency,
+        connect_latency=args.rtt,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+    )
+    results = {}
+    with host:
+        # Порт выбирается при запуске, поэтому параметры берутся после него
+        params = host.ssh_params()
+        def names(prefix):
+            return [f"{prefix}_{uuid.uuid4().hex[:10]}" for _ in range(args.operations)]
+
+        connect_names = names("direct")
+        connections_before = host.stats["connections"]
+        results["create_connect_per_call"] = measure(
+            lambda name: create_connect_per_call(name, **params), connect_names, args.concurrency
+        )
+        results["create_connect_per_call"]["ssh_connections"] = host.stats["connections"] - connections_before
+
+        pooled_names = names("pooled")
+        connections_before = host.stats["connections"]
+        results["create_pooled"] = measure(
+            lambda name: ovpn.create_openvpn_user(name, **params), pooled_names, args.concurrency
+        )
+        results["create_pooled"]["ssh_connections"] = host.stats["connections"] - connections_before
+
+        results["revoke_connect_per_call"] = measure(
+            lambda name: revoke_connect_per_call(name, **params), connect_names, args.concurrency
+        )
+        half = len(pooled_names) // 2
+        results["revoke_pooled"] = measure(
+            lambda name: ovpn.revoke_openvpn_user(name, **params), pooled_names[:half], args.concurrency
+        )
+        batches = [
+            pooled_names[half:][i:i + args.batch_size]
+            for i in range(0, len(pooled_names) - half, args.batch_size)
+        ]
+        results["revoke_batched"] = measure(
+            lambda batch: all(ovpn.revoke_openvpn_users(batch, **params).values()),
+            batches, args.concurrency, weight=len
+        )
+        ssh.close_all_pools()
+
+    return {
+        "benchmark": "provisioning",
+        "started_at": datetime.now(UTC),
+        "python": platform.python_version(),
+        "parameters": {
+            "operations": args.operations,
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size,
+            "adduser_latency_s": args.adduser_latency,
+            "removeuser_latency_s": args.removeuser_latency,
+            "rtt_s": args.rtt,
+            "jitter": args.jitter,
+            "failure_rate": args.failure_rate,
+            "ssh_pool_max_channels": ssh.SSH_POOL_MAX_CHANNELS,
+        },
+        "host_stats": dict(host.stats),
+        "results": results,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарк создания и отзыва VPN клиентов по SSH")
+    parser.add_argument("--operations", type=int, default=100, help="Клиентов на каждый сценарий")
+    parser.add_argument("--concurrency", type=int, default=8, help="Потоков, вызывающих ovpn одновременно")
+    parser.add_argument("--batch-size", type=int, default=25, help="Клиентов в одном пакетном отзыве")
+    parser.add_argument("--adduser-latency", type=float, default=0.3)
+    parser.add_argument("--removeuser-latency", type=float, default=0.1)
+    parser.add_argument("--rtt", type=float, default=0.05, help="Имитация сетевой задержки перед рукопожатием")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Файл для JSON отчёта")
+    args = parser.parse_args()
+
+    common.write_report(run(args), args.output)
+
+if __name__ == "__main__":
+    main_cli()
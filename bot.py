@@ -0,0 +1,32 @@
+"""
+Отдельный процесс Telegram бота, масштабируется независимо от API.
+
+    BOT_MODE=polling python bot.py   # getUpdates; при нескольких процессах опрашивает только лидер
+    BOT_MODE=webhook python bot.py   # принимает апдейты на BOT_PORT по WEBHOOK_PATH
+
+API при этом запускается с BOT_EMBEDDED=0, чтобы не поднимать второго бота.
+"""
+import asyncio
+import os
+import uvicorn
+from fastapi import FastAPI
+from src import leader, telegram
+
+BOT_PORT = int(os.getenv("BOT_PORT", "8081"))
+
+app = FastAPI(title="VPN Bot")
+app.include_router(telegram.router)
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.create_task(telegram.run_webhook_dispatcher())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await telegram.bot.session.close()
+
+if __name__ == "__main__":
+    if telegram.BOT_MODE == "webhook":
+        uvicorn.run(app, host="0.0.0.0", port=BOT_PORT)
+    else:
+        asyncio.run(leader.run_as_leader("telegram_bot", telegram.start_polling))
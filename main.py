@@ -1,29 +1,24 @@
-from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, PreCheckoutQuery
-from fastapi import FastAPI, HTTPException, Depends, Query
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, UTC
 import asyncio
+import time
+import zlib
 from typing import Optional
 import uvicorn
-import os
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from src import models, crud, ovpn
-from src.database import SessionLocal, engine
+from src import models, crud, ovpn, ssh, jobs, config_pool, config_store, cache, placement, metrics, leader, telegram, notifications, background, pagination
+from src.database import (
+    AsyncSessionLocal, async_engine, engine, slow_queries, SLOW_QUERY_LOG_SIZE, SLOW_QUERY_THRESHOLD_MS
+)
+
+from src.telegram import bot, BOT_TOKEN
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Получаем параметры SSH из переменных окружения
-SSH_HOST = os.getenv("SSH_HOST")
-SSH_USERNAME = os.getenv("SSH_USERNAME")
-SSH_PASSWORD = os.getenv("SSH_PASSWORD")
-SSH_PORT = int(os.getenv("SSH_PORT", "22"))
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-
 # Создаем таблицы в базе данных
 models.Base.metadata.create_all(bind=engine)
 
@@ -43,110 +38,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики SQL запросов
+metrics.instrument_engine(async_engine.sync_engine)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Шаблон пути (/api/configs/{config_id}), а не сам путь, чтобы не плодить метки
+        route = request.scope.get("route")
+        metrics.observe_request(
+            request.method,
+            getattr(route, "path", "unmatched"),
+            status,
+            time.perf_counter() - started
+        )
 
-# Обработчик pre-checkout query
-@dp.pre_checkout_query()
-async def pre_checkout_query(query: PreCheckoutQuery):
-    await query.answer(ok=True)
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
-# Обработчик успешной оплаты
-@dp.message(F.successful_payment)
-async def successful_payment(message: Message):
-    # await bot.refund_star_payment(message.from_user.id, message.successful_payment.telegram_payment_charge_id)
-    await bot.send_message(message.from_user.id, "Payment successful")
+# Бот и обработчики апдейтов находятся в src/telegram.py; в режиме webhook
+# апдейты принимает этот же API, если бот не вынесен в отдельный процесс (bot.py)
+if telegram.BOT_EMBEDDED and telegram.BOT_MODE == "webhook":
+    app.include_router(telegram.router)
 
 # Dependency для получения сессии базы данных
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
-
-# Фоновые задачи
-async def cleanup_expired_configs():
-    while True:
-        db = SessionLocal()
-        try:
-            # Получаем все активные конфиги с истекшим сроком
-            current_time = datetime.now(UTC)
-            expired_configs = db.query(models.UserConfig).filter(
-                models.UserConfig.is_active == True,
-                models.UserConfig.expires_at < current_time
-            ).all()
-            
-            for config in expired_configs:
-                # Деактивируем конфиг
-                crud.deactivate_user_config(db, config.id)
-                print(f"Конфиг {config.id} деактивирован (истек срок)")
-        finally:
-            db.close()
-        await asyncio.sleep(3600)  # Проверка каждый час
-
-async def send_expiration_notifications():
-    """Отправляет уведомления о скором истечении конфигураций"""
-    while True:
-        db = SessionLocal()
-        try:
-            # Получаем конфиги, которые истекают через 24 часа
-            expiring_configs = crud.get_configs_expiring_soon(db, hours_before=24)
-            
-            for config in expiring_configs:
-                # Проверяем, не было ли уже отправлено уведомление
-                if not crud.has_expiration_notification_sent(db, config.id):
-                    try:
-                        # Отправляем уведомление пользователю
-                        await send_expiration_warning_message(config)
-                        
-                        # Создаем запись об отправленном уведомлении
-                        crud.create_notification_log(
-                            db, 
-                            config_id=config.id,
-                            user_id=config.user_id,
-                            notification_type="expiration_warning",
-                            expires_at=config.expires_at
-                        )
-                        
-                        print(f"Отправлено уведомление об истечении для конфига {config.id}")
-                    except Exception as e:
-                        print(f"Ошибка при отправке уведомления для конфига {config.id}: {str(e)}")
-        finally:
-            db.close()
-        
-        # Проверяем каждые 6 часов
-        await asyncio.sleep(6 * 3600)
-
-async def send_expiration_warning_message(config):
-    """Отправляет сообщение с предупреждением об истечении конфигурации"""
-    try:
-        # Форматируем дату истечения
-        expires_date = config.expires_at.strftime("%d.%m.%Y в %H:%M")
-        
-        # Создаем сообщение
-        message = (
-            f"⚠️ **Внимание! Ваша VPN конфигурация скоро истечет**\n\n"
-            f"📅 **Дата истечения:** {expires_date}\n"
-            f"🖥️ **Сервер:** {config.server.country}\n"
-            f"📡 **Протокол:** {config.protocol.name}\n"
-            f"📁 **Конфигурация:** {config.config_name}\n\n"
-            f"🔗 Для продления конфигурации используйте наш бот или веб-интерфейс.\n"
-            f"💡 Не забудьте продлить конфигурацию до истечения срока!"
-        )
-        
-        # Отправляем сообщение пользователю
-        await bot.send_message(
-            chat_id=config.user.tgId,
-            text=message,
-            parse_mode="Markdown"
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при отправке уведомления пользователю {config.user.tgId}: {str(e)}")
-        raise e
 
 # Эндпоинты для работы с пользователями
 @app.post("/api/users")
@@ -156,17 +82,17 @@ async def create_user(
     firstname: str = Query(...),
     activate_trial: bool = Query(True, alias="activate_trial"),
     trial_days: int = Query(7, alias="trial_days"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_user = crud.get_user_by_tg_id(db, user_id)
+    db_user = await crud.get_user_by_tg_id(db, user_id)
     if db_user:
         return {"message": "Пользователь уже существует", "user": db_user}
     
-    user = crud.create_user(db, tg_id=user_id, username=username, firstname=firstname)
+    user = await crud.create_user(db, tg_id=user_id, username=username, firstname=firstname)
     
     # Активируем бесплатный пробный период, если запрошено
     if activate_trial:
-        trial_user = crud.activate_free_trial(db, user.id, trial_days)
+        trial_user = await crud.activate_free_trial(db, user.id, trial_days)
         if trial_user:
             return {
                 "message": "success", 
@@ -181,20 +107,20 @@ async def create_user(
     return {"message": "success", "user": user}
 
 @app.get("/api/users/{user_id}")
-async def get_user(user_id: int, db: Session = Depends(get_db)):
+async def get_user(user_id: int, db: AsyncSession = Depends(get_db)):
     # Сначала пробуем найти по Telegram ID
-    db_user = crud.get_user_by_tg_id(db, user_id)
+    db_user = await crud.get_user_by_tg_id(db, user_id)
     if db_user is None:
         # Если не найден по Telegram ID, пробуем по внутреннему ID
-        db_user = crud.get_user(db, user_id)
+        db_user = await crud.get_user(db, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return db_user
 
 @app.get("/api/users/{user_id}/free-trial")
-async def get_user_free_trial_status(user_id: int, db: Session = Depends(get_db)):
+async def get_user_free_trial_status(user_id: int, db: AsyncSession = Depends(get_db)):
     """Получить статус бесплатного пробного периода пользователя"""
-    trial_status = crud.get_user_free_trial_status(db, user_id)
+    trial_status = await crud.get_user_free_trial_status(db, user_id)
     if trial_status is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return trial_status
@@ -203,15 +129,15 @@ async def get_user_free_trial_status(user_id: int, db: Session = Depends(get_db)
 async def activate_user_free_trial(
     user_id: int,
     trial_days: int = Query(7, alias="trial_days"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Активировать бесплатный пробный период для пользователя"""
     # Проверяем существование пользователя
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    trial_user = crud.activate_free_trial(db, user.id, trial_days)
+    trial_user = await crud.activate_free_trial(db, user.id, trial_days)
     if not trial_user:
         raise HTTPException(status_code=400, detail="Бесплатный пробный период уже использован или недоступен")
     
@@ -226,11 +152,36 @@ async def activate_user_free_trial(
     }
 
 # Эндпоинты для работы с серверами
+def public_server(server, active_configs: int):
+    """Поля сервера, которые можно отдавать клиенту (без SSH учётных данных)"""
+    return {
+        "id": server.id,
+        "name": server.name,
+        "host": server.host,
+        "port": server.port,
+        "country": server.country,
+        "is_active": server.is_active,
+        "created_at": server.created_at,
+        "capacity": server.capacity,
+        "openvpn_proto": server.openvpn_proto,
+        "active_configs": active_configs,
+    }
+
 @app.get("/api/servers")
-async def get_servers(db: Session = Depends(get_db)):
-    """Получить все активные серверы"""
-    servers = crud.get_active_servers(db)
-    return {"servers": servers}
+async def get_servers(db: AsyncSession = Depends(get_db)):
+    """Получить все активные серверы с последним состоянием из фонового опроса"""
+    servers = await crud.get_active_servers(db)
+    # Настройки серверов берутся из кэша, а счётчики - свежие, одним запросом
+    states = await crud.get_server_states(db)
+    return {
+        "servers": [
+            {
+                **public_server(server, states[server.id].active_configs if server.id in states else 0),
+                "health": states[server.id].health if server.id in states else None
+            }
+            for server in servers
+        ]
+    }
 
 @app.post("/api/servers")
 async def create_server(
@@ -238,31 +189,47 @@ async def create_server(
     host: str = Query(...),
     port: int = Query(...),
     country: str = Query(None),
-    db: Session = Depends(get_db)
+    ssh_username: str = Query(None),
+    ssh_password: str = Query(None),
+    ssh_port: int = Query(22),
+    capacity: int = Query(1000, gt=0),
+    openvpn_proto: str = Query("udp"),
+    db: AsyncSession = Depends(get_db)
 ):
     """Создать новый сервер"""
     try:
-        server = crud.create_server(db, name=name, host=host, port=port, country=country)
-        return server
+        server = await crud.create_server(
+            db,
+            name=name,
+            host=host,
+            port=port,
+            country=country,
+            ssh_username=ssh_username,
+            ssh_password=ssh_password,
+            ssh_port=ssh_port,
+            capacity=capacity,
+            openvpn_proto=openvpn_proto
+        )
+        return public_server(server, server.active_configs)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 # Эндпоинты для работы с протоколами
 @app.get("/api/protocols")
-async def get_protocols(db: Session = Depends(get_db)):
+async def get_protocols(db: AsyncSession = Depends(get_db)):
     """Получить все активные протоколы"""
-    protocols = crud.get_active_protocols(db)
+    protocols = await crud.get_active_protocols(db)
     return {"protocols": protocols}
 
 @app.post("/api/protocols")
 async def create_protocol(
     name: str = Query(...),
     description: str = Query(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Создать новый протокол"""
     try:
-        protocol = crud.create_protocol(db, name=name, description=description)
+        protocol = await crud.create_protocol(db, name=name, description=description)
         return protocol
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -271,179 +238,382 @@ async def create_protocol(
 @app.post("/api/configs")
 async def create_user_config(
     user_id: int = Query(..., alias="user_id"),
-    server_id: int = Query(..., alias="server_id"),
+    server_id: Optional[int] = Query(None, alias="server_id"),
+    country: Optional[str] = Query(None),
     protocol_id: int = Query(..., alias="protocol_id"),
     config_name: str = Query(...),
     duration_days: int = Query(30),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Создать новую конфигурацию для пользователя"""
+    """
+    Поставить в очередь создание новой конфигурации для пользователя.
+    Если указан server_id, конфигурация создаётся именно на этом сервере
+    (409 - сервер заполнен, 503 - сервер выключен или не прошёл проверку здоровья).
+    Иначе она размещается на наименее загруженном сервере страны country.
+    """
     # Проверяем существование пользователя
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     # Проверяем существование сервера
-    server = crud.get_server(db, server_id)
-    if not server:
-        raise HTTPException(status_code=404, detail="Сервер не найден")
+    if server_id is not None:
+        server = await crud.get_server(db, server_id)
+        if not server:
+            raise HTTPException(status_code=404, detail="Сервер не найден")
+        if country is not None and country != server.country:
+            raise HTTPException(status_code=400, detail="Сервер находится в другой стране")
+    elif country is None:
+        raise HTTPException(status_code=400, detail="Укажите server_id или country")
     
     # Проверяем существование протокола
-    protocol = crud.get_protocol(db, protocol_id)
+    protocol = await crud.get_protocol(db, protocol_id)
     if not protocol:
         raise HTTPException(status_code=404, detail="Протокол не найден")
     
-    try:
-        # Создаем VPN конфигурацию на сервере через ovpn.py
-        config_content = ovpn.create_openvpn_user(
-            client_name=config_name,
-            hostname=SSH_HOST,
-            username=SSH_USERNAME,
-            password=SSH_PASSWORD,
-            port=SSH_PORT
-        )
-        
-        # Сохраняем конфигурацию в базе данных
-        config = crud.create_user_config(
-            db, 
-            user_id=user.id, 
-            server_id=server_id, 
-            protocol_id=protocol_id,
-            config_name=config_name,
-            config_content=config_content,
-            duration_days=duration_days
-        )
-        res = {
-            **config.__dict__,
-            "server_country": server.country,
+    # Место на сервере занимается сразу, в одной транзакции с задачей: всплеск запросов
+    # не превысит ёмкость сервера, пока воркеры ещё не создали конфигурации
+    if server_id is not None:
+        if await placement.reserve_on_server(db, server_id) is None:
+            state = (await crud.get_server_states(db)).get(server_id)
+            if server.is_active and state.health_up and state.active_configs >= server.capacity:
+                raise HTTPException(status_code=409, detail="На сервере нет свободных мест")
+            raise HTTPException(status_code=503, detail="Сервер недоступен")
+    else:
+        server_id = await placement.reserve_server(db, country)
+        if server_id is None:
+            raise HTTPException(status_code=503, detail="Нет доступных серверов в выбранной стране")
+    
+    # Сама генерация ключей на VPN сервере выполняется воркером в фоне,
+    # поэтому время ответа не зависит от скорости VPN сервера
+    job = await crud.create_provisioning_job(
+        db,
+        user_id=user.id,
+        server_id=server_id,
+        protocol_id=protocol_id,
+        config_name=config_name,
+        duration_days=duration_days
+    )
+    jobs.notify_new_job()
+    return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+@app.get("/api/configs/jobs/{job_id}")
+async def get_provisioning_job(
+    job_id: int,
+    wait: float = Query(0, ge=0, le=60)
+):
+    """Получить статус задачи создания конфигурации (wait - секунды ожидания завершения)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        # Сессия открывается на каждую проверку: во время ожидания соединение
+        # возвращается в пул, а не висит idle in transaction до 60 секунд
+        async with AsyncSessionLocal() as db:
+            job = await crud.get_provisioning_job(db, job_id)
+            if not job:
+                raise HTTPException(status_code=404, detail="Задача не найдена")
+            remaining = deadline - loop.time()
+            if job.status in ("done", "failed") or remaining <= 0:
+                return await _provisioning_job_result(db, job)
+        await jobs.wait_for_job(job_id, timeout=min(remaining, 1.0))
+
+async def _provisioning_job_result(db: AsyncSession, job: models.ProvisioningJob) -> dict:
+    result = {"job_id": job.id, "status": job.status}
+    if job.status == "failed":
+        result["error"] = job.error
+    elif job.status == "done":
+        config = job.config
+        result["config"] = {
+            "id": config.id,
+            "user_id": config.user_id,
+            "server_id": config.server_id,
+            "protocol_id": config.protocol_id,
+            "config_name": config.config_name,
+            "config_content": await crud.get_config_content(db, config),
+            "created_at": config.created_at,
+            "expires_at": config.expires_at,
+            "is_active": config.is_active,
+            "server_country": config.server.country,
         }
-        return res
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка при создании VPN конфигурации: {str(e)}")
+    return result
 
 @app.get("/api/configs/user/{user_id}")
-async def get_user_configs(user_id: int, db: Session = Depends(get_db)):
+async def get_user_configs(user_id: int, db: AsyncSession = Depends(get_db)):
     """Получить все конфигурации пользователя"""
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    configs = crud.get_user_all_configs(db, user.id)
+    configs = await crud.get_user_all_configs(db, user.id)
     return {"configs": configs}
 
 @app.get("/api/configs/user/{user_id}/active")
-async def get_user_active_configs(user_id: int, db: Session = Depends(get_db)):
+async def get_user_active_configs(user_id: int, db: AsyncSession = Depends(get_db)):
     """Получить активные конфигурации пользователя"""
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    configs = crud.get_user_active_configs(db, user.id)
+    configs = await crud.get_user_active_configs(db, user.id)
     return {"configs": configs}
 
 @app.delete("/api/configs/{config_id}")
-async def deactivate_config(config_id: int, db: Session = Depends(get_db)):
+async def deactivate_config(config_id: int, db: AsyncSession = Depends(get_db)):
     """Деактивировать конфигурацию и удалить VPN пользователя на сервере"""
-    config = crud.get_user_config(db, config_id)
+    config = await crud.get_user_config(db, config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Конфигурация не найдена")
     
     try:
         # Удаляем VPN конфигурацию на сервере
-        success = ovpn.revoke_openvpn_user(
-            client_name=config.config_name,
-            hostname=SSH_HOST,
-            username=SSH_USERNAME,
-            password=SSH_PASSWORD,
-            port=SSH_PORT
+        server = await crud.get_server(db, config.server_id)
+        success = await asyncio.to_thread(
+            ovpn.revoke_openvpn_user,
+            client_name=config.client_name or config.config_name,
+            **placement.ssh_params(server)
         )
         
         if success:
             # Деактивируем конфигурацию в базе данных
-            crud.deactivate_user_config(db, config_id)
+            await crud.deactivate_user_config(db, config_id)
             return {"message": "Конфигурация деактивирована и удалена с сервера"}
         else:
             raise HTTPException(status_code=500, detail="Ошибка при удалении VPN конфигурации на сервере")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при деактивации конфигурации: {str(e)}")
 
+@app.get("/api/configs/{config_id}/download")
+async def download_config(config_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """Скачать файл конфигурации (gzip, ETag / If-None-Match)"""
+    config = await crud.get_user_config(db, config_id)
+    if not config:
+        raise HTTPException(status_code=404, detail="Конфигурация не найдена")
+    
+    segments = None
+    if config.segment_hashes is not None:
+        etag = config_store.content_etag(config.segment_hashes)
+    else:
+        segments = await crud.get_config_segments(db, config)
+        etag = config_store.segment_hash(config_store.join_segments(segments))
+    etag = f'W/"{etag}"'
+    
+    headers = {
+        "ETag": etag,
+        # Клиент может кэшировать файл, но обязан перепроверять его по ETag
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    
+    if segments is None:
+        segments = await crud.get_config_segments(db, config)
+    headers["Content-Disposition"] = f'attachment; filename="vpn_config_{config.config_name}.ovpn"'
+    
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        
+        def body():
+            compressor = zlib.compressobj(wbits=31)  # 31: формат gzip
+            for segment in segments:
+                chunk = compressor.compress(segment.encode("utf-8"))
+                if chunk:
+                    yield chunk
+            yield compressor.flush()
+    else:
+        def body():
+            for segment in segments:
+                yield segment.encode("utf-8")
+    
+    return StreamingResponse(body(), media_type="application/x-openvpn-profile", headers=headers)
+
 @app.put("/api/configs/{config_id}/extend")
 async def extend_config(
     config_id: int,
     additional_days: int = Query(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Продлить конфигурацию"""
-    config = crud.extend_user_config(db, config_id, additional_days)
+    config = await crud.extend_user_config(db, config_id, additional_days)
     if not config:
-        raise HTTPException(status_code=404, detail="Конфигурация не найдена")
+        if not await crud.get_user_config(db, config_id):
+            raise HTTPException(status_code=404, detail="Конфигурация не найдена")
+        # Клиент истекшего конфига отозван на сервере: нужна новая конфигурация
+        raise HTTPException(status_code=400, detail="Конфигурация истекла или деактивирована, продление невозможно")
     return config
 
 @app.post("/api/configs/{config_id}/send-to-telegram")
 async def send_config_to_telegram(
     config_id: int,
     chat_id: int = Query(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Отправить файл конфигурации в Telegram чат"""
-    config = crud.get_user_config(db, config_id)
+    config = await crud.get_user_config(db, config_id, load_relations=True)
     if not config:
         raise HTTPException(status_code=404, detail="Конфигурация не найдена")
     
     if not config.is_active:
         raise HTTPException(status_code=400, detail="Конфигурация неактивна")
     
-    try:
-        # Создаем содержимое файла
-        config_content = config.config_content.encode('utf-8')
-        
-        # Отправляем файл в Telegram
-        from aiogram.types import BufferedInputFile
-        await bot.send_document(
-            chat_id=chat_id,
-            document=BufferedInputFile(
-                file=config_content,
-                filename=f"vpn_config_{config.config_name}.ovpn"
-            ),
-            caption=f"🔐 Ваш VPN конфигурационный файл\n"
-                   f"📅 Действует до: {config.expires_at.strftime('%Y-%m-%d') if config.expires_at else 'Бессрочно'}\n"
-                   f"🖥️ Сервер: {config.server.country}\n"
-                   f"📡 Протокол: {config.protocol.name}"
-        )
-        
-        return {"message": "Файл конфигурации отправлен в Telegram"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка при отправке файла: {str(e)}")
+    # Файл отправит outbox.run_outbox_sender с учётом лимитов Telegram и повторами при ошибках
+    message_id = await crud.enqueue_outbox_message(
+        db,
+        chat_id,
+        "send_document",
+        {
+            "config_id": config.id,
+            "filename": f"vpn_config_{config.config_name}.ovpn",
+            "caption": f"🔐 Ваш VPN конфигурационный файл\n"
+                       f"📅 Действует до: {config.expires_at.strftime('%Y-%m-%d') if config.expires_at else 'Бессрочно'}\n"
+                       f"🖥️ Сервер: {config.server.country}\n"
+                       f"📡 Протокол: {config.protocol.name}"
+        }
+    )
+    await db.commit()
+    
+    return {"message": "Файл конфигурации поставлен в очередь отправки в Telegram", "outbox_id": message_id}
 
 @app.post("/api/configs/{config_id}/send-expiration-notification")
 async def send_expiration_notification(
     config_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Отправить уведомление об истечении конфигурации (для тестирования)"""
-    config = crud.get_user_config(db, config_id)
+    config = await crud.get_user_config(db, config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Конфигурация не найдена")
     
     if not config.is_active:
         raise HTTPException(status_code=400, detail="Конфигурация неактивна")
     
+    notice = await crud.get_expiration_notice(db, config_id)
+    if notice is None:
+        raise HTTPException(status_code=404, detail="Пользователь конфигурации не найден")
+    
+    # Запись в журнал и сообщение в outbox фиксируются вместе
+    queued = await crud.create_notification_logs(db, [notice], "expiration_warning", commit=False)
+    if notice.config_id not in queued:
+        # Журнал уже содержит уведомление: повторное сообщение пользователю не отправляется
+        raise HTTPException(status_code=409, detail="Уведомление об истечении уже отправлялось")
+    message_id = await crud.enqueue_outbox_message(db, **notifications.expiration_warning_message(notice))
+    await db.commit()
+    
+    return {"message": "Уведомление об истечении поставлено в очередь отправки", "outbox_id": message_id}
+
+@app.get("/api/config-pool")
+async def get_config_pool_stats(db: AsyncSession = Depends(get_db)):
+    """Получить число готовых конфигураций по серверам"""
+    depths = await crud.get_pooled_config_counts(db)
+    # Пул пополняет процесс воркера, поэтому цель считается здесь по тем же данным
+    since = datetime.now(UTC) - timedelta(hours=config_pool.CONFIG_POOL_DEMAND_WINDOW_HOURS)
+    demand = await crud.get_recent_config_counts(db, since)
+    return {
+        "servers": [
+            {
+                "server_id": server_id,
+                "depth": depth,
+                "target": config_pool.pool_target(demand.get(server_id, 0)),
+            }
+            for server_id, depth in depths.items()
+        ]
+    }
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    """Получить счётчики попаданий и промахов кэшей справочников"""
+    return cache.get_stats()
+
+@app.get("/api/slow-queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=SLOW_QUERY_LOG_SIZE)):
+    """
+    Получить последние медленные запросы к БД (новые первыми) с планами выполнения.
+    Значения параметров видны только с SLOW_QUERY_LOG_PARAMETERS=1, иначе - их типы
+    """
+    return {
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "queries": list(reversed(slow_queries))[:limit]
+    }
+
+# Постраничные списки для администратора: keyset курсор вместо OFFSET,
+# next_cursor передаётся в cursor следующего запроса; null - страниц больше нет
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    return value.replace(tzinfo=UTC) if value is not None and value.tzinfo is None else value
+
+@app.get("/api/admin/users")
+async def list_users(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db)
+):
+    """Получить пользователей постранично, новые первыми"""
     try:
-        # Отправляем уведомление
-        await send_expiration_warning_message(config)
-        
-        # Создаем запись об отправленном уведомлении
-        crud.create_notification_log(
-            db, 
-            config_id=config.id,
-            user_id=config.user_id,
-            notification_type="expiration_warning",
-            expires_at=config.expires_at
+        users, next_cursor = await crud.get_users(db, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"users": users, "next_cursor": next_cursor}
+
+@app.get("/api/admin/configs")
+async def list_configs(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE),
+    server_id: Optional[int] = Query(None),
+    protocol_id: Optional[int] = Query(None),
+    is_active: Optional[bool] = Query(None),
+    expires_after: Optional[datetime] = Query(None),
+    expires_before: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """Получить конфигурации постранично; с фильтром по сроку - в порядке истечения"""
+    try:
+        configs, next_cursor = await crud.list_configs(
+            db, cursor, limit,
+            server_id=server_id,
+            protocol_id=protocol_id,
+            is_active=is_active,
+            expires_after=_as_utc(expires_after),
+            expires_before=_as_utc(expires_before)
         )
-        
-        return {"message": "Уведомление об истечении отправлено"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка при отправке уведомления: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"configs": configs, "next_cursor": next_cursor}
+
+@app.get("/api/admin/purchases")
+async def list_purchases(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE),
+    user_id: Optional[int] = Query(None),
+    config_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """Получить покупки постранично, новые первыми (user_id - внутренний ID пользователя)"""
+    try:
+        purchases, next_cursor = await crud.list_purchases(db, cursor, limit, user_id=user_id, config_id=config_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"purchases": purchases, "next_cursor": next_cursor}
+
+@app.get("/api/admin/notification-logs")
+async def list_notification_logs(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE),
+    config_id: Optional[int] = Query(None),
+    user_id: Optional[int] = Query(None),
+    notification_type: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """Получить журнал уведомлений постранично, новые первыми"""
+    try:
+        logs, next_cursor = await crud.list_notification_logs(
+            db, cursor, limit,
+            config_id=config_id,
+            user_id=user_id,
+            notification_type=notification_type
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"notification_logs": logs, "next_cursor": next_cursor}
 
 # Эндпоинты для работы с покупками
 @app.post("/api/purchases")
@@ -453,20 +623,20 @@ async def create_purchase(
     amount: float = Query(...),
     duration_days: int = Query(...),
     purchase_type: str = Query("new"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Создать запись о покупке"""
     # Проверяем существование пользователя
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     # Проверяем существование конфигурации
-    config = crud.get_user_config(db, config_id)
+    config = await crud.get_user_config(db, config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Конфигурация не найдена")
     
-    purchase = crud.create_purchase(
+    purchase = await crud.create_purchase(
         db, 
         user_id=user.id, 
         config_id=config_id,
@@ -477,13 +647,13 @@ async def create_purchase(
     return purchase
 
 @app.get("/api/purchases/user/{user_id}")
-async def get_user_purchases(user_id: int, db: Session = Depends(get_db)):
+async def get_user_purchases(user_id: int, db: AsyncSession = Depends(get_db)):
     """Получить все покупки пользователя"""
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    purchases = crud.get_user_purchases(db, user.id)
+    purchases = await crud.get_user_purchases(db, user.id)
     return {"purchases": purchases}
 
 # Комбинированные эндпоинты для покупки конфигураций
@@ -493,20 +663,20 @@ async def buy_new_config(
     server_id: int = Query(..., alias="server_id"),
     protocol_id: int = Query(..., alias="protocol_id"),
     config_name: str = Query(...),
-    config_content: str = Query(...),
+    config_content: Optional[str] = Query(None),  # Без содержимого конфиг выдаётся из пула готовых
     amount: float = Query(0.0),  # По умолчанию 0 для бесплатного пробного периода
     duration_days: int = Query(30),
     use_free_trial: bool = Query(False, alias="use_free_trial"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Покупка новой конфигурации с поддержкой бесплатного пробного периода"""
     # Проверяем существование пользователя
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     # Проверяем статус бесплатного пробного периода
-    trial_status = crud.get_user_free_trial_status(db, user_id)
+    trial_status = await crud.get_user_free_trial_status(db, user_id)
     if not trial_status:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
@@ -516,13 +686,13 @@ async def buy_new_config(
             raise HTTPException(status_code=400, detail="Бесплатный пробный период недоступен")
         
         # Активируем бесплатный пробный период
-        trial_user = crud.activate_free_trial(db, user.id, 7)  # 7 дней пробного периода
+        trial_user = await crud.activate_free_trial(db, user.id, 7)  # 7 дней пробного периода
         if not trial_user:
             raise HTTPException(status_code=400, detail="Не удалось активировать бесплатный пробный период")
         
         # Создаем конфигурацию с нулевой стоимостью
         try:
-            config, purchase = crud.buy_new_config(
+            config, purchase = await crud.buy_new_config(
                 db, 
                 user_id=user.id,
                 server_id=server_id,
@@ -548,7 +718,7 @@ async def buy_new_config(
             raise HTTPException(status_code=400, detail="Сумма покупки должна быть больше 0")
         
         try:
-            config, purchase = crud.buy_new_config(
+            config, purchase = await crud.buy_new_config(
                 db, 
                 user_id=user.id,
                 server_id=server_id,
@@ -568,16 +738,16 @@ async def renew_config(
     user_id: int = Query(..., alias="user_id"),
     amount: float = Query(...),
     duration_days: int = Query(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Продление существующей конфигурации"""
     # Проверяем существование пользователя
-    user = crud.get_user_by_tg_id(db, user_id)
+    user = await crud.resolve_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     try:
-        config, purchase = crud.renew_config(
+        config, purchase = await crud.renew_config(
             db,
             config_id=config_id,
             user_id=user.id,
@@ -585,14 +755,15 @@ async def renew_config(
             duration_days=duration_days
         )
         return {"config": config, "purchase": purchase}
+    except ValueError as e:
+        # Истекший конфиг не продлевается, и покупка не записывается
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
 # Эндпоинт для создания инвойса (оставляем без изменений)
-from fastapi.responses import JSONResponse
-
 @app.get("/api/create_invoice")
 async def create_invoice(title: str, description: str, payload: str, price: int):
     try:
@@ -649,16 +820,23 @@ async def create_invoice(title: str, description: str, payload: str, price: int)
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(cleanup_expired_configs())
-    asyncio.create_task(send_expiration_notifications())
-    asyncio.create_task(start_bot())
+    background.start_shared_tasks()
+    # Периодические задачи и очередь создания конфигураций выполняет отдельный
+    # процесс (python -m worker); EMBEDDED_WORKER=1 запускает их здесь же
+    if background.EMBEDDED_WORKER:
+        background.start_worker_tasks()
+    if telegram.BOT_EMBEDDED:
+        if telegram.BOT_MODE == "webhook":
+            asyncio.create_task(telegram.run_webhook_dispatcher())
+        else:
+            asyncio.create_task(leader.run_as_leader("telegram_bot", telegram.start_polling))
 
-async def start_bot():
-    print("🚀 Бот запущен")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+@app.on_event("shutdown")
+async def shutdown_event():
+    ssh.close_all_pools()
 
 if __name__ == "__main__":
     # Запускаем сервер uvicorn через asyncio
     uvicorn.run(app, host="0.0.0.0", port=8000)
-    # Бот стартует как фоновая задача при запуске FastAPI (см. startup_event)
+    # Бот стартует как фоновая задача при запуске FastAPI (см. startup_event),
+    # либо отдельно: BOT_EMBEDDED=0 и python bot.py
@@ -1,8 +1,8 @@
-import os
+import json
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 from src.database import engine
-from src import models
+from src import models, config_store, secrets_store
 from src.database import DATABASE_URL
 
 # Загружаем переменные окружения
@@ -219,6 +219,273 @@ def migrate_notification_logs():
         else:
             print("ℹ️ Таблица notification_logs уже существует")
 
+def migrate_config_pool():
+    """Добавляет колонку client_name в user_configs для конфигураций, выданных из пула"""
+    models.Base.metadata.create_all(bind=engine)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE user_configs
+            ADD COLUMN IF NOT EXISTS client_name VARCHAR;
+        """))
+        conn.commit()
+        print("✅ Колонка user_configs.client_name добавлена")
+
+def migrate_timestamps_to_timestamptz():
+    """Переводит колонки дат в TIMESTAMP WITH TIME ZONE (asyncpg не принимает aware-даты для TIMESTAMP)"""
+    timestamp_columns = {
+        "users": ["free_trial_expires_at"],
+        "servers": ["created_at"],
+        "user_configs": ["created_at", "expires_at"],
+        "pooled_configs": ["created_at"],
+        "purchases": ["created_at"],
+        "notification_logs": ["sent_at", "expires_at"],
+        "provisioning_jobs": ["created_at", "started_at", "finished_at"],
+    }
+    
+    with engine.connect() as conn:
+        for table, columns in timestamp_columns.items():
+            for column in columns:
+                data_type = conn.execute(text("""
+                    SELECT data_type FROM information_schema.columns
+                    WHERE table_name = :table AND column_name = :column
+                """), {"table": table, "column": column}).scalar()
+                
+                if data_type == "timestamp without time zone":
+                    # Существующие значения записывались в UTC
+                    conn.execute(text(
+                        f"ALTER TABLE {table} ALTER COLUMN {column} "
+                        f"TYPE TIMESTAMP WITH TIME ZONE USING {column} AT TIME ZONE 'UTC'"
+                    ))
+                    print(f"✅ Колонка {table}.{column} переведена в TIMESTAMP WITH TIME ZONE")
+        conn.commit()
+
+def migrate_notification_logs_unique():
+    """
+    Добавляет уникальность (config_id, notification_type) в notification_logs.
+    ADD CONSTRAINT UNIQUE блокирует запись в таблицу на время построения индекса, поэтому
+    индекс строится через CREATE UNIQUE INDEX CONCURRENTLY (в режиме AUTOCOMMIT),
+    а ограничение затем навешивается на готовый индекс без повторного сканирования.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        constraint_exists = conn.execute(text("""
+            SELECT EXISTS (
+                SELECT FROM pg_constraint WHERE conname = 'uq_notification_logs_config_type'
+            );
+        """)).scalar()
+        if constraint_exists:
+            print("✅ Ограничение uq_notification_logs_config_type уже есть")
+            return
+        
+        # Удаляем дубликаты, оставляя самую раннюю запись
+        conn.execute(text("""
+            DELETE FROM notification_logs a
+            USING notification_logs b
+            WHERE a.config_id = b.config_id
+              AND a.notification_type = b.notification_type
+              AND a.id > b.id;
+        """))
+        
+        # Прерванная сборка (или дубликат, вставленный во время неё) оставляет
+        # невалидный индекс: его пересоздаём
+        invalid = conn.execute(text("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = 'uq_notification_logs_config_type' AND NOT i.indisvalid;
+        """)).first()
+        if invalid:
+            print("Индекс uq_notification_logs_config_type невалиден после прерванной сборки, пересоздаём")
+            conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS uq_notification_logs_config_type;"))
+        
+        conn.execute(text("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_notification_logs_config_type
+            ON notification_logs (config_id, notification_type);
+        """))
+        conn.execute(text("""
+            ALTER TABLE notification_logs
+            ADD CONSTRAINT uq_notification_logs_config_type UNIQUE USING INDEX uq_notification_logs_config_type;
+        """))
+        print("✅ Ограничение uq_notification_logs_config_type добавлено")
+
+def migrate_config_segments(batch_size: int = 1000):
+    """Переносит содержимое конфигураций в хранилище сегментов config_segments"""
+    models.Base.metadata.create_all(bind=engine)
+    
+    with engine.connect() as conn:
+        for table in ("user_configs", "pooled_configs"):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS segment_hashes JSON;"))
+        conn.execute(text("ALTER TABLE pooled_configs ALTER COLUMN config_content DROP NOT NULL;"))
+        conn.commit()
+        
+        for table in ("user_configs", "pooled_configs"):
+            migrated = 0
+            while True:
+                rows = conn.execute(text(f"""
+                    SELECT id, config_content FROM {table}
+                    WHERE segment_hashes IS NULL AND config_content IS NOT NULL
+                    ORDER BY id
+                    LIMIT :batch_size
+                """), {"batch_size": batch_size}).all()
+                if not rows:
+                    break
+                
+                for row_id, content in rows:
+                    segments = config_store.split_config(content)
+                    hashes = [config_store.segment_hash(segment) for segment in segments]
+                    for h, segment in zip(hashes, segments):
+                        conn.execute(text("""
+                            INSERT INTO config_segments (hash, content) VALUES (:hash, :content)
+                            ON CONFLICT (hash) DO NOTHING;
+                        """), {"hash": h, "content": segment})
+                    conn.execute(text(f"""
+                        UPDATE {table} SET segment_hashes = CAST(:hashes AS JSON), config_content = NULL
+                        WHERE id = :id;
+                    """), {"hashes": json.dumps(hashes), "id": row_id})
+                conn.commit()
+                migrated += len(rows)
+            print(f"✅ {table}: перенесено в config_segments конфигураций: {migrated}")
+
+def migrate_server_placement():
+    """Добавляет в servers SSH учётные данные, ёмкость и счётчик активных конфигов"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE servers
+            ADD COLUMN IF NOT EXISTS ssh_username VARCHAR,
+            ADD COLUMN IF NOT EXISTS ssh_password VARCHAR,
+            ADD COLUMN IF NOT EXISTS ssh_port INTEGER DEFAULT 22,
+            ADD COLUMN IF NOT EXISTS capacity INTEGER NOT NULL DEFAULT 1000,
+            ADD COLUMN IF NOT EXISTS active_configs INTEGER NOT NULL DEFAULT 0;
+        """))
+        
+        # Один раз пересчитываем счётчики; дальше они поддерживаются инкрементально
+        conn.execute(text("""
+            UPDATE servers s SET active_configs = (
+                SELECT COUNT(*) FROM user_configs uc
+                WHERE uc.server_id = s.id AND uc.is_active = TRUE
+            );
+        """))
+        conn.commit()
+        print("✅ Колонки размещения добавлены в servers, счётчики пересчитаны")
+
+def migrate_server_health():
+    """Добавляет в servers протокол OpenVPN и результат фоновой проверки здоровья"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE servers
+            ADD COLUMN IF NOT EXISTS openvpn_proto VARCHAR NOT NULL DEFAULT 'udp',
+            ADD COLUMN IF NOT EXISTS health_up BOOLEAN NOT NULL DEFAULT TRUE,
+            ADD COLUMN IF NOT EXISTS health JSON;
+        """))
+        conn.commit()
+        print("✅ Колонки openvpn_proto, health_up и health добавлены в servers")
+
+def migrate_telegram_file_id():
+    """Добавляет в user_configs file_id загруженного в Telegram файла"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE user_configs
+            ADD COLUMN IF NOT EXISTS telegram_file_id VARCHAR,
+            ADD COLUMN IF NOT EXISTS telegram_file_etag VARCHAR(64);
+        """))
+        conn.commit()
+        print("✅ Колонки telegram_file_id и telegram_file_etag добавлены в user_configs")
+
+def migrate_revoke_pending():
+    """Добавляет в user_configs состояние отзыва клиента на VPN сервере"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE user_configs
+            ADD COLUMN IF NOT EXISTS revoke_pending BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS revoke_attempted_at TIMESTAMPTZ;
+        """))
+        conn.commit()
+        print("✅ Колонки revoke_pending и revoke_attempted_at добавлены в user_configs")
+
+def migrate_reserved_capacity():
+    """
+    Пересчитывает active_configs с учётом мест, занятых задачами создания конфигураций:
+    задачи, поставленные до перехода на резервирование, место не занимали
+    """
+    with engine.connect() as conn:
+        conn.execute(text("""
+            UPDATE servers s SET active_configs = (
+                SELECT COUNT(*) FROM user_configs uc
+                WHERE uc.server_id = s.id AND uc.is_active = TRUE
+            ) + (
+                SELECT COUNT(*) FROM provisioning_jobs j
+                WHERE j.server_id = s.id AND j.status IN ('pending', 'running')
+            );
+        """))
+        conn.commit()
+        print("✅ Счётчики active_configs пересчитаны с учётом задач в очереди")
+
+def migrate_encrypt_ssh_passwords():
+    """Шифрует SSH пароли серверов, сохранённые до появления SERVER_SECRET_KEY"""
+    if not secrets_store.SERVER_SECRET_KEY:
+        print("⚠️ SERVER_SECRET_KEY не задан, SSH пароли серверов остаются незашифрованными")
+        return
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT id, ssh_password FROM servers
+            WHERE ssh_password IS NOT NULL AND ssh_password NOT LIKE 'fernet:%';
+        """)).all()
+        for server_id, password in rows:
+            conn.execute(
+                text("UPDATE servers SET ssh_password = :password WHERE id = :id;"),
+                {"password": secrets_store.encrypt(password), "id": server_id}
+            )
+        conn.commit()
+        print(f"✅ Зашифровано SSH паролей серверов: {len(rows)}")
+
+# Индексы из models.py: (имя, таблица, определение)
+INDEXES = [
+    ("ix_user_configs_active_expires_at", "user_configs", "(expires_at) WHERE is_active"),
+    ("ix_user_configs_user_id_is_active", "user_configs", "(user_id, is_active)"),
+    ("ix_user_configs_created_at", "user_configs", "(created_at)"),
+    ("ix_purchases_user_id_created_at", "purchases", "(user_id, created_at)"),
+    ("ix_purchases_config_id", "purchases", "(config_id)"),
+    ("ix_provisioning_jobs_pending_id", "provisioning_jobs", "(id) WHERE status = 'pending'"),
+    ("ix_user_configs_server_id_id", "user_configs", "(server_id, id)"),
+    ("ix_user_configs_protocol_id_id", "user_configs", "(protocol_id, id)"),
+    ("ix_user_configs_is_active_id", "user_configs", "(is_active, id)"),
+    ("ix_user_configs_expires_at_id", "user_configs", "(expires_at, id)"),
+    ("ix_purchases_created_at_id", "purchases", "(created_at, id)"),
+    ("ix_notification_logs_user_id_id", "notification_logs", "(user_id, id)"),
+    ("ix_notification_logs_notification_type_id", "notification_logs", "(notification_type, id)"),
+    ("ix_user_configs_revoke_pending", "user_configs", "(revoke_attempted_at) WHERE revoke_pending"),
+]
+
+def migrate_indexes():
+    """
+    Создаёт индексы через CREATE INDEX CONCURRENTLY, не блокируя запись в таблицы.
+    CONCURRENTLY не работает внутри транзакции, поэтому соединение в режиме AUTOCOMMIT.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, table, definition in INDEXES:
+            # Прерванная сборка CONCURRENTLY оставляет невалидный индекс: его пересоздаём
+            invalid = conn.execute(text("""
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name AND NOT i.indisvalid;
+            """), {"name": name}).first()
+            if invalid:
+                print(f"Индекс {name} невалиден после прерванной сборки, пересоздаём")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name};"))
+            
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition};"))
+            print(f"✅ Индекс {name} готов")
+        
+        conn.execute(text("ANALYZE user_configs, purchases, provisioning_jobs, notification_logs;"))
+
 if __name__ == "__main__":
     migrate_database()
-    migrate_notification_logs() 
\ No newline at end of file
+    migrate_notification_logs()
+    migrate_config_pool()
+    migrate_timestamps_to_timestamptz()
+    migrate_notification_logs_unique()
+    migrate_config_segments()
+    migrate_server_placement()
+    migrate_server_health()
+    migrate_telegram_file_id()
+    migrate_revoke_pending()
+    migrate_reserved_capacity()
+    migrate_encrypt_ssh_passwords()
+    migrate_indexes()
@@ -0,0 +1,25 @@
+import asyncio
+import os
+from . import cache, config_pool, expiry, health, jobs, leader, notifications, outbox
+
+# Выполнять фоновые задачи воркера прямо в процессе API (для запуска одним процессом)
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "0") == "1"
+
+def start_shared_tasks() -> None:
+    """Задачи, нужные каждому процессу: и API, и воркеру"""
+    asyncio.create_task(cache.listen_for_invalidations())
+    asyncio.create_task(jobs.listen_for_job_events())
+
+def start_worker_tasks() -> None:
+    """Периодические задачи и очередь создания конфигураций"""
+    # Задачи, которые должны работать в одном экземпляре на все процессы и узлы
+    asyncio.create_task(leader.run_as_leader("cleanup_expired_configs", expiry.run_reconciliation_sweep))
+    asyncio.create_task(leader.run_as_leader("expiry_scheduler", expiry.run_expiry_scheduler))
+    asyncio.create_task(leader.run_as_leader("send_expiration_notifications", notifications.send_expiration_notifications))
+    asyncio.create_task(leader.run_as_leader("config_pool_filler", config_pool.run_config_pool_filler))
+    # Серверы опрашивает один процесс, результат видят все через servers.health_up
+    asyncio.create_task(leader.run_as_leader("health_prober", health.run_health_prober))
+    # Лимиты Telegram общие на бота: отправитель outbox один, параллельность внутри него
+    asyncio.create_task(leader.run_as_leader("outbox_sender", outbox.run_outbox_sender))
+    # Задачи очереди разбираются всеми воркерами параллельно (SKIP LOCKED)
+    asyncio.create_task(jobs.run_provisioning_workers())
@@ -0,0 +1,157 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import listen
+
+# Время жизни записей справочников (серверы, протоколы) в секундах
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "300"))
+# Максимум пользователей в кэше tgId -> пользователь
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Канал Postgres, через который процессы сообщают друг другу об инвалидации
+INVALIDATION_CHANNEL = "bcpy_cache_invalidation"
+
+_MISSING = object()
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float):
+        """
+        Кэш в памяти процесса с временем жизни записей и явной инвалидацией
+        
+        Args:
+            name: Имя кэша (используется в уведомлениях об инвалидации)
+            ttl: Время жизни записи в секундах
+        """
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[Any, tuple[float, Any]] = {}
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return default
+
+    def set(self, key, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+class LRUCache:
+    def __init__(self, name: str, maxsize: int):
+        """
+        Ограниченный по размеру кэш, вытесняющий давно не использованные записи
+        
+        Ключи приводятся к строке, чтобы совпадать с ключами из уведомлений
+        об инвалидации от других процессов.
+        
+        Args:
+            name: Имя кэша (используется в уведомлениях об инвалидации)
+            maxsize: Максимальное число записей
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Any] = OrderedDict()
+
+    def get(self, key, default=None):
+        key = str(key)
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value) -> None:
+        key = str(key)
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(str(key), None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+class UserRecord:
+    """Неизменяемая сводка пользователя: всё, что нужно обработчикам без загрузки ORM объекта"""
+    __slots__ = ("id", "tg_id", "free_trial_used", "free_trial_expires_at")
+
+    def __init__(self, id: int, tg_id: int, free_trial_used: Optional[bool],
+                 free_trial_expires_at: Optional[datetime]):
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "tg_id", tg_id)
+        object.__setattr__(self, "free_trial_used", free_trial_used)
+        object.__setattr__(self, "free_trial_expires_at", free_trial_expires_at)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserRecord неизменяем")
+
+class ServerRecord:
+    """
+    Неизменяемые настройки сервера для кэша. Счётчик active_configs и состояние
+    здоровья меняются постоянно, поэтому в кэш не попадают и читаются из БД.
+    """
+    __slots__ = ("id", "name", "host", "port", "country", "is_active", "created_at",
+                 "capacity", "ssh_username", "ssh_password", "ssh_port", "openvpn_proto")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ServerRecord неизменяем")
+
+servers_cache = TTLCache("servers", REFERENCE_CACHE_TTL)
+protocols_cache = TTLCache("protocols", REFERENCE_CACHE_TTL)
+users_cache = LRUCache("users", USER_CACHE_SIZE)
+
+_caches = {cache.name: cache for cache in (servers_cache, protocols_cache, users_cache)}
+
+def get_stats() -> dict:
+    """Счётчики попаданий и промахов всех кэшей"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+async def publish_invalidation(db: AsyncSession, cache, key=None) -> None:
+    """
+    Сбрасывает кэш (или одну его запись) в этом процессе и сообщает об этом остальным.
+    NOTIFY внутри транзакции доставляется только после её коммита.
+    """
+    cache.invalidate(key)
+    payload = cache.name if key is None else f"{cache.name}:{key}"
+    await db.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+
+def _on_notification(connection, pid, channel, payload) -> None:
+    name, _, key = payload.partition(":")
+    cache = _caches.get(name)
+    if cache is not None:
+        cache.invalidate(key or None)
+
+async def listen_for_invalidations() -> None:
+    """Держит соединение с LISTEN и сбрасывает кэши по уведомлениям других процессов"""
+
+    def _reset_all():
+        # Пока соединения не было, уведомления могли потеряться
+        for cache in _caches.values():
+            cache.invalidate()
+
+    await listen(INVALIDATION_CHANNEL, _on_notification, on_connect=_reset_all)
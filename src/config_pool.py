@@ -0,0 +1,76 @@
+import asyncio
+import math
+import os
+import uuid
+from datetime import UTC, datetime, timedelta
+from . import crud, metrics, ovpn, placement
+from .database import AsyncSessionLocal
+
+# Минимальное и максимальное число готовых конфигураций на сервер
+CONFIG_POOL_MIN_SIZE = int(os.getenv("CONFIG_POOL_MIN_SIZE", "5"))
+CONFIG_POOL_MAX_SIZE = int(os.getenv("CONFIG_POOL_MAX_SIZE", "50"))
+# Запас в часах: пул держит столько конфигураций, сколько покупают за это время
+CONFIG_POOL_HORIZON_HOURS = float(os.getenv("CONFIG_POOL_HORIZON_HOURS", "2"))
+# Окно, по которому оценивается спрос
+CONFIG_POOL_DEMAND_WINDOW_HOURS = float(os.getenv("CONFIG_POOL_DEMAND_WINDOW_HOURS", "6"))
+CONFIG_POOL_INTERVAL = float(os.getenv("CONFIG_POOL_INTERVAL", "60"))
+
+def pool_target(recent_demand: int) -> int:
+    """Целевая глубина пула по числу покупок за окно спроса"""
+    hourly = recent_demand / CONFIG_POOL_DEMAND_WINDOW_HOURS
+    target = math.ceil(hourly * CONFIG_POOL_HORIZON_HOURS)
+    return max(CONFIG_POOL_MIN_SIZE, min(CONFIG_POOL_MAX_SIZE, target))
+
+async def _plan_refill() -> dict:
+    """Считает, сколько конфигураций догенерировать для каждого сервера"""
+    async with AsyncSessionLocal() as db:
+        servers = await crud.get_active_servers(db)
+        depths = await crud.get_pooled_config_counts(db)
+        since = datetime.now(UTC) - timedelta(hours=CONFIG_POOL_DEMAND_WINDOW_HOURS)
+        demand = await crud.get_recent_config_counts(db, since)
+        states = await crud.get_server_states(db)
+    
+    plan = {}
+    down = {server_id for server_id, state in states.items() if not state.health_up}
+    for server in servers:
+        depth = depths.get(server.id, 0)
+        target = pool_target(demand.get(server.id, 0))
+        metrics.CONFIG_POOL_DEPTH.labels(str(server.id)).set(depth)
+        metrics.CONFIG_POOL_TARGET.labels(str(server.id)).set(target)
+        # Недоступный сервер пополним, когда он вернётся в ротацию
+        if depth < target and server.id not in down:
+            plan[server] = target - depth
+    return plan
+
+async def _generate_pooled_config(server) -> None:
+    client_name = f"pool{server.id}_{uuid.uuid4().hex[:12]}"
+    config_content = await asyncio.to_thread(
+        ovpn.create_openvpn_user,
+        client_name=client_name,
+        **placement.ssh_params(server)
+    )
+    async with AsyncSessionLocal() as db:
+        await crud.add_pooled_config(db, server.id, client_name, config_content)
+    # Выдачу из пула gauge увидит при следующем планировании, а пополнение - сразу
+    metrics.CONFIG_POOL_DEPTH.labels(str(server.id)).inc()
+
+async def _refill_server(server, count: int) -> None:
+    # Конфигурации одного сервера генерируются последовательно, чтобы не перегружать его
+    for _ in range(count):
+        try:
+            await _generate_pooled_config(server)
+        except Exception as e:
+            print(f"Ошибка при пополнении пула конфигураций сервера {server.id}: {str(e)}")
+            return
+
+async def run_config_pool_filler():
+    """Поддерживает пул готовых конфигураций каждого сервера"""
+    while True:
+        try:
+            plan = await _plan_refill()
+            if plan:
+                print(f"Пополнение пула конфигураций: { {server.id: count for server, count in plan.items()} }")
+                await asyncio.gather(*(_refill_server(server, count) for server, count in plan.items()))
+        except Exception as e:
+            print(f"Ошибка в цикле пополнения пула конфигураций: {str(e)}")
+        await asyncio.sleep(CONFIG_POOL_INTERVAL)
@@ -0,0 +1,35 @@
+import hashlib
+import re
+
+# Встроенные блоки .ovpn: <ca>, <cert>, <key>, <tls-auth>, <tls-crypt> и т.п.
+_INLINE_BLOCK = re.compile(r"<([A-Za-z0-9-]+)>.*?</\1>\r?\n?", re.DOTALL)
+
+def split_config(content: str) -> list[str]:
+    """
+    Разбивает .ovpn файл на сегменты: директивы между блоками и сами встроенные блоки.
+    
+    Директивы, <ca> и ключ tls-auth одинаковы у всех клиентов сервера и при
+    хранении по хэшу сохраняются один раз; уникальны только <cert> и <key> клиента.
+    Склейка сегментов в исходном порядке даёт файл байт в байт.
+    """
+    segments = []
+    position = 0
+    for match in _INLINE_BLOCK.finditer(content):
+        if match.start() > position:
+            segments.append(content[position:match.start()])
+        segments.append(match.group(0))
+        position = match.end()
+    if position < len(content):
+        segments.append(content[position:])
+    return segments
+
+def segment_hash(segment: str) -> str:
+    """Адрес сегмента в хранилище: sha256 от содержимого"""
+    return hashlib.sha256(segment.encode("utf-8")).hexdigest()
+
+def join_segments(segments) -> str:
+    return "".join(segments)
+
+def content_etag(hashes) -> str:
+    """ETag файла по хэшам его сегментов: вычисляется без чтения содержимого"""
+    return hashlib.sha256(":".join(hashes).encode("ascii")).hexdigest()
@@ -1,197 +1,612 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, exists, func, null, select, union_all, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from collections import Counter
 from datetime import UTC, datetime, timedelta
-from . import models
+from . import models, config_store, pagination, secrets_store
+from .leader import lock_key
+from .cache import servers_cache, protocols_cache, users_cache, ServerRecord, UserRecord, publish_invalidation
 
 # User CRUD operations
-def create_user(db: Session, tg_id: int, username: str, firstname: str):
+async def create_user(db: AsyncSession, tg_id: int, username: str, firstname: str):
     db_user = models.User(tgId=tg_id, username=username, firstname=firstname)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await publish_invalidation(db, users_cache, tg_id)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def get_user_by_tg_id(db: Session, tg_id: int):
-    return db.query(models.User).filter(models.User.tgId == tg_id).first()
+async def get_user_by_tg_id(db: AsyncSession, tg_id: int):
+    return await db.scalar(select(models.User).where(models.User.tgId == tg_id).limit(1))
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def resolve_user(db: AsyncSession, tg_id: int):
+    """
+    Возвращает UserRecord по Telegram ID из кэша, а при промахе - одним запросом
+    только нужных колонок. None, если пользователя нет.
+    """
+    record = users_cache.get(tg_id)
+    if record is None:
+        row = (await db.execute(
+            select(
+                models.User.id,
+                models.User.tgId,
+                models.User.free_trial_used,
+                models.User.free_trial_expires_at
+            ).where(models.User.tgId == tg_id).limit(1)
+        )).first()
+        if row:
+            record = UserRecord(*row)
+            users_cache.set(tg_id, record)
+    return record
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username).limit(1))
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.scalar(select(models.User).where(models.User.id == user_id).limit(1))
 
-def activate_free_trial(db: Session, user_id: int, trial_days: int = 7):
+async def get_users(db: AsyncSession, cursor: str | None = None, limit: int = 100):
+    """Страница пользователей, новые первыми. Возвращает (пользователи, курсор следующей страницы)"""
+    columns = [models.User.id]
+    users = await db.scalars(pagination.apply_cursor(select(models.User), columns, cursor, limit))
+    return pagination.page(columns, users.all(), limit)
+
+async def activate_free_trial(db: AsyncSession, user_id: int, trial_days: int = 7):
     """Активирует бесплатный пробный период для пользователя"""
-    user = get_user(db, user_id)
+    user = await get_user(db, user_id)
     if user and not user.free_trial_used:
         user.free_trial_used = True
         user.free_trial_expires_at = datetime.now(UTC) + timedelta(days=trial_days)
-        db.commit()
-        db.refresh(user)
+        await publish_invalidation(db, users_cache, user.tgId)
+        await db.commit()
+        await db.refresh(user)
         return user
     return None
 
-def get_user_free_trial_status(db: Session, user_id: int):
+async def get_user_free_trial_status(db: AsyncSession, user_id: int):
     """Получает статус бесплатного пробного периода пользователя"""
-    user = get_user_by_tg_id(db, user_id)
+    user = await resolve_user(db, user_id)
     if not user:
         return None
-    
+
     if not user.free_trial_used:
         return {"available": True, "used": False, "expires_at": None}
-    
+
     if user.free_trial_expires_at and user.free_trial_expires_at > datetime.now(UTC):
         return {
-            "available": False, 
-            "used": True, 
+            "available": False,
+            "used": True,
             "active": True,
             "expires_at": user.free_trial_expires_at
         }
     else:
         return {
-            "available": False, 
-            "used": True, 
+            "available": False,
+            "used": True,
             "active": False,
             "expires_at": user.free_trial_expires_at
         }
 
 # Server CRUD operations
-def create_server(db: Session, name: str, host: str, port: int, country: str = None):
+async def create_server(db: AsyncSession, name: str, host: str, port: int, country: str = None,
+                        ssh_username: str = None, ssh_password: str = None, ssh_port: int = 22,
+                        capacity: int = 1000, openvpn_proto: str = "udp"):
     # Проверяем, существует ли сервер с таким именем
-    existing_server = get_server_by_name(db, name)
+    existing_server = await get_server_by_name(db, name)
     if existing_server:
         raise ValueError(f"Сервер с именем '{name}' уже существует")
-    
-    db_server = models.Server(name=name, host=host, port=port, country=country)
+    if openvpn_proto not in ("udp", "tcp"):
+        raise ValueError("openvpn_proto должен быть udp или tcp")
+
+    db_server = models.Server(
+        name=name,
+        host=host,
+        port=port,
+        country=country,
+        ssh_username=ssh_username,
+        ssh_password=secrets_store.encrypt(ssh_password),
+        ssh_port=ssh_port,
+        capacity=capacity,
+        openvpn_proto=openvpn_proto
+    )
     db.add(db_server)
-    db.commit()
-    db.refresh(db_server)
+    await publish_invalidation(db, servers_cache)
+    await db.commit()
+    await db.refresh(db_server)
     return db_server
 
-def get_server(db: Session, server_id: int):
-    return db.query(models.Server).filter(models.Server.id == server_id).first()
+def _server_record_query():
+    return select(*(getattr(models.Server, name) for name in ServerRecord.__slots__))
+
+async def get_server(db: AsyncSession, server_id: int):
+    """ServerRecord сервера из кэша (без active_configs, см. get_server_states)"""
+    server = servers_cache.get(("id", server_id))
+    if server is None:
+        row = (await db.execute(_server_record_query().where(models.Server.id == server_id).limit(1))).first()
+        if row:
+            server = ServerRecord(**row._mapping)
+            servers_cache.set(("id", server_id), server)
+    return server
 
-def get_active_servers(db: Session):
-    return db.query(models.Server).filter(models.Server.is_active == True).all()
+async def get_active_servers(db: AsyncSession):
+    servers = servers_cache.get("active")
+    if servers is None:
+        rows = await db.execute(_server_record_query().where(models.Server.is_active == True))
+        servers = [ServerRecord(**row._mapping) for row in rows]
+        servers_cache.set("active", servers)
+    return servers
 
-def get_server_by_name(db: Session, name: str):
-    return db.query(models.Server).filter(models.Server.name == name).first()
+async def get_server_states(db: AsyncSession):
+    """
+    Часто меняющиеся поля серверов в обход кэша:
+    {server_id: строка с active_configs, health_up, health}
+    """
+    rows = await db.execute(select(
+        models.Server.id,
+        models.Server.active_configs,
+        models.Server.health_up,
+        models.Server.health
+    ))
+    return {row.id: row for row in rows}
+
+async def save_server_health(db: AsyncSession, states: dict):
+    """Сохраняет результаты проверки серверов одним UPDATE по ключу: {server_id: (up, снимок)}"""
+    if not states:
+        return
+    await db.execute(
+        update(models.Server),
+        [
+            {"id": server_id, "health_up": up, "health": snapshot}
+            for server_id, (up, snapshot) in states.items()
+        ]
+    )
+    await db.commit()
+
+async def get_server_by_name(db: AsyncSession, name: str):
+    return await db.scalar(select(models.Server).where(models.Server.name == name).limit(1))
 
 # Protocol CRUD operations
-def create_protocol(db: Session, name: str, description: str = None):
+async def create_protocol(db: AsyncSession, name: str, description: str = None):
     # Проверяем, существует ли протокол с таким именем
-    existing_protocol = get_protocol_by_name(db, name)
+    existing_protocol = await get_protocol_by_name(db, name)
     if existing_protocol:
         raise ValueError(f"Протокол с именем '{name}' уже существует")
-    
+
     db_protocol = models.Protocol(name=name, description=description)
     db.add(db_protocol)
-    db.commit()
-    db.refresh(db_protocol)
+    await publish_invalidation(db, protocols_cache)
+    await db.commit()
+    await db.refresh(db_protocol)
     return db_protocol
 
-def get_protocol(db: Session, protocol_id: int):
-    return db.query(models.Protocol).filter(models.Protocol.id == protocol_id).first()
+async def get_protocol(db: AsyncSession, protocol_id: int):
+    protocol = protocols_cache.get(("id", protocol_id))
+    if protocol is None:
+        protocol = await db.scalar(select(models.Protocol).where(models.Protocol.id == protocol_id).limit(1))
+        if protocol:
+            db.expunge(protocol)
+            protocols_cache.set(("id", protocol_id), protocol)
+    return protocol
 
-def get_active_protocols(db: Session):
-    return db.query(models.Protocol).filter(models.Protocol.is_active == True).all()
+async def get_active_protocols(db: AsyncSession):
+    protocols = protocols_cache.get("active")
+    if protocols is None:
+        protocols = (await db.scalars(select(models.Protocol).where(models.Protocol.is_active == True))).all()
+        for protocol in protocols:
+            db.expunge(protocol)
+        protocols_cache.set("active", protocols)
+    return protocols
 
-def get_protocol_by_name(db: Session, name: str):
-    return db.query(models.Protocol).filter(models.Protocol.name == name).first()
+async def get_protocol_by_name(db: AsyncSession, name: str):
+    return await db.scalar(select(models.Protocol).where(models.Protocol.name == name).limit(1))
 
 # UserConfig CRUD operations
-def create_user_config(db: Session, user_id: int, server_id: int, protocol_id: int, 
-                      config_name: str, config_content: str, duration_days: int = 30):
+# Канал, по которому планировщик истечения узнаёт о новых сроках действия конфигов
+EXPIRY_CHANNEL = "bcpy_expiry_schedule"
+
+async def _publish_expiry(db: AsyncSession, config_id: int, expires_at: datetime):
+    """Сообщает планировщику истечения новый срок конфига; NOTIFY доставляется после коммита"""
+    await db.execute(select(func.pg_notify(EXPIRY_CHANNEL, f"{config_id}:{expires_at.timestamp()}")))
+
+async def _adjust_active_configs(db: AsyncSession, server_id: int, delta: int):
+    """Меняет счётчик активных конфигов сервера в текущей транзакции"""
+    await db.execute(
+        update(models.Server)
+        .where(models.Server.id == server_id)
+        .values(active_configs=models.Server.active_configs + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+async def create_user_config(db: AsyncSession, user_id: int, server_id: int, protocol_id: int,
+                             config_name: str, config_content: str, duration_days: int = 30,
+                             client_name: str = None, reserved: bool = False, commit: bool = True):
+    """
+    Создаёт конфиг пользователя. reserved=True - место на сервере уже занято
+    задачей создания (placement.reserve_server), счётчик сервера не меняется.
+    """
     expires_at = datetime.now(UTC) + timedelta(days=duration_days)
     db_config = models.UserConfig(
         user_id=user_id,
         server_id=server_id,
         protocol_id=protocol_id,
         config_name=config_name,
-        config_content=config_content,
+        client_name=client_name,
+        segment_hashes=await store_config_content(db, config_content),
         expires_at=expires_at,
         is_active=True
     )
     db.add(db_config)
-    db.commit()
-    db.refresh(db_config)
+    if not reserved:
+        await _adjust_active_configs(db, server_id, 1)
+    await db.flush()
+    await _publish_expiry(db, db_config.id, expires_at)
+    if commit:
+        await db.commit()
+        await db.refresh(db_config)
     return db_config
 
-def get_user_config(db: Session, config_id: int):
-    return db.query(models.UserConfig).filter(models.UserConfig.id == config_id).first()
+async def create_user_config_from_pool(db: AsyncSession, user_id: int, server_id: int, protocol_id: int,
+                                       config_name: str, duration_days: int = 30, commit: bool = True,
+                                       reserved: bool = False):
+    """
+    Выдаёт пользователю заранее сгенерированную конфигурацию сервера.
+    Возвращает None, если готовых конфигураций нет.
+    reserved=True - место на сервере уже занято задачей создания, счётчик не меняется.
+    """
+    # SKIP LOCKED: параллельные покупки разбирают разные строки, не дожидаясь друг друга
+    pooled = await db.scalar(
+        select(models.PooledConfig)
+        .where(models.PooledConfig.server_id == server_id)
+        .order_by(models.PooledConfig.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if not pooled:
+        return None
 
-def get_user_active_configs(db: Session, user_id: int):
+    # На VPN сервере клиент остаётся под своим именем, пользователю показываем его название
+    db_config = models.UserConfig(
+        user_id=user_id,
+        server_id=server_id,
+        protocol_id=protocol_id,
+        config_name=config_name,
+        client_name=pooled.client_name,
+        config_content=pooled.config_content,
+        segment_hashes=pooled.segment_hashes,
+        expires_at=datetime.now(UTC) + timedelta(days=duration_days),
+        is_active=True
+    )
+    db.add(db_config)
+    await db.delete(pooled)
+    if not reserved:
+        await _adjust_active_configs(db, server_id, 1)
+    await db.flush()
+    await _publish_expiry(db, db_config.id, db_config.expires_at)
+    if commit:
+        await db.commit()
+        await db.refresh(db_config)
+    return db_config
+
+async def get_user_config(db: AsyncSession, config_id: int, load_relations: bool = False):
+    """Получает конфиг; с load_relations=True сразу подгружает пользователя, сервер и протокол"""
+    query = select(models.UserConfig).where(models.UserConfig.id == config_id).limit(1)
+    if load_relations:
+        # В асинхронной сессии ленивая подгрузка связей недоступна
+        query = query.options(
+            joinedload(models.UserConfig.user),
+            joinedload(models.UserConfig.server),
+            joinedload(models.UserConfig.protocol)
+        )
+    return await db.scalar(query)
+
+def _config_listing_query():
+    """Одна выборка конфигов с именем протокола и данными сервера, без загрузки ORM объектов"""
+    return (
+        select(
+            models.UserConfig.id,
+            models.UserConfig.config_name,
+            models.UserConfig.created_at,
+            models.UserConfig.expires_at,
+            models.UserConfig.is_active,
+            models.Protocol.name.label("protocol"),  # Имя протокола вместо ID
+            models.Server.country.label("server_country"),  # Страна сервера вместо ID
+            models.Server.name.label("server_name")  # Добавим также имя сервера для полноты
+        )
+        .outerjoin(models.Protocol, models.Protocol.id == models.UserConfig.protocol_id)
+        .outerjoin(models.Server, models.Server.id == models.UserConfig.server_id)
+    )
+
+async def get_user_active_configs(db: AsyncSession, user_id: int):
     """Получает все активные конфиги пользователя"""
-    configs = db.query(models.UserConfig).filter(
-        models.UserConfig.user_id == user_id,
-        models.UserConfig.is_active == True,
-        (models.UserConfig.expires_at == None) | (models.UserConfig.expires_at > datetime.now(UTC))
-    ).all()
-    
-    # Преобразуем объекты конфигурации в словари с нужными полями
-    result = []
-    for config in configs:
-        config_dict = {
-            "id": config.id,
-            "config_name": config.config_name,
-            "created_at": config.created_at,
-            "expires_at": config.expires_at,
-            "is_active": config.is_active,
-            "protocol": config.protocol.name,  # Имя протокола вместо ID
-            "server_country": config.server.country,  # Страна сервера вместо ID
-            "server_name": config.server.name,  # Добавим также имя сервера для полноты
-            "config_content": config.config_content
-        }
-        result.append(config_dict)
-    
-    return result
+    # Содержимое файлов в список не входит: его отдаёт /api/configs/{config_id}/download
+    rows = await db.execute(
+        _config_listing_query()
+        .where(
+            models.UserConfig.user_id == user_id,
+            models.UserConfig.is_active == True,
+            (models.UserConfig.expires_at == None) | (models.UserConfig.expires_at > datetime.now(UTC))
+        )
+    )
+    return [dict(row) for row in rows.mappings()]
 
-def get_user_all_configs(db: Session, user_id: int):
+async def get_user_all_configs(db: AsyncSession, user_id: int):
     """Получает все конфиги пользователя"""
-    configs = db.query(models.UserConfig).filter(models.UserConfig.user_id == user_id).all()
-    
-    # Преобразуем объекты конфигурации в словари с нужными полями
-    result = []
-    for config in configs:
-        config_dict = {
-            "id": config.id,
-            "config_name": config.config_name,
-            "created_at": config.created_at,
-            "expires_at": config.expires_at,
-            "is_active": config.is_active,
-            "protocol": config.protocol.name,  # Имя протокола вместо ID
-            "server_country": config.server.country,  # Страна сервера вместо ID
-            "server_name": config.server.name  # Добавим также имя сервера для полноты
-        }
-        result.append(config_dict)
-    
-    return result
+    rows = await db.execute(
+        _config_listing_query().where(models.UserConfig.user_id == user_id)
+    )
+    return [dict(row) for row in rows.mappings()]
 
-def deactivate_user_config(db: Session, config_id: int):
-    config = get_user_config(db, config_id)
+async def list_configs(db: AsyncSession, cursor: str | None = None, limit: int = 100,
+                       server_id: int | None = None, protocol_id: int | None = None,
+                       is_active: bool | None = None, expires_after: datetime | None = None,
+                       expires_before: datetime | None = None):
+    """
+    Страница конфигов для администратора. Без фильтра по сроку - новые первыми
+    (ключ id), с фильтром по сроку - в порядке истечения (ключ expires_at, id).
+    Возвращает (конфиги, курсор следующей страницы).
+    """
+    query = _config_listing_query().add_columns(
+        models.UserConfig.user_id,
+        models.UserConfig.server_id,
+        models.UserConfig.protocol_id
+    )
+    if server_id is not None:
+        query = query.where(models.UserConfig.server_id == server_id)
+    if protocol_id is not None:
+        query = query.where(models.UserConfig.protocol_id == protocol_id)
+    if is_active is not None:
+        query = query.where(models.UserConfig.is_active == is_active)
+
+    if expires_after is None and expires_before is None:
+        columns, descending = [models.UserConfig.id], True
+    else:
+        columns, descending = [models.UserConfig.expires_at, models.UserConfig.id], False
+        if expires_after is not None:
+            query = query.where(models.UserConfig.expires_at >= expires_after)
+        if expires_before is not None:
+            query = query.where(models.UserConfig.expires_at < expires_before)
+
+    rows = await db.execute(pagination.apply_cursor(query, columns, cursor, limit, descending))
+    rows, next_cursor = pagination.page(columns, rows.all(), limit)
+    return [row._asdict() for row in rows], next_cursor
+
+async def deactivate_user_config(db: AsyncSession, config_id: int):
+    """Деактивирует конфиг, клиент которого уже отозван на VPN сервере"""
+    config = await get_user_config(db, config_id)
     if config:
+        if config.is_active:
+            await _adjust_active_configs(db, config.server_id, -1)
         config.is_active = False
-        db.commit()
-        db.refresh(config)
+        config.revoke_pending = False
+        # Ключи отозванного клиента больше не нужны: их сегменты удалит сборка мусора
+        config.segment_hashes = null()
+        config.config_content = None
+        config.telegram_file_id = config.telegram_file_etag = None
+        await db.commit()
+        await db.refresh(config)
     return config
 
-def extend_user_config(db: Session, config_id: int, additional_days: int):
-    """Продлевает конфиг на указанное количество дней"""
-    config = get_user_config(db, config_id)
+def _revocation_columns():
+    """Колонки, нужные для отзыва клиента на VPN сервере: (id, server_id, client_name)"""
+    return (
+        models.UserConfig.id,
+        models.UserConfig.server_id,
+        func.coalesce(models.UserConfig.client_name, models.UserConfig.config_name).label("client_name")
+    )
+
+async def _deactivate_configs(db: AsyncSession, config_ids):
+    """
+    Деактивирует конфиги одним UPDATE ... RETURNING и уменьшает счётчики серверов.
+    Конфиги помечаются revoke_pending: отметку снимает mark_configs_revoked после
+    успешного отзыва на сервере, иначе отзыв повторит сверочный проход.
+    Возвращает строки (id, server_id, client_name) деактивированных конфигов.
+    """
+    rows = (await db.execute(
+        update(models.UserConfig)
+        .where(models.UserConfig.id.in_(config_ids))
+        .values(is_active=False, revoke_pending=True, revoke_attempted_at=datetime.now(UTC))
+        .returning(*_revocation_columns())
+        .execution_options(synchronize_session=False)
+    )).all()
+    
+    for server_id, count in Counter(row.server_id for row in rows).items():
+        await _adjust_active_configs(db, server_id, -count)
+    await db.commit()
+    return rows
+
+async def claim_expired_configs(db: AsyncSession, batch_size: int = 500):
+    """Деактивирует пачку истекших конфигов (сверочный проход по всей таблице)"""
+    expired_ids = select(models.UserConfig.id).where(
+        models.UserConfig.is_active == True,
+        models.UserConfig.expires_at < datetime.now(UTC)
+    ).limit(batch_size).with_for_update(skip_locked=True).scalar_subquery()
+    return await _deactivate_configs(db, expired_ids)
+
+async def expire_configs(db: AsyncSession, config_ids: list[int]):
+    """
+    Деактивирует конфиги из списка, срок которых действительно истёк.
+    Конфиги, продлённые после постановки в расписание, остаются активными.
+    """
+    due_ids = select(models.UserConfig.id).where(
+        models.UserConfig.id.in_(config_ids),
+        models.UserConfig.is_active == True,
+        models.UserConfig.expires_at <= datetime.now(UTC)
+    ).with_for_update(skip_locked=True).scalar_subquery()
+    return await _deactivate_configs(db, due_ids)
+
+async def claim_pending_revocations(db: AsyncSession, retry_after_seconds: float, batch_size: int = 500):
+    """
+    Забирает пачку деактивированных конфигов, отзыв которых не подтвердился за
+    retry_after_seconds, и отмечает новую попытку: параллельный проход их не возьмёт.
+    Возвращает строки (id, server_id, client_name).
+    """
+    due_ids = select(models.UserConfig.id).where(
+        models.UserConfig.revoke_pending == True,
+        models.UserConfig.revoke_attempted_at < datetime.now(UTC) - timedelta(seconds=retry_after_seconds)
+    ).order_by(models.UserConfig.revoke_attempted_at).limit(batch_size).with_for_update(skip_locked=True).scalar_subquery()
+    rows = (await db.execute(
+        update(models.UserConfig)
+        .where(models.UserConfig.id.in_(due_ids))
+        .values(revoke_attempted_at=datetime.now(UTC))
+        .returning(*_revocation_columns())
+        .execution_options(synchronize_session=False)
+    )).all()
+    await db.commit()
+    return rows
+
+async def mark_configs_revoked(db: AsyncSession, config_ids: list[int]):
+    """
+    Снимает отметку revoke_pending с конфигов, клиенты которых отозваны на VPN сервере,
+    и забывает файлы конфигураций: сертификат и ключ отозванного клиента больше не нужны,
+    а их сегменты удалит delete_unreferenced_config_segments
+    """
+    if not config_ids:
+        return
+    await db.execute(
+        update(models.UserConfig)
+        .where(models.UserConfig.id.in_(config_ids))
+        .values(
+            revoke_pending=False,
+            # null(): SQL NULL, а не JSON null, иначе сборка мусора споткнётся о скаляр
+            segment_hashes=null(),
+            config_content=None,
+            telegram_file_id=None,
+            telegram_file_etag=None
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+async def get_config_expirations(db: AsyncSession, config_ids: list[int]):
+    """Текущие сроки активных конфигов из списка: строки (id, expires_at)"""
+    return (await db.execute(
+        select(models.UserConfig.id, models.UserConfig.expires_at).where(
+            models.UserConfig.id.in_(config_ids),
+            models.UserConfig.is_active == True,
+            models.UserConfig.expires_at != None
+        )
+    )).all()
+
+async def get_expiring_configs(db: AsyncSession, after: datetime | None, until: datetime):
+    """Активные конфиги со сроком в интервале (after, until]: строки (id, expires_at)"""
+    query = select(models.UserConfig.id, models.UserConfig.expires_at).where(
+        models.UserConfig.is_active == True,
+        models.UserConfig.expires_at <= until
+    )
+    if after is not None:
+        query = query.where(models.UserConfig.expires_at > after)
+    return (await db.execute(query)).all()
+
+async def extend_user_config(db: AsyncSession, config_id: int, additional_days: int, commit: bool = True):
+    """
+    Продлевает активный конфиг на указанное количество дней.
+    Возвращает None, если конфига нет или он уже истёк: его клиент отозван
+    (или вот-вот будет отозван) на VPN сервере, и продлевать там нечего.
+    Проверка и продление - один UPDATE, поэтому гонки с планировщиком истечения нет.
+    Активность конфига не меняется, поэтому счётчик сервера тоже остаётся прежним.
+    """
+    now = datetime.now(UTC)
+    config = await db.scalar(
+        update(models.UserConfig)
+        .where(
+            models.UserConfig.id == config_id,
+            models.UserConfig.is_active == True,
+            (models.UserConfig.expires_at == None) | (models.UserConfig.expires_at > now)
+        )
+        .values(expires_at=func.coalesce(models.UserConfig.expires_at, now) + timedelta(days=additional_days))
+        .returning(models.UserConfig)
+        .execution_options(populate_existing=True)
+    )
     if config:
-        if config.expires_at:
-            config.expires_at += timedelta(days=additional_days)
-        else:
-            config.expires_at = datetime.now(UTC) + timedelta(days=additional_days)
-        db.commit()
-        db.refresh(config)
+        await _publish_expiry(db, config.id, config.expires_at)
+        if commit:
+            await db.commit()
     return config
 
+# Advisory lock хранилища сегментов: запись сегментов берёт его разделяемым до конца
+# транзакции, сборка мусора - исключительным
+CONFIG_SEGMENTS_LOCK = lock_key("config_segments")
+
+async def store_config_content(db: AsyncSession, content: str):
+    """
+    Сохраняет сегменты файла конфигурации, которых ещё нет в хранилище,
+    и возвращает список их хэшей. Коммит остаётся за вызывающим.
+    """
+    # Пока транзакция не записала ссылающийся конфиг, сборка мусора не удалит его сегменты
+    await db.execute(select(func.pg_advisory_xact_lock_shared(CONFIG_SEGMENTS_LOCK)))
+    segments = config_store.split_config(content)
+    hashes = [config_store.segment_hash(segment) for segment in segments]
+    unique_segments = dict(zip(hashes, segments))
+    if unique_segments:
+        await db.execute(
+            insert(models.ConfigSegment)
+            .values([{"hash": h, "content": segment} for h, segment in unique_segments.items()])
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+    return hashes
+
+def _referenced_segment_hashes(model):
+    return select(func.json_array_elements_text(model.segment_hashes).label("hash")).where(
+        func.json_typeof(model.segment_hashes) == "array"
+    )
+
+async def delete_unreferenced_config_segments(db: AsyncSession):
+    """
+    Удаляет сегменты, на которые не ссылаются ни конфиги пользователей, ни пул готовых
+    конфигураций (в основном сертификаты и ключи отозванных клиентов).
+    Возвращает число удалённых сегментов.
+    """
+    # Исключительная блокировка дожидается транзакций, сохраняющих сегменты прямо сейчас
+    await db.execute(select(func.pg_advisory_xact_lock(CONFIG_SEGMENTS_LOCK)))
+    referenced = union_all(
+        _referenced_segment_hashes(models.UserConfig),
+        _referenced_segment_hashes(models.PooledConfig)
+    ).subquery()
+    result = await db.execute(
+        delete(models.ConfigSegment)
+        .where(~exists().where(referenced.c.hash == models.ConfigSegment.hash))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def load_config_segments(db: AsyncSession, hashes):
+    """Возвращает сегменты файла конфигурации в порядке hashes"""
+    rows = await db.execute(
+        select(models.ConfigSegment.hash, models.ConfigSegment.content)
+        .where(models.ConfigSegment.hash.in_(set(hashes)))
+    )
+    segments = dict(rows.all())
+    return [segments[h] for h in hashes]
+
+async def get_config_segments(db: AsyncSession, config):
+    """Возвращает файл конфигурации сегментами (для потоковой отдачи)"""
+    if config.segment_hashes is not None:
+        return await load_config_segments(db, config.segment_hashes)
+    # Старая запись: содержимое лежит целиком в отложенной колонке
+    content = await db.scalar(
+        select(models.UserConfig.config_content).where(models.UserConfig.id == config.id)
+    )
+    return [content] if content else []
+
+async def get_config_content(db: AsyncSession, config):
+    """Возвращает содержимое файла конфигурации"""
+    return config_store.join_segments(await get_config_segments(db, config))
+
+async def set_config_telegram_file(db: AsyncSession, config_id: int, file_id: str | None, etag: str | None):
+    """Запоминает file_id отправленного в Telegram файла (None - забыть)"""
+    await db.execute(
+        update(models.UserConfig)
+        .where(models.UserConfig.id == config_id)
+        .values(telegram_file_id=file_id, telegram_file_etag=etag)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
 # Purchase CRUD operations
-def create_purchase(db: Session, user_id: int, config_id: int, amount: float, 
-                   duration_days: int, purchase_type: str = "new"):
+async def create_purchase(db: AsyncSession, user_id: int, config_id: int, amount: float,
+                          duration_days: int, purchase_type: str = "new"):
     db_purchase = models.Purchase(
         user_id=user_id,
         config_id=config_id,
@@ -200,80 +615,446 @@ def create_purchase(db: Session, user_id: int, config_id: int, amount: float,
         purchase_type=purchase_type
     )
     db.add(db_purchase)
-    db.commit()
-    db.refresh(db_purchase)
+    await db.commit()
+    await db.refresh(db_purchase)
     return db_purchase
 
-def get_user_purchases(db: Session, user_id: int):
-    return db.query(models.Purchase).filter(models.Purchase.user_id == user_id).all()
+async def get_user_purchases(db: AsyncSession, user_id: int):
+    return (await db.scalars(select(models.Purchase).where(models.Purchase.user_id == user_id))).all()
 
-def get_config_purchases(db: Session, config_id: int):
-    return db.query(models.Purchase).filter(models.Purchase.config_id == config_id).all()
+async def get_config_purchases(db: AsyncSession, config_id: int):
+    return (await db.scalars(select(models.Purchase).where(models.Purchase.config_id == config_id))).all()
 
-def get_purchase(db: Session, purchase_id: int):
-    return db.query(models.Purchase).filter(models.Purchase.id == purchase_id).first()
+async def list_purchases(db: AsyncSession, cursor: str | None = None, limit: int = 100,
+                         user_id: int | None = None, config_id: int | None = None):
+    """Страница покупок, новые первыми. Возвращает (покупки, курсор следующей страницы)"""
+    columns = [models.Purchase.created_at, models.Purchase.id]
+    query = select(models.Purchase)
+    if user_id is not None:
+        query = query.where(models.Purchase.user_id == user_id)
+    if config_id is not None:
+        query = query.where(models.Purchase.config_id == config_id)
+    purchases = await db.scalars(pagination.apply_cursor(query, columns, cursor, limit))
+    return pagination.page(columns, purchases.all(), limit)
+
+async def get_purchase(db: AsyncSession, purchase_id: int):
+    return await db.scalar(select(models.Purchase).where(models.Purchase.id == purchase_id).limit(1))
 
 # Комбинированные операции
-def buy_new_config(db: Session, user_id: int, server_id: int, protocol_id: int, 
-                  config_name: str, config_content: str, amount: float, duration_days: int):
-    """Покупка нового конфига"""
+async def buy_new_config(db: AsyncSession, user_id: int, server_id: int, protocol_id: int,
+                         config_name: str, config_content: str, amount: float, duration_days: int):
+    """Покупка нового конфига (без config_content конфиг берётся из пула готовых)"""
     # Создаем конфиг
-    config = create_user_config(db, user_id, server_id, protocol_id, 
-                               config_name, config_content, duration_days)
-    
+    if config_content is None:
+        config = await create_user_config_from_pool(db, user_id, server_id, protocol_id,
+                                                    config_name, duration_days)
+        if not config:
+            raise ValueError("Нет готовых конфигураций для выбранного сервера, попробуйте позже")
+    else:
+        config = await create_user_config(db, user_id, server_id, protocol_id,
+                                          config_name, config_content, duration_days)
+
     # Создаем запись о покупке
-    purchase = create_purchase(db, user_id, config.id, amount, duration_days, "new")
-    
+    purchase = await create_purchase(db, user_id, config.id, amount, duration_days, "new")
+
     return config, purchase
 
-def renew_config(db: Session, config_id: int, user_id: int, amount: float, duration_days: int):
-    """Продление существующего конфига"""
+async def renew_config(db: AsyncSession, config_id: int, user_id: int, amount: float, duration_days: int):
+    """Продление существующего конфига: продление и покупка записываются одной транзакцией"""
     # Продлеваем конфиг
-    config = extend_user_config(db, config_id, duration_days)
-    
+    config = await extend_user_config(db, config_id, duration_days, commit=False)
+    if not config:
+        raise ValueError("Конфигурация не найдена или уже истекла, продление невозможно")
+
     # Создаем запись о покупке
-    purchase = create_purchase(db, user_id, config_id, amount, duration_days, "renewal")
-    
-    return config, purchase 
+    purchase = await create_purchase(db, user_id, config_id, amount, duration_days, "renewal")
+
+    return config, purchase
 
 # Notification CRUD operations
-def create_notification_log(db: Session, config_id: int, user_id: int, notification_type: str, expires_at: datetime):
-    """Создает запись об отправленном уведомлении"""
-    notification = models.NotificationLog(
-        config_id=config_id,
-        user_id=user_id,
-        notification_type=notification_type,
-        expires_at=expires_at
+def _expiration_notice_query():
+    """Выборка только тех полей, которые нужны для текста уведомления об истечении"""
+    return (
+        select(
+            models.UserConfig.id.label("config_id"),
+            models.UserConfig.user_id,
+            models.User.tgId.label("tg_id"),
+            models.UserConfig.config_name,
+            models.UserConfig.expires_at,
+            models.Server.country.label("server_country"),
+            models.Protocol.name.label("protocol_name")
+        )
+        .join(models.User, models.User.id == models.UserConfig.user_id)
+        .outerjoin(models.Server, models.Server.id == models.UserConfig.server_id)
+        .outerjoin(models.Protocol, models.Protocol.id == models.UserConfig.protocol_id)
     )
-    db.add(notification)
-    db.commit()
-    db.refresh(notification)
-    return notification
-
-def get_notification_log(db: Session, config_id: int, notification_type: str):
-    """Получает запись об уведомлении для конкретного конфига и типа"""
-    return db.query(models.NotificationLog).filter(
-        models.NotificationLog.config_id == config_id,
-        models.NotificationLog.notification_type == notification_type
-    ).first()
-
-def get_configs_expiring_soon(db: Session, hours_before: int = 24):
-    """Получает конфиги, которые истекают через указанное количество часов"""
-    from datetime import timedelta
-    
+
+async def get_pending_expiration_notices(db: AsyncSession, hours_before: int = 24,
+                                         after_config_id: int = 0, limit: int = 500):
+    """
+    Получает одним запросом конфиги, истекающие в ближайшие hours_before часов,
+    по которым ещё не отправлялось уведомление. Страницы идут по возрастанию id конфига.
+    """
     current_time = datetime.now(UTC)
     target_time = current_time + timedelta(hours=hours_before)
     
-    # Получаем конфиги, которые истекают в указанном временном окне
-    configs = db.query(models.UserConfig).filter(
-        models.UserConfig.is_active == True,
-        models.UserConfig.expires_at >= current_time,
-        models.UserConfig.expires_at <= target_time
-    ).all()
-    
-    return configs
+    already_sent = exists().where(
+        models.NotificationLog.config_id == models.UserConfig.id,
+        models.NotificationLog.notification_type == "expiration_warning"
+    )
+    rows = (await db.execute(
+        _expiration_notice_query()
+        .where(
+            models.UserConfig.id > after_config_id,
+            models.UserConfig.is_active == True,
+            models.UserConfig.expires_at >= current_time,
+            models.UserConfig.expires_at <= target_time,
+            ~already_sent
+        )
+        .order_by(models.UserConfig.id)
+        .limit(limit)
+    )).all()
+    return rows
+
+async def get_expiration_notice(db: AsyncSession, config_id: int):
+    """Получает данные для уведомления об истечении конкретного конфига"""
+    return (await db.execute(
+        _expiration_notice_query().where(models.UserConfig.id == config_id)
+    )).first()
+
+async def create_notification_logs(db: AsyncSession, notices, notification_type: str, commit: bool = True):
+    """
+    Записывает журнал уведомлений одним INSERT; повторы игнорируются.
+    Возвращает config_id, для которых запись появилась впервые.
+    """
+    if not notices:
+        return set()
+    config_ids = (await db.scalars(
+        insert(models.NotificationLog)
+        .values([
+            {
+                "config_id": notice.config_id,
+                "user_id": notice.user_id,
+                "notification_type": notification_type,
+                "expires_at": notice.expires_at,
+                "sent_at": datetime.now(UTC)
+            }
+            for notice in notices
+        ])
+        .on_conflict_do_nothing(index_elements=["config_id", "notification_type"])
+        .returning(models.NotificationLog.config_id)
+    )).all()
+    if commit:
+        await db.commit()
+    return set(config_ids)
+
+async def list_notification_logs(db: AsyncSession, cursor: str | None = None, limit: int = 100,
+                                 config_id: int | None = None, user_id: int | None = None,
+                                 notification_type: str | None = None):
+    """Страница журнала уведомлений, новые первыми. Возвращает (записи, курсор следующей страницы)"""
+    columns = [models.NotificationLog.id]
+    query = select(models.NotificationLog)
+    if config_id is not None:
+        query = query.where(models.NotificationLog.config_id == config_id)
+    if user_id is not None:
+        query = query.where(models.NotificationLog.user_id == user_id)
+    if notification_type is not None:
+        query = query.where(models.NotificationLog.notification_type == notification_type)
+    logs = await db.scalars(pagination.apply_cursor(query, columns, cursor, limit))
+    return pagination.page(columns, logs.all(), limit)
 
-def has_expiration_notification_sent(db: Session, config_id: int):
-    """Проверяет, было ли уже отправлено уведомление об истечении для данного конфига"""
-    notification = get_notification_log(db, config_id, "expiration_warning")
-    return notification is not None 
\ No newline at end of file
+# ProvisioningJob CRUD operations
+# Канал, по которому API и воркеры сообщают друг другу о новых и завершённых задачах
+JOBS_CHANNEL = "bcpy_provisioning_jobs"
+
+async def _publish_job_event(db: AsyncSession, event: str, job_id: int):
+    """event: "new" или "finished"; NOTIFY доставляется после коммита"""
+    await db.execute(select(func.pg_notify(JOBS_CHANNEL, f"{event}:{job_id}")))
+
+async def create_provisioning_job(db: AsyncSession, user_id: int, server_id: int, protocol_id: int,
+                                  config_name: str, duration_days: int):
+    """
+    Ставит в очередь задачу на создание VPN конфигурации.
+    Если в пуле есть готовая конфигурация, задача сразу создаётся выполненной.
+    Место на сервере должно быть занято placement.reserve_server в этой же транзакции:
+    созданный конфиг его использует, а провал задачи освобождает.
+    """
+    job = models.ProvisioningJob(
+        user_id=user_id,
+        server_id=server_id,
+        protocol_id=protocol_id,
+        config_name=config_name,
+        duration_days=duration_days,
+        status="pending"
+    )
+    # Выдача из пула и запись задачи фиксируются одной транзакцией
+    config = await create_user_config_from_pool(db, user_id, server_id, protocol_id,
+                                                config_name, duration_days, commit=False, reserved=True)
+    if config:
+        job.status = "done"
+        job.config_id = config.id
+        job.started_at = job.finished_at = datetime.now(UTC)
+    db.add(job)
+    await db.flush()
+    if job.status == "pending":
+        await _publish_job_event(db, "new", job.id)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+async def get_provisioning_job(db: AsyncSession, job_id: int):
+    # populate_existing: задачу обновляет воркер, поэтому при повторном чтении
+    # в той же сессии нужны свежие значения, а не закэшированный объект
+    return await db.scalar(
+        select(models.ProvisioningJob)
+        .options(joinedload(models.ProvisioningJob.config).joinedload(models.UserConfig.server))
+        .where(models.ProvisioningJob.id == job_id)
+        .limit(1)
+        .execution_options(populate_existing=True)
+    )
+
+async def claim_next_provisioning_job(db: AsyncSession):
+    """Забирает самую старую ожидающую задачу, пропуская занятые другими воркерами"""
+    job = await db.scalar(
+        select(models.ProvisioningJob)
+        .where(models.ProvisioningJob.status == "pending")
+        .order_by(models.ProvisioningJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if job:
+        job.status = "running"
+        job.started_at = datetime.now(UTC)
+        await db.commit()
+        await db.refresh(job)
+    return job
+
+async def finish_provisioning_job(db: AsyncSession, job_id: int, config_id: int):
+    job = await db.get(models.ProvisioningJob, job_id)
+    if job:
+        job.status = "done"
+        job.config_id = config_id
+        job.finished_at = datetime.now(UTC)
+        await _publish_job_event(db, "finished", job_id)
+        await db.commit()
+        await db.refresh(job)
+    return job
+
+async def fail_provisioning_job(db: AsyncSession, job_id: int, error: str):
+    """Помечает задачу проваленной и освобождает занятое ею место на сервере"""
+    job = await db.get(models.ProvisioningJob, job_id)
+    if job:
+        if job.status in ("pending", "running"):
+            await _adjust_active_configs(db, job.server_id, -1)
+        job.status = "failed"
+        job.error = error
+        job.finished_at = datetime.now(UTC)
+        await _publish_job_event(db, "finished", job_id)
+        await db.commit()
+        await db.refresh(job)
+    return job
+
+async def fail_stale_provisioning_jobs(db: AsyncSession, older_than_minutes: int = 30):
+    """Помечает зависшие задачи (воркер упал посреди выполнения) как проваленные и освобождает их места"""
+    threshold = datetime.now(UTC) - timedelta(minutes=older_than_minutes)
+    server_ids = (await db.scalars(
+        update(models.ProvisioningJob)
+        .where(
+            models.ProvisioningJob.status == "running",
+            models.ProvisioningJob.started_at < threshold
+        )
+        .values(
+            status="failed",
+            error="Задача прервана: воркер остановился во время выполнения",
+            finished_at=datetime.now(UTC)
+        )
+        .returning(models.ProvisioningJob.server_id)
+        .execution_options(synchronize_session=False)
+    )).all()
+    for server_id, count in Counter(server_ids).items():
+        await _adjust_active_configs(db, server_id, -count)
+    await db.commit()
+    return len(server_ids)
+
+# PooledConfig CRUD operations
+async def add_pooled_config(db: AsyncSession, server_id: int, client_name: str, config_content: str):
+    pooled = models.PooledConfig(
+        server_id=server_id,
+        client_name=client_name,
+        segment_hashes=await store_config_content(db, config_content)
+    )
+    db.add(pooled)
+    await db.commit()
+    await db.refresh(pooled)
+    return pooled
+
+async def get_pooled_config_counts(db: AsyncSession):
+    """Возвращает число готовых конфигураций по серверам: {server_id: count}"""
+    rows = (await db.execute(
+        select(models.PooledConfig.server_id, func.count(models.PooledConfig.id))
+        .group_by(models.PooledConfig.server_id)
+    )).all()
+    return {server_id: count for server_id, count in rows}
+
+async def get_recent_config_counts(db: AsyncSession, since: datetime):
+    """Возвращает число конфигураций, выданных с момента since, по серверам: {server_id: count}"""
+    rows = (await db.execute(
+        select(models.UserConfig.server_id, func.count(models.UserConfig.id))
+        .where(models.UserConfig.created_at >= since)
+        .group_by(models.UserConfig.server_id)
+    )).all()
+    return {server_id: count for server_id, count in rows}
+
+# OutboxMessage CRUD operations
+# Канал, по которому отправитель узнаёт о новых сообщениях в outbox
+OUTBOX_CHANNEL = "bcpy_outbox"
+
+async def enqueue_outbox_messages(db: AsyncSession, messages: list[dict]):
+    """
+    Добавляет сообщения в outbox без коммита: они фиксируются в транзакции
+    вызывающего кода вместе с бизнес-изменением. Каждый элемент - словарь
+    с chat_id, method, payload и необязательным dedup_key.
+    Возвращает id добавленных сообщений (повторы по dedup_key пропускаются).
+    """
+    if not messages:
+        return []
+    ids = (await db.scalars(
+        insert(models.OutboxMessage)
+        .values([
+            {
+                "chat_id": message["chat_id"],
+                "method": message["method"],
+                "payload": message["payload"],
+                "dedup_key": message.get("dedup_key"),
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": datetime.now(UTC),
+                "created_at": datetime.now(UTC)
+            }
+            for message in messages
+        ])
+        .on_conflict_do_nothing(index_elements=["dedup_key"])
+        .returning(models.OutboxMessage.id)
+    )).all()
+    if ids:
+        # NOTIFY доставляется после коммита, т.е. только если бизнес-изменение зафиксировано
+        await db.execute(select(func.pg_notify(OUTBOX_CHANNEL, "")))
+    return ids
+
+async def enqueue_outbox_message(db: AsyncSession, chat_id: int, method: str, payload: dict,
+                                 dedup_key: str | None = None):
+    ids = await enqueue_outbox_messages(
+        db, [{"chat_id": chat_id, "method": method, "payload": payload, "dedup_key": dedup_key}]
+    )
+    return ids[0] if ids else None
+
+async def claim_outbox_messages(db: AsyncSession, limit: int):
+    """
+    Забирает готовые к отправке сообщения, переводя их в "sending".
+    Занятые другой транзакцией строки пропускаются, поэтому каждое сообщение
+    достаётся ровно одному отправителю.
+    """
+    now = datetime.now(UTC)
+    ready_ids = select(models.OutboxMessage.id).where(
+        models.OutboxMessage.status == "pending",
+        models.OutboxMessage.next_attempt_at <= now
+    ).order_by(models.OutboxMessage.next_attempt_at).limit(limit).with_for_update(skip_locked=True).scalar_subquery()
+    rows = (await db.execute(
+        update(models.OutboxMessage)
+        .where(models.OutboxMessage.id.in_(ready_ids))
+        .values(status="sending", claimed_at=now)
+        .returning(
+            models.OutboxMessage.id,
+            models.OutboxMessage.chat_id,
+            models.OutboxMessage.method,
+            models.OutboxMessage.payload,
+            models.OutboxMessage.attempts,
+            models.OutboxMessage.claimed_at
+        )
+        .execution_options(synchronize_session=False)
+    )).all()
+    await db.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+async def touch_outbox_message(db: AsyncSession, message_id: int, claimed_at: datetime):
+    """
+    Продлевает захват сообщения перед отправкой. claimed_at - отметка, полученная
+    при захвате; если сообщение уже вернули в очередь как зависшее (его мог забрать
+    другой отправитель), возвращает None и отправлять его нельзя.
+    Иначе возвращает новую отметку захвата.
+    """
+    claimed_at = await db.scalar(
+        update(models.OutboxMessage)
+        .where(
+            models.OutboxMessage.id == message_id,
+            models.OutboxMessage.status == "sending",
+            models.OutboxMessage.claimed_at == claimed_at
+        )
+        .values(claimed_at=datetime.now(UTC))
+        .returning(models.OutboxMessage.claimed_at)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return claimed_at
+
+async def _finish_outbox_message(db: AsyncSession, message_id: int, claimed_at: datetime, values: dict):
+    # Результат записывается, только если сообщение всё ещё захвачено этим отправителем.
+    # values - словарём, а не **kwargs: среди них бывает и сам claimed_at
+    await db.execute(
+        update(models.OutboxMessage)
+        .where(
+            models.OutboxMessage.id == message_id,
+            models.OutboxMessage.status == "sending",
+            models.OutboxMessage.claimed_at == claimed_at
+        )
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+async def mark_outbox_message_sent(db: AsyncSession, message_id: int, claimed_at: datetime):
+    await _finish_outbox_message(db, message_id, claimed_at, {
+        "status": "sent",
+        "sent_at": datetime.now(UTC),
+        "last_error": None
+    })
+
+async def reschedule_outbox_message(db: AsyncSession, message_id: int, claimed_at: datetime,
+                                    delay_seconds: float, error: str, count_attempt: bool = True):
+    """Возвращает сообщение в очередь через delay_seconds; retry_after от Telegram попыткой не считается"""
+    await _finish_outbox_message(db, message_id, claimed_at, {
+        "status": "pending",
+        "attempts": models.OutboxMessage.attempts + (1 if count_attempt else 0),
+        "next_attempt_at": datetime.now(UTC) + timedelta(seconds=delay_seconds),
+        "claimed_at": None,
+        "last_error": error
+    })
+
+async def fail_outbox_message(db: AsyncSession, message_id: int, claimed_at: datetime, error: str):
+    await _finish_outbox_message(db, message_id, claimed_at, {
+        "status": "failed",
+        "attempts": models.OutboxMessage.attempts + 1,
+        "last_error": error
+    })
+
+async def release_stale_outbox_messages(db: AsyncSession, older_than_seconds: float):
+    """Возвращает в очередь сообщения, отправитель которых остановился во время отправки"""
+    threshold = datetime.now(UTC) - timedelta(seconds=older_than_seconds)
+    result = await db.execute(
+        update(models.OutboxMessage)
+        .where(
+            models.OutboxMessage.status == "sending",
+            models.OutboxMessage.claimed_at < threshold
+        )
+        .values(status="pending", claimed_at=None, next_attempt_at=datetime.now(UTC))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def get_next_outbox_attempt(db: AsyncSession):
+    """Ближайшее время, когда ожидающее сообщение станет готово к отправке"""
+    return await db.scalar(
+        select(func.min(models.OutboxMessage.next_attempt_at))
+        .where(models.OutboxMessage.status == "pending")
+    )
@@ -1,5 +1,15 @@
+import asyncio
 import os
-from sqlalchemy import create_engine
+import random
+import re
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime
+from greenlet import getcurrent
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -17,9 +27,37 @@ DATABASE_URL = (
     f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 )
 
+ASYNC_DATABASE_URL = (
+    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+# Запросы дольше порога (мс) попадают в журнал медленных запросов; 0 отключает журнал
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "250"))
+# Доля медленных запросов, для которых дополнительно снимается план выполнения
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.1"))
+# Сколько последних медленных запросов хранится в памяти
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+# Записывать в журнал значения параметров (SSH пароли, данные пользователей) - только для отладки;
+# по умолчанию вместо значений пишутся их типы
+SLOW_QUERY_LOG_PARAMETERS = os.getenv("SLOW_QUERY_LOG_PARAMETERS", "0") == "1"
+
+# Синхронный движок остаётся для создания таблиц и миграций
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок для обработчиков и фоновых задач: ожидание БД не блокирует event loop
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True
+)
+# expire_on_commit=False: после commit атрибуты объектов остаются доступны без повторного запроса
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Зависимость для получения сессии БД
@@ -30,4 +68,186 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def listen(channel: str, callback, on_connect=None, heartbeat_interval: float = 30) -> None:
+    """
+    Держит отдельное соединение с LISTEN channel и вызывает callback(connection, pid, channel, payload).
+    on_connect() вызывается после каждого (пере)подключения: уведомления за время разрыва потеряны.
+    """
+    while True:
+        try:
+            async with async_engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.add_listener(channel, callback)
+                if on_connect is not None:
+                    on_connect()
+                while True:
+                    await asyncio.sleep(heartbeat_interval)
+                    await conn.execute(text("SELECT 1"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка в подписке на канал {channel}: {str(e)}")
+            await asyncio.sleep(5)
+
+class QueryCounter:
+    """Счётчик SQL запросов, выполненных внутри count_queries()"""
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+@asynccontextmanager
+async def count_queries(db):
+    """
+    Считает запросы к БД, выполненные сессией db внутри блока (для тестов и бенчмарков на N+1).
+    Слушается только соединение этой сессии, поэтому запросы фоновых задач и других
+    сессий в счёт не попадают. После commit сессия берёт новое соединение - оно тоже слушается.
+    """
+    counter = QueryCounter()
+    connections = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.count += 1
+        counter.statements.append(statement)
+
+    def _watch(connection):
+        if not any(watched is connection for watched in connections):
+            event.listen(connection, "before_cursor_execute", _before_cursor_execute)
+            connections.append(connection)
+
+    def _after_begin(session, transaction, connection):
+        _watch(connection)
+
+    _watch((await db.connection()).sync_connection)
+    event.listen(db.sync_session, "after_begin", _after_begin)
+    try:
+        yield counter
+    finally:
+        event.remove(db.sync_session, "after_begin", _after_begin)
+        for connection in connections:
+            event.remove(connection, "before_cursor_execute", _before_cursor_execute)
+
+@asynccontextmanager
+async def assert_query_count(db, expected: int):
+    """Проверяет, что сессия db выполнила внутри блока ровно expected запросов к БД"""
+    async with count_queries(db) as counter:
+        yield counter
+    assert counter.count == expected, (
+        f"Ожидалось запросов: {expected}, выполнено: {counter.count}\n" + "\n".join(counter.statements)
+    )
+
+
+# Журнал медленных запросов: последние SLOW_QUERY_LOG_SIZE записей
+slow_queries: deque = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\(\s*\$\d+(?:\s*,\s*\$\d+)+\s*\)")
+
+def normalize_sql(statement: str) -> str:
+    """Приводит запрос к общему виду: литералы и списки параметров IN заменяются заглушками"""
+    normalized = _WHITESPACE.sub(" ", statement).strip()
+    normalized = _STRING_LITERAL.sub("?", normalized)
+    normalized = _PARAM_LIST.sub("(...)", normalized)
+    return _NUMBER_LITERAL.sub("?", normalized)
+
+def _short_parameters(parameters) -> list:
+    if parameters is None:
+        return []
+    values = parameters.values() if isinstance(parameters, dict) else parameters
+    if not SLOW_QUERY_LOG_PARAMETERS:
+        return [f"<{type(value).__name__}>" for value in values]
+    return [value if len(text := repr(value)) <= 80 else text[:77] + "..." for value in values]
+
+def _calling_crud_function() -> str | None:
+    """
+    Ищет в стеке функцию из src/crud.py, выполнившую запрос.
+    В асинхронном движке драйвер работает в дочернем greenlet, поэтому
+    стек корутин просматривается через кадр родительского greenlet.
+    """
+    frames = [sys._getframe(1)]
+    parent = getcurrent().parent
+    if parent is not None and parent.gr_frame is not None:
+        frames.append(parent.gr_frame)
+    for frame in frames:
+        while frame is not None:
+            code = frame.f_code
+            if os.path.basename(code.co_filename) == "crud.py":
+                return f"crud.{code.co_name}:{frame.f_lineno}"
+            frame = frame.f_back
+    return None
+
+# Функции, вызов которых не меняет состояния БД: запрос только с ними можно выполнить повторно
+_ANALYZE_SAFE_FUNCTIONS = {
+    "count", "sum", "min", "max", "avg", "coalesce", "nullif", "greatest", "least",
+    "lower", "upper", "length", "cast", "now", "date_trunc", "extract", "row_number",
+}
+# Ключевые слова, за которыми в SQL идёт скобка, но это не вызов функции
+_SQL_KEYWORDS_BEFORE_PAREN = {
+    "select", "from", "join", "on", "where", "and", "or", "not", "in", "exists", "any", "all",
+    "as", "over", "by", "having", "case", "when", "then", "else", "union", "lateral",
+}
+_FUNCTION_CALL = re.compile(r"\b([a-z_][a-z0-9_.]*)\s*\(")
+_LOCKING_CLAUSE = re.compile(r"\bfor\s+(update|no\s+key\s+update|share|key\s+share)\b")
+
+def _can_analyze(statement: str) -> bool:
+    """
+    EXPLAIN ANALYZE выполняет запрос ещё раз, поэтому разрешён только для простого чтения
+    таблиц: SELECT без блокировок и без функций с побочными эффектами (pg_try_advisory_lock,
+    pg_notify, nextval и т.п.) - вызывать можно только функции из _ANALYZE_SAFE_FUNCTIONS
+    """
+    lower = _STRING_LITERAL.sub("''", statement).strip().lower()
+    if not lower.startswith("select") or ";" in lower or _LOCKING_CLAUSE.search(lower):
+        return False
+    if re.search(r"\binto\b", lower):
+        return False
+    return all(
+        name in _ANALYZE_SAFE_FUNCTIONS or name in _SQL_KEYWORDS_BEFORE_PAREN
+        for name in _FUNCTION_CALL.findall(lower)
+    )
+
+async def _capture_plan(entry: dict, statement: str, parameters) -> None:
+    explain = "EXPLAIN (ANALYZE, BUFFERS) " if _can_analyze(statement) else "EXPLAIN "
+    try:
+        # Отдельное соединение: план снимается вне транзакции исходного запроса и откатывается
+        async with async_engine.connect() as conn:
+            result = await conn.exec_driver_sql(explain + statement, tuple(parameters or ()))
+            entry["plan"] = "\n".join(row[0] for row in result)
+    except Exception as e:
+        entry["plan"] = f"Не удалось получить план: {str(e)}"
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - conn.info["slow_query_start"].pop()) * 1000
+    if SLOW_QUERY_THRESHOLD_MS <= 0 or duration_ms < SLOW_QUERY_THRESHOLD_MS:
+        return
+    if statement.lstrip().upper().startswith("EXPLAIN"):
+        return
+
+    entry = {
+        "at": datetime.now(UTC),
+        "duration_ms": round(duration_ms, 2),
+        "sql": normalize_sql(statement),
+        "parameters": [] if executemany else _short_parameters(parameters),
+        "caller": _calling_crud_function(),
+        "plan": None,
+    }
+    slow_queries.append(entry)
+    print(f"🐢 Медленный запрос ({entry['duration_ms']} мс, {entry['caller']}): {entry['sql']} {entry['parameters']}")
+
+    if not executemany and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE:
+        asyncio.get_running_loop().create_task(_capture_plan(entry, statement, parameters))
 
+@event.listens_for(async_engine.sync_engine, "handle_error")
+def _drop_query_timer(exception_context):
+    starts = exception_context.connection.info.get("slow_query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
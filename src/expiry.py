@@ -0,0 +1,262 @@
+import asyncio
+import heapq
+import os
+import time
+from collections import defaultdict
+from datetime import UTC, datetime
+from . import crud, metrics, ovpn, placement
+from .database import AsyncSessionLocal, listen
+
+# Сколько истекших конфигов деактивируется одним UPDATE
+EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", "500"))
+# На сколько часов вперёд сроки конфигов держатся в памяти планировщика
+EXPIRY_HORIZON_HOURS = float(os.getenv("EXPIRY_HORIZON_HOURS", "6"))
+# Период сверочного прохода по таблице: ловит то, что планировщик пропустил
+EXPIRY_RECONCILE_INTERVAL = float(os.getenv("EXPIRY_RECONCILE_INTERVAL", str(6 * 3600)))
+# Через сколько секунд повторить истечение пачки, если обработка упала (например, БД недоступна)
+EXPIRY_RETRY_DELAY = float(os.getenv("EXPIRY_RETRY_DELAY", "5"))
+# Через сколько секунд повторять отзыв клиента, который не удалось удалить на VPN сервере
+EXPIRY_REVOKE_RETRY_INTERVAL = float(os.getenv("EXPIRY_REVOKE_RETRY_INTERVAL", "600"))
+
+def _revoke_on_servers(rows, servers) -> list[int]:
+    """Отзывает клиентов на VPN серверах: одна SSH сессия на сервер. Возвращает ID отозванных конфигов"""
+    by_server = defaultdict(list)
+    for row in rows:
+        by_server[row.server_id].append(row)
+
+    revoked = []
+    for server_id, server_rows in by_server.items():
+        try:
+            results = ovpn.revoke_openvpn_users(
+                [row.client_name for row in server_rows],
+                **placement.ssh_params(servers.get(server_id))
+            )
+            revoked.extend(row.id for row in server_rows if results.get(row.client_name))
+            failed = [name for name, ok in results.items() if not ok]
+            if failed:
+                print(f"Не удалось отозвать на сервере {server_id} клиентов (будет повтор): {failed}")
+        except Exception as e:
+            print(f"Ошибка при отзыве клиентов на сервере {server_id} (будет повтор): {str(e)}")
+    return revoked
+
+async def _revoke(rows, servers) -> int:
+    """Отзывает клиентов и снимает revoke_pending с успешно отозванных; неудачные повторит сверочный проход"""
+    revoked = await asyncio.to_thread(_revoke_on_servers, rows, servers)
+    async with AsyncSessionLocal() as db:
+        await crud.mark_configs_revoked(db, revoked)
+    return len(revoked)
+
+async def _get_servers(db, rows) -> dict:
+    servers = {}
+    for server_id in {row.server_id for row in rows}:
+        servers[server_id] = await crud.get_server(db, server_id)
+    return servers
+
+async def _sweep_batch() -> int:
+    async with AsyncSessionLocal() as db:
+        rows = await crud.claim_expired_configs(db, EXPIRY_SWEEP_BATCH_SIZE)
+        servers = await _get_servers(db, rows)
+    if rows:
+        await _revoke(rows, servers)
+        print(f"Деактивировано истекших конфигов: {len(rows)}")
+    return len(rows)
+
+async def sweep_expired_configs() -> int:
+    """Деактивирует все истекшие конфиги пачками и отзывает их на серверах"""
+    total = 0
+    while True:
+        count = await _sweep_batch()
+        total += count
+        if count < EXPIRY_SWEEP_BATCH_SIZE:
+            return total
+
+async def retry_pending_revocations() -> int:
+    """Повторяет отзыв клиентов, не удавшийся при деактивации. Возвращает число отозванных"""
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = await crud.claim_pending_revocations(db, EXPIRY_REVOKE_RETRY_INTERVAL, EXPIRY_SWEEP_BATCH_SIZE)
+            servers = await _get_servers(db, rows)
+        if rows:
+            revoked = await _revoke(rows, servers)
+            total += revoked
+            print(f"Повторный отзыв клиентов: отозвано {revoked} из {len(rows)}")
+        if len(rows) < EXPIRY_SWEEP_BATCH_SIZE:
+            return total
+
+async def run_reconciliation_sweep():
+    """
+    Редкий сверочный проход: деактивирует всё, что пропустил планировщик,
+    и удаляет сегменты конфигураций, на которые больше никто не ссылается.
+    Чаще, раз в EXPIRY_REVOKE_RETRY_INTERVAL, повторяет неудавшиеся отзывы на серверах.
+    """
+    next_sweep_at = 0.0
+    while True:
+        if time.monotonic() >= next_sweep_at:
+            next_sweep_at = time.monotonic() + EXPIRY_RECONCILE_INTERVAL
+            started = time.perf_counter()
+            try:
+                # Деактивируем истекшие конфиги пачками и отзываем их на VPN серверах
+                deactivated = await sweep_expired_configs()
+                metrics.observe_loop("cleanup_expired_configs", started, deactivated)
+            except Exception as e:
+                print(f"Ошибка при очистке истекших конфигов: {str(e)}")
+
+            started = time.perf_counter()
+            try:
+                # Сегменты отозванных клиентов (их сертификаты и ключи) больше ни на что не ссылаются
+                async with AsyncSessionLocal() as db:
+                    deleted = await crud.delete_unreferenced_config_segments(db)
+                metrics.observe_loop("config_segments_gc", started, deleted)
+                if deleted:
+                    print(f"Удалено неиспользуемых сегментов конфигураций: {deleted}")
+            except Exception as e:
+                print(f"Ошибка при удалении неиспользуемых сегментов конфигураций: {str(e)}")
+
+        started = time.perf_counter()
+        try:
+            revoked = await retry_pending_revocations()
+            metrics.observe_loop("retry_revocations", started, revoked)
+        except Exception as e:
+            print(f"Ошибка при повторном отзыве клиентов: {str(e)}")
+        # Точное истечение выполняет run_expiry_scheduler, здесь только сверка и повторы
+        await asyncio.sleep(min(EXPIRY_REVOKE_RETRY_INTERVAL, max(next_sweep_at - time.monotonic(), 0)))
+
+class ExpiryHeap:
+    def __init__(self):
+        """
+        Сроки действия конфигов на ближайший горизонт, упорядоченные кучей
+
+        Продление не удаляет старую запись из кучи: актуальный срок хранится
+        в словаре, а устаревшие записи отбрасываются при извлечении.
+        """
+        self._heap: list[tuple[float, int]] = []
+        self._deadlines: dict[int, float] = {}
+        # До какого момента (timestamp) сроки загружены из БД; None - ещё не загружены
+        self.loaded_until: float | None = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, config_id: int, deadline: float) -> bool:
+        """Ставит (или переносит) срок конфига. Сроки за горизонтом подгрузятся из БД позже"""
+        if self.loaded_until is None or deadline > self.loaded_until:
+            self._deadlines.pop(config_id, None)
+            return False
+        if self._deadlines.get(config_id) == deadline:
+            return False
+        self._deadlines[config_id] = deadline
+        heapq.heappush(self._heap, (deadline, config_id))
+        return True
+
+    def next_deadline(self) -> float | None:
+        while self._heap:
+            deadline, config_id = self._heap[0]
+            if self._deadlines.get(config_id) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: float, limit: int) -> list[int]:
+        """Извлекает до limit конфигов, срок которых наступил"""
+        due = []
+        while len(due) < limit and (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, config_id = heapq.heappop(self._heap)
+            del self._deadlines[config_id]
+            due.append(config_id)
+        return due
+
+    def reschedule(self, config_ids: list[int], deadline: float) -> None:
+        """Возвращает извлечённые конфиги в кучу, если их не удалось обработать"""
+        for config_id in config_ids:
+            # Новый срок из уведомления (например, продление) важнее повтора
+            if config_id not in self._deadlines:
+                self.schedule(config_id, deadline)
+
+    def reset(self) -> None:
+        self._heap.clear()
+        self._deadlines.clear()
+        self.loaded_until = None
+
+expiry_heap = ExpiryHeap()
+_wakeup = asyncio.Event()
+
+def _on_expiry_notification(connection, pid, channel, payload) -> None:
+    config_id, _, deadline = payload.partition(":")
+    if expiry_heap.schedule(int(config_id), float(deadline)):
+        _wakeup.set()
+
+def _reload_horizon() -> None:
+    # Пока соединения не было, уведомления могли потеряться: горизонт загрузится заново
+    expiry_heap.reset()
+    _wakeup.set()
+
+async def _extend_horizon(now: float) -> None:
+    """Догружает из БД сроки, попавшие в горизонт с прошлой загрузки"""
+    after = expiry_heap.loaded_until
+    until = now + EXPIRY_HORIZON_HOURS * 3600
+    # Горизонт сдвигается до запроса, чтобы уведомления во время загрузки не потерялись
+    expiry_heap.loaded_until = until
+    async with AsyncSessionLocal() as db:
+        rows = await crud.get_expiring_configs(
+            db,
+            datetime.fromtimestamp(after, UTC) if after is not None else None,
+            datetime.fromtimestamp(until, UTC)
+        )
+    for config_id, expires_at in rows:
+        expiry_heap.schedule(config_id, expires_at.timestamp())
+
+async def _expire_due(config_ids: list[int]) -> None:
+    async with AsyncSessionLocal() as db:
+        rows = await crud.expire_configs(db, config_ids)
+        servers = await _get_servers(db, rows)
+
+        # Продлённые за это время конфиги возвращаются в расписание с новым сроком
+        expired = {row.id for row in rows}
+        remaining = [config_id for config_id in config_ids if config_id not in expired]
+        if remaining:
+            # Строки, заблокированные другой транзакцией, пробуем снова через секунду
+            retry_at = time.time() + 1
+            for config_id, expires_at in await crud.get_config_expirations(db, remaining):
+                expiry_heap.schedule(config_id, max(expires_at.timestamp(), retry_at))
+    if rows:
+        await _revoke(rows, servers)
+        print(f"Деактивировано конфигов по расписанию: {len(rows)}")
+
+async def run_expiry_scheduler() -> None:
+    """Деактивирует конфиги точно в момент истечения по куче сроков"""
+    listener = asyncio.create_task(listen(crud.EXPIRY_CHANNEL, _on_expiry_notification, on_connect=_reload_horizon))
+    try:
+        while True:
+            try:
+                _wakeup.clear()
+                now = time.time()
+                refresh_at = (
+                    expiry_heap.loaded_until - EXPIRY_HORIZON_HOURS * 1800
+                    if expiry_heap.loaded_until is not None else now
+                )
+                if now >= refresh_at:
+                    await _extend_horizon(now)
+                    continue
+
+                due = expiry_heap.pop_due(now, EXPIRY_SWEEP_BATCH_SIZE)
+                if due:
+                    try:
+                        await _expire_due(due)
+                    except Exception:
+                        # pop_due уже убрал сроки из кучи: без возврата конфиги ждали бы сверочного прохода
+                        expiry_heap.reschedule(due, time.time() + EXPIRY_RETRY_DELAY)
+                        raise
+                    continue
+
+                next_deadline = expiry_heap.next_deadline()
+                wake_at = min(refresh_at, next_deadline) if next_deadline is not None else refresh_at
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=max(wake_at - now, 0))
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                print(f"Ошибка в планировщике истечения конфигов: {str(e)}")
+                await asyncio.sleep(5)
+    finally:
+        listener.cancel()
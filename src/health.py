@@ -0,0 +1,224 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import UTC, datetime
+from typing import Optional
+from . import crud, placement
+from .database import AsyncSessionLocal
+
+# Период опроса серверов в секундах
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+# Таймаут одной проверки (TCP подключение, чтение SSH баннера, ответ OpenVPN)
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+# Сколько проверок SSH подряд должно провалиться, чтобы сервер вывели из ротации
+HEALTH_FAIL_THRESHOLD = int(os.getenv("HEALTH_FAIL_THRESHOLD", "3"))
+# Сколько успешных проверок подряд нужно, чтобы вернуть сервер в ротацию
+HEALTH_RECOVER_THRESHOLD = int(os.getenv("HEALTH_RECOVER_THRESHOLD", "2"))
+# Сколько последних замеров задержки хранится для перцентилей
+HEALTH_LATENCY_WINDOW = int(os.getenv("HEALTH_LATENCY_WINDOW", "100"))
+
+# Пакет P_CONTROL_HARD_RESET_CLIENT_V2 с пустым ACK: с него клиент OpenVPN начинает сессию
+_OPENVPN_HARD_RESET = bytes([7 << 3]) + os.urandom(8) + b"\x00" + b"\x00" * 4
+
+class ServerHealth:
+    def __init__(self, server_id: int, up: bool = True):
+        """
+        Состояние здоровья одного сервера по результатам последних проверок
+
+        Args:
+            server_id: ID сервера
+            up: Состояние, с которого начинается учёт (последнее сохранённое в БД)
+        """
+        self.server_id = server_id
+        self.up = up
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.last_checked: Optional[datetime] = None
+        self.last_change: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.checks: dict[str, bool] = {}
+        self.openvpn: Optional[str] = None
+        self.openvpn_error: Optional[str] = None
+        self.latencies: dict[str, deque] = {}
+
+    def record(self, checks: dict[str, Optional[float]], errors: list[str],
+               openvpn: str, openvpn_error: Optional[str] = None) -> None:
+        """
+        Учитывает результат одного опроса: задержки проверок в мс или None при ошибке.
+        В ротацию сервер выводят только ошибки SSH (errors); проверка OpenVPN
+        (openvpn: "ok", "no_reply" или "error") лишь показывается в состоянии.
+        """
+        now = datetime.now(UTC)
+        self.last_checked = now
+        self.checks = {name: latency is not None for name, latency in checks.items()}
+        self.openvpn = openvpn
+        self.openvpn_error = openvpn_error
+        for name, latency in checks.items():
+            if latency is not None:
+                self.latencies.setdefault(name, deque(maxlen=HEALTH_LATENCY_WINDOW)).append(latency)
+
+        if errors:
+            self.last_error = "; ".join(errors)
+            self.consecutive_failures += 1
+            self.consecutive_successes = 0
+            if self.up and self.consecutive_failures >= HEALTH_FAIL_THRESHOLD:
+                self.up = False
+                self.last_change = now
+                print(f"⚠️ Сервер {self.server_id} выведен из ротации: {self.last_error}")
+        else:
+            self.last_error = None
+            self.consecutive_successes += 1
+            self.consecutive_failures = 0
+            if not self.up and self.consecutive_successes >= HEALTH_RECOVER_THRESHOLD:
+                self.up = True
+                self.last_change = now
+                print(f"✅ Сервер {self.server_id} возвращён в ротацию")
+
+    def snapshot(self) -> dict:
+        """Состояние для servers.health (только JSON-совместимые значения)"""
+        return {
+            "up": self.up,
+            "checks": self.checks,
+            "openvpn": self.openvpn,
+            "openvpn_error": self.openvpn_error,
+            "consecutive_failures": self.consecutive_failures,
+            "last_checked": self.last_checked.isoformat() if self.last_checked else None,
+            "last_change": self.last_change.isoformat() if self.last_change else None,
+            "last_error": self.last_error,
+            "latency_ms": {name: _percentiles(values) for name, values in self.latencies.items()},
+        }
+
+# Состояние серверов в процессе-лидере health_prober: {server_id: ServerHealth}.
+# Остальные процессы читают результат из servers.health_up / servers.health
+server_health: dict[int, ServerHealth] = {}
+
+def _percentiles(values) -> dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+async def _tcp_connect(host: str, port: int):
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), HEALTH_PROBE_TIMEOUT)
+    return reader, writer, (time.perf_counter() - started) * 1000
+
+async def _close(writer) -> None:
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+
+async def _probe_ssh(host: str, port: int) -> tuple[float, float]:
+    """Подключается к SSH порту и ждёт баннер сервера. Возвращает (TCP, SSH) задержки в мс"""
+    started = time.perf_counter()
+    reader, writer, tcp_latency = await _tcp_connect(host, port)
+    try:
+        banner = await asyncio.wait_for(reader.readline(), HEALTH_PROBE_TIMEOUT)
+    finally:
+        await _close(writer)
+    if not banner.startswith(b"SSH-"):
+        raise ConnectionError(f"неожиданный SSH баннер: {banner[:40]!r}")
+    return tcp_latency, (time.perf_counter() - started) * 1000
+
+class _UDPReply(asyncio.DatagramProtocol):
+    def __init__(self, loop):
+        self.reply = loop.create_future()
+
+    def datagram_received(self, data, addr) -> None:
+        if not self.reply.done():
+            self.reply.set_result(data)
+
+    def error_received(self, exc) -> None:
+        # ICMP port unreachable приходит сюда как ConnectionRefusedError
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+async def _probe_openvpn_udp(host: str, port: int) -> Optional[float]:
+    """
+    Отправляет OpenVPN hard reset и ждёт ответ. None - ответа нет: при tls-auth/tls-crypt
+    сервер молча отбрасывает пакет без HMAC, поэтому тишина не считается ошибкой
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: _UDPReply(loop), remote_addr=(host, port))
+    try:
+        transport.sendto(_OPENVPN_HARD_RESET)
+        try:
+            await asyncio.wait_for(protocol.reply, HEALTH_PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+    finally:
+        transport.close()
+    return (time.perf_counter() - started) * 1000
+
+async def _probe_openvpn_tcp(host: str, port: int) -> float:
+    """Проверяет, что порт OpenVPN принимает TCP подключения"""
+    _, writer, latency = await _tcp_connect(host, port)
+    await _close(writer)
+    return latency
+
+async def probe_server(server, up: bool = True) -> ServerHealth:
+    """Проверяет SSH и порт OpenVPN сервера (по его протоколу) и обновляет его состояние"""
+    ssh = placement.ssh_params(server)
+    checks: dict[str, Optional[float]] = {"tcp": None, "ssh": None}
+    errors = []
+
+    probe_openvpn = _probe_openvpn_tcp if server.openvpn_proto == "tcp" else _probe_openvpn_udp
+    ssh_result, openvpn_result = await asyncio.gather(
+        _probe_ssh(ssh["hostname"], ssh["port"]),
+        probe_openvpn(server.host, server.port),
+        return_exceptions=True
+    )
+    if isinstance(ssh_result, BaseException):
+        errors.append(f"ssh: {ssh_result!r}")
+    else:
+        checks["tcp"], checks["ssh"] = ssh_result
+
+    openvpn_error = None
+    if isinstance(openvpn_result, BaseException):
+        openvpn, openvpn_error = "error", repr(openvpn_result)
+    elif openvpn_result is None:
+        openvpn = "no_reply"
+    else:
+        openvpn = "ok"
+        checks["openvpn"] = openvpn_result
+
+    health = server_health.setdefault(server.id, ServerHealth(server.id, up))
+    health.record(checks, errors, openvpn, openvpn_error)
+    return health
+
+async def run_health_prober():
+    """
+    Периодически опрашивает все активные серверы параллельно и сохраняет
+    результат в servers. Работает в одном процессе (лидер health_prober)
+    """
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                servers = await crud.get_active_servers(db)
+                states = await crud.get_server_states(db)
+
+            # Серверы, которые больше не активны, не должны влиять на ротацию
+            active_ids = {server.id for server in servers}
+            for server_id in list(server_health):
+                if server_id not in active_ids:
+                    del server_health[server_id]
+
+            results = await asyncio.gather(*(
+                probe_server(server, states[server.id].health_up if server.id in states else True)
+                for server in servers
+            ))
+            async with AsyncSessionLocal() as db:
+                await crud.save_server_health(db, {
+                    health.server_id: (health.up, health.snapshot()) for health in results
+                })
+        except Exception as e:
+            print(f"Ошибка в цикле проверки серверов: {str(e)}")
+        await asyncio.sleep(HEALTH_PROBE_INTERVAL)
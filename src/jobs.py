@@ -0,0 +1,125 @@
+import asyncio
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+from . import crud, ovpn, placement
+from .database import AsyncSessionLocal, listen
+
+# Число одновременно выполняемых задач создания конфигураций
+PROVISIONING_WORKERS = int(os.getenv("PROVISIONING_WORKERS", "4"))
+# Как часто воркер заглядывает в очередь, если его не разбудили
+PROVISIONING_POLL_INTERVAL = float(os.getenv("PROVISIONING_POLL_INTERVAL", "5"))
+
+# Блокирующий paramiko выполняется в отдельных потоках,
+# чтобы не останавливать event loop FastAPI и бота
+_executor = ThreadPoolExecutor(max_workers=PROVISIONING_WORKERS, thread_name_prefix="provisioning")
+_wakeup: Optional[asyncio.Event] = None
+_finished: dict[int, asyncio.Event] = {}
+
+def _get_wakeup() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+def notify_new_job() -> None:
+    """Будит воркеры после постановки задачи в очередь"""
+    _get_wakeup().set()
+
+def _on_job_event(connection, pid, channel, payload) -> None:
+    event, _, job_id = payload.partition(":")
+    if event == "new":
+        notify_new_job()
+    elif event == "finished":
+        finished = _finished.get(int(job_id))
+        if finished:
+            finished.set()
+
+async def listen_for_job_events() -> None:
+    """
+    Доставляет события задач между процессами: воркеры просыпаются на новые задачи,
+    а ожидающие запросы API узнают о завершении задачи, выполненной другим процессом
+    """
+    await listen(crud.JOBS_CHANNEL, _on_job_event)
+
+async def _run_next_job() -> Optional[int]:
+    """Выполняет одну задачу из очереди. Возвращает её id или None, если очередь пуста"""
+    async with AsyncSessionLocal() as db:
+        job = await crud.claim_next_provisioning_job(db)
+        if not job:
+            return None
+        try:
+            # Создаем VPN конфигурацию на выбранном сервере через ovpn.py
+            server = await crud.get_server(db, job.server_id)
+            # Имя клиента на VPN сервере генерируется, а не берётся из config_name:
+            # пользовательская строка попадает в команду оболочки, а совпадение имён
+            # позволило бы отзыву одного пользователя отключить другого
+            client_name = f"user{job.user_id}_{uuid.uuid4().hex[:12]}"
+            config_content = await asyncio.get_running_loop().run_in_executor(_executor, partial(
+                ovpn.create_openvpn_user,
+                client_name=client_name,
+                **placement.ssh_params(server)
+            ))
+            
+            # Сохраняем конфигурацию в базе данных: место на сервере занято при создании задачи,
+            # конфиг и завершение задачи фиксируются одной транзакцией
+            config = await crud.create_user_config(
+                db,
+                user_id=job.user_id,
+                server_id=job.server_id,
+                protocol_id=job.protocol_id,
+                config_name=job.config_name,
+                config_content=config_content,
+                duration_days=job.duration_days,
+                client_name=client_name,
+                reserved=True,
+                commit=False
+            )
+            await crud.finish_provisioning_job(db, job.id, config.id)
+            print(f"Задача {job.id}: конфигурация {config.id} создана")
+        except Exception as e:
+            await db.rollback()
+            await crud.fail_provisioning_job(db, job.id, str(e))
+            print(f"Задача {job.id}: ошибка при создании VPN конфигурации: {str(e)}")
+        return job.id
+
+async def _worker() -> None:
+    wakeup = _get_wakeup()
+    while True:
+        try:
+            job_id = await _run_next_job()
+        except Exception as e:
+            print(f"Ошибка воркера создания конфигураций: {str(e)}")
+            job_id = None
+        if job_id is not None:
+            event = _finished.pop(job_id, None)
+            if event:
+                event.set()
+            continue
+        # Очередь пуста: ждём сигнала от эндпоинта или периодически проверяем
+        # очередь сами (задачу мог поставить другой процесс)
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=PROVISIONING_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_provisioning_workers() -> None:
+    """Запускает пул воркеров, выполняющих задачи создания конфигураций"""
+    async with AsyncSessionLocal() as db:
+        count = await crud.fail_stale_provisioning_jobs(db)
+    if count:
+        print(f"Помечено зависших задач создания конфигураций: {count}")
+    await asyncio.gather(*(_worker() for _ in range(PROVISIONING_WORKERS)))
+
+async def wait_for_job(job_id: int, timeout: float) -> None:
+    """Ждёт завершения задачи (в этом или другом процессе), но не дольше timeout секунд"""
+    event = _finished.setdefault(job_id, asyncio.Event())
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _finished.pop(job_id, None)
@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable
+from sqlalchemy import func, select, text
+from . import metrics
+from .database import async_engine
+
+# Как часто процесс без лидерства пробует захватить блокировку
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "10"))
+# Как часто лидер проверяет соединение, на котором держится блокировка
+LEADER_HEARTBEAT_INTERVAL = float(os.getenv("LEADER_HEARTBEAT_INTERVAL", "5"))
+
+def lock_key(name: str) -> int:
+    """Стабильный между процессами 64-битный ключ advisory lock для имени задачи"""
+    digest = hashlib.sha256(f"bcpy:{name}".encode()).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+async def run_as_leader(name: str, task_factory: Callable[[], Awaitable]) -> None:
+    """
+    Запускает task_factory() только в одном процессе среди всех воркеров и узлов.
+
+    Лидерство - это сессионный pg_try_advisory_lock на отдельном соединении.
+    Пока лидер жив, соединение проверяется heartbeat запросом; если оно
+    оборвалось, Postgres снимает блокировку и её забирает другой процесс,
+    а здесь задача останавливается.
+    """
+    key = lock_key(name)
+    while True:
+        try:
+            async with async_engine.connect() as conn:
+                acquired = await conn.scalar(select(func.pg_try_advisory_lock(key)))
+                # Блокировка сессионная и переживает конец транзакции
+                await conn.commit()
+                if acquired:
+                    await _lead(name, key, conn, task_factory)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка выбора лидера для {name}: {str(e)}")
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+
+async def _lead(name: str, key: int, conn, task_factory) -> None:
+    print(f"👑 Процесс {os.getpid()} стал лидером для {name}")
+    metrics.LEADER.labels(name).set(1)
+    task = asyncio.create_task(task_factory())
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=LEADER_HEARTBEAT_INTERVAL)
+            if done:
+                # Задача завершилась сама (обычно из-за ошибки): отдаём лидерство
+                if not task.cancelled() and task.exception():
+                    print(f"Задача {name} завершилась с ошибкой: {task.exception()!r}")
+                return
+            await conn.execute(text("SELECT 1"))
+            await conn.commit()
+    finally:
+        metrics.LEADER.labels(name).set(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        try:
+            await conn.execute(select(func.pg_advisory_unlock(key)))
+            await conn.commit()
+        except Exception:
+            # Соединение сломано: не возвращаем его в пул, блокировка снимется вместе с сессией
+            await conn.invalidate()
+        print(f"Процесс {os.getpid()} больше не лидер для {name}")
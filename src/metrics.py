@@ -0,0 +1,123 @@
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+
+REQUEST_LATENCY = Histogram(
+    "bcpy_http_request_duration_seconds",
+    "Время обработки HTTP запроса",
+    ["method", "route", "status"],
+)
+SSH_CONNECT_LATENCY = Histogram(
+    "bcpy_ssh_connect_duration_seconds",
+    "Время установки SSH соединения",
+    ["host"],
+)
+SSH_COMMAND_LATENCY = Histogram(
+    "bcpy_ssh_command_duration_seconds",
+    "Время выполнения команды по SSH",
+    ["host"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+SSH_ERRORS = Counter(
+    "bcpy_ssh_errors_total",
+    "Ошибки SSH подключений и команд",
+    ["host", "stage"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "bcpy_db_query_duration_seconds",
+    "Время выполнения SQL запроса",
+    ["operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+TELEGRAM_LATENCY = Histogram(
+    "bcpy_telegram_request_duration_seconds",
+    "Время вызова Telegram Bot API",
+    ["method"],
+)
+TELEGRAM_ERRORS = Counter(
+    "bcpy_telegram_errors_total",
+    "Ошибки вызовов Telegram Bot API",
+    ["method", "error"],
+)
+OUTBOX_MESSAGES = Counter(
+    "bcpy_outbox_messages_total",
+    "Результаты отправки сообщений из outbox",
+    ["method", "result"],
+)
+LOOP_DURATION = Histogram(
+    "bcpy_loop_iteration_duration_seconds",
+    "Время одной итерации фонового цикла",
+    ["loop"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+LOOP_ROWS = Counter(
+    "bcpy_loop_rows_processed_total",
+    "Сколько строк обработали фоновые циклы",
+    ["loop"],
+)
+CONFIG_POOL_DEPTH = Gauge(
+    "bcpy_config_pool_depth",
+    "Число готовых конфигураций в пуле сервера",
+    ["server_id"],
+)
+CONFIG_POOL_TARGET = Gauge(
+    "bcpy_config_pool_target",
+    "Целевая глубина пула готовых конфигураций сервера",
+    ["server_id"],
+)
+LEADER = Gauge(
+    "bcpy_leader",
+    "1, если процесс сейчас лидер для фоновой задачи",
+    ["task"],
+)
+
+# Известные операции SQL; всё остальное попадает в "other", чтобы не плодить метки
+_SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "BEGIN", "COMMIT", "ROLLBACK"}
+
+def render() -> tuple[bytes, str]:
+    """Текущие значения всех метрик в текстовом формате Prometheus"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    REQUEST_LATENCY.labels(method, route, str(status)).observe(seconds)
+
+def observe_loop(loop: str, started: float, rows: int) -> None:
+    """Учитывает итерацию фонового цикла, начатую в started (time.perf_counter())"""
+    LOOP_DURATION.labels(loop).observe(time.perf_counter() - started)
+    LOOP_ROWS.labels(loop).inc(rows)
+
+def _sql_operation(statement: str) -> str:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return operation if operation in _SQL_OPERATIONS else "other"
+
+def instrument_engine(engine) -> None:
+    """Считает число и длительность SQL запросов движка (для AsyncEngine передаётся sync_engine)"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_query_start"].pop()
+        DB_QUERY_LATENCY.labels(_sql_operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        starts = exception_context.connection.info.get("metrics_query_start") if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Замеряет время и ошибки каждого вызова Bot API (send_message, send_document и т.д.)"""
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_LATENCY.labels(name).observe(time.perf_counter() - started)
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Numeric
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Numeric, UniqueConstraint, JSON, Index, text
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime, UTC
 from .database import Base
 
@@ -11,7 +11,7 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     firstname = Column(String)
     free_trial_used = Column(Boolean, default=False)  # Использовал ли пользователь бесплатный пробный период
-    free_trial_expires_at = Column(DateTime, nullable=True)  # Дата истечения бесплатного пробного периода
+    free_trial_expires_at = Column(DateTime(timezone=True), nullable=True)  # Дата истечения бесплатного пробного периода
     
     # Связи с другими таблицами
     configs = relationship("UserConfig", back_populates="user")
@@ -26,7 +26,20 @@ class Server(Base):
     port = Column(Integer, nullable=False)
     country = Column(String)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    
+    # Доступ по SSH для adduser.sh/removeuser.sh (без ssh_username используются SSH_* из окружения)
+    ssh_username = Column(String, nullable=True)
+    ssh_password = Column(String, nullable=True)  # Зашифрован ключом SERVER_SECRET_KEY (src/secrets_store.py)
+    ssh_port = Column(Integer, default=22)
+    # Транспорт OpenVPN на port: "udp" (как в выдаваемых .ovpn) или "tcp"
+    openvpn_proto = Column(String, nullable=False, default="udp", server_default="udp")
+    capacity = Column(Integer, nullable=False, default=1000, server_default="1000")  # Максимум активных конфигов
+    # Число активных конфигов; меняется в одной транзакции с конфигами, чтобы не считать COUNT(*)
+    active_configs = Column(Integer, nullable=False, default=0, server_default="0")
+    # Результат фоновой проверки: пишет лидер health_prober, читают все процессы
+    health_up = Column(Boolean, nullable=False, default=True, server_default="true")
+    health = Column(JSON, nullable=True)  # Последний снимок состояния (задержки, ошибки)
     
     # Связи
     configs = relationship("UserConfig", back_populates="server")
@@ -44,6 +57,21 @@ class Protocol(Base):
 
 class UserConfig(Base):
     __tablename__ = "user_configs"
+    __table_args__ = (
+        # Очистка истекших и поиск истекающих: сканируется только активная часть таблицы
+        Index("ix_user_configs_active_expires_at", "expires_at", postgresql_where=text("is_active")),
+        # Списки конфигов пользователя (все и только активные)
+        Index("ix_user_configs_user_id_is_active", "user_id", "is_active"),
+        # Оценка спроса для пула готовых конфигураций
+        Index("ix_user_configs_created_at", "created_at"),
+        # Постраничные списки администратора: фильтр + ключ курсора
+        Index("ix_user_configs_server_id_id", "server_id", "id"),
+        Index("ix_user_configs_protocol_id_id", "protocol_id", "id"),
+        Index("ix_user_configs_is_active_id", "is_active", "id"),
+        Index("ix_user_configs_expires_at_id", "expires_at", "id"),
+        # Повтор отзыва: сканируются только конфиги, ещё не отозванные на VPN сервере
+        Index("ix_user_configs_revoke_pending", "revoke_attempted_at", postgresql_where=text("revoke_pending")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -51,10 +79,22 @@ class UserConfig(Base):
     protocol_id = Column(Integer, ForeignKey("protocols.id"))
     
     config_name = Column(String)
-    config_content = Column(Text)  # Содержимое конфигурационного файла
-    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
-    expires_at = Column(DateTime, nullable=True)  # Дата истечения конфига
+    client_name = Column(String, nullable=True)  # Имя клиента на VPN сервере (если отличается от config_name)
+    # Содержимое конфигурационного файла (для записей до появления config_segments).
+    # Не загружается вместе с объектом: читается только через crud.get_config_segments
+    config_content = deferred(Column(Text))
+    segment_hashes = Column(JSON, nullable=True)  # Хэши сегментов файла из config_segments по порядку
+    # file_id уже загруженного в Telegram файла и ETag содержимого, для которого он получен:
+    # при другом содержимом ETag не совпадёт и файл загрузится заново
+    telegram_file_id = Column(String, nullable=True)
+    telegram_file_etag = Column(String(64), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    expires_at = Column(DateTime(timezone=True), nullable=True)  # Дата истечения конфига
     is_active = Column(Boolean, default=True)
+    # Конфиг деактивирован, но клиент ещё не отозван на VPN сервере: отзыв повторяется,
+    # пока removeuser.sh не сообщит об успехе. revoke_attempted_at - время последней попытки
+    revoke_pending = Column(Boolean, nullable=False, default=False, server_default="false")
+    revoke_attempted_at = Column(DateTime(timezone=True), nullable=True)
     
     # Связи
     user = relationship("User", back_populates="configs")
@@ -62,8 +102,36 @@ class UserConfig(Base):
     protocol = relationship("Protocol", back_populates="configs")
     purchases = relationship("Purchase", back_populates="config")
 
+class PooledConfig(Base):
+    """Заранее сгенерированная, ещё никому не выданная конфигурация"""
+    __tablename__ = "pooled_configs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    server_id = Column(Integer, ForeignKey("servers.id"), index=True)
+    client_name = Column(String, unique=True, nullable=False)  # Имя клиента на VPN сервере
+    config_content = Column(Text, nullable=True)  # Для записей до появления config_segments
+    segment_hashes = Column(JSON, nullable=True)  # Хэши сегментов файла из config_segments по порядку
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    
+    # Связи
+    server = relationship("Server")
+
+class ConfigSegment(Base):
+    """Сегмент .ovpn файла, хранящийся один раз для всех конфигов, где он встречается"""
+    __tablename__ = "config_segments"
+
+    hash = Column(String(64), primary_key=True)  # sha256 содержимого
+    content = Column(Text, nullable=False)
+
 class Purchase(Base):
     __tablename__ = "purchases"
+    __table_args__ = (
+        # История покупок пользователя по времени
+        Index("ix_purchases_user_id_created_at", "user_id", "created_at"),
+        Index("ix_purchases_config_id", "config_id"),
+        # Постраничный список всех покупок по времени
+        Index("ix_purchases_created_at_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -72,7 +140,7 @@ class Purchase(Base):
     amount = Column(Numeric(10, 2), nullable=False)  # Сумма покупки
     duration_days = Column(Integer, nullable=False)  # Продолжительность в днях
     purchase_type = Column(String)  # "new", "renewal"
-    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
     
     # Связи
     user = relationship("User", back_populates="purchases")
@@ -80,14 +148,67 @@ class Purchase(Base):
 
 class NotificationLog(Base):
     __tablename__ = "notification_logs"
+    __table_args__ = (
+        # Одно уведомление каждого типа на конфиг, даже при параллельных рассылках
+        UniqueConstraint("config_id", "notification_type", name="uq_notification_logs_config_type"),
+        # Постраничные списки журнала по пользователю и по типу уведомления
+        Index("ix_notification_logs_user_id_id", "user_id", "id"),
+        Index("ix_notification_logs_notification_type_id", "notification_type", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     config_id = Column(Integer, ForeignKey("user_configs.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
     notification_type = Column(String)  # "expiration_warning"
-    sent_at = Column(DateTime, default=lambda: datetime.now(UTC))
-    expires_at = Column(DateTime)  # Дата истечения конфига на момент отправки уведомления
+    sent_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    expires_at = Column(DateTime(timezone=True))  # Дата истечения конфига на момент отправки уведомления
+    
+    # Связи
+    config = relationship("UserConfig")
+    user = relationship("User")
+
+class ProvisioningJob(Base):
+    __tablename__ = "provisioning_jobs"
+    __table_args__ = (
+        # Очередь ожидающих задач; выполненные задачи в индекс не попадают
+        Index("ix_provisioning_jobs_pending_id", "id", postgresql_where=text("status = 'pending'")),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    server_id = Column(Integer, ForeignKey("servers.id"))
+    protocol_id = Column(Integer, ForeignKey("protocols.id"))
+    config_name = Column(String, nullable=False)
+    duration_days = Column(Integer, nullable=False)
+    status = Column(String, default="pending", index=True)  # "pending", "running", "done", "failed"
+    error = Column(Text, nullable=True)  # Текст ошибки для статуса "failed"
+    config_id = Column(Integer, ForeignKey("user_configs.id"), nullable=True)  # Результат для статуса "done"
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
     
     # Связи
     config = relationship("UserConfig")
-    user = relationship("User")
\ No newline at end of file
+
+class OutboxMessage(Base):
+    """Исходящее сообщение Telegram, записанное в той же транзакции, что и бизнес-изменение"""
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        # Очередь отправки: только ожидающие сообщения в порядке готовности
+        Index("ix_outbox_messages_pending_next_attempt_at", "next_attempt_at", postgresql_where=text("status = 'pending'")),
+        # Поиск зависших отправок после падения отправителя
+        Index("ix_outbox_messages_sending_claimed_at", "claimed_at", postgresql_where=text("status = 'sending'")),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger, nullable=False)
+    method = Column(String, nullable=False)  # "send_message", "send_document"
+    payload = Column(JSON, nullable=False)  # Аргументы метода Bot API (для документа - config_id вместо файла)
+    dedup_key = Column(String, unique=True, nullable=True)  # Повторная постановка того же сообщения игнорируется
+    status = Column(String, default="pending", nullable=False)  # "pending", "sending", "sent", "failed"
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC), nullable=False)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)  # Когда отправитель забрал сообщение
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    sent_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from . import crud, metrics
+from .database import AsyncSessionLocal
+
+async def send_expiration_notifications():
+    """Отправляет уведомления о скором истечении конфигураций"""
+    while True:
+        started = time.perf_counter()
+        total_sent = 0
+        try:
+            async with AsyncSessionLocal() as db:
+                last_config_id = 0
+                while True:
+                    # Конфиги, которые истекают через 24 часа и по которым ещё не было уведомления
+                    notices = await crud.get_pending_expiration_notices(
+                        db, hours_before=24, after_config_id=last_config_id
+                    )
+                    if not notices:
+                        break
+                    last_config_id = notices[-1].config_id
+                    
+                    # Журнал уведомлений и сообщения в outbox фиксируются одной транзакцией,
+                    # отправку выполняет outbox.run_outbox_sender с учётом лимитов Telegram
+                    queued = await crud.create_notification_logs(db, notices, "expiration_warning", commit=False)
+                    await crud.enqueue_outbox_messages(db, [
+                        expiration_warning_message(notice) for notice in notices if notice.config_id in queued
+                    ])
+                    await db.commit()
+                    total_sent += len(queued)
+                    print(f"Поставлено в очередь уведомлений об истечении: {len(queued)}")
+        except Exception as e:
+            print(f"Ошибка при рассылке уведомлений об истечении: {str(e)}")
+        metrics.observe_loop("send_expiration_notifications", started, total_sent)
+        
+        # Проверяем каждые 6 часов
+        await asyncio.sleep(6 * 3600)
+
+def expiration_warning_message(notice) -> dict:
+    """Сообщение outbox с предупреждением об истечении конфигурации"""
+    # Форматируем дату истечения
+    expires_date = notice.expires_at.strftime("%d.%m.%Y в %H:%M")
+    
+    # Создаем сообщение
+    message = (
+        f"⚠️ **Внимание! Ваша VPN конфигурация скоро истечет**\n\n"
+        f"📅 **Дата истечения:** {expires_date}\n"
+        f"🖥️ **Сервер:** {notice.server_country}\n"
+        f"📡 **Протокол:** {notice.protocol_name}\n"
+        f"📁 **Конфигурация:** {notice.config_name}\n\n"
+        f"🔗 Для продления конфигурации используйте наш бот или веб-интерфейс.\n"
+        f"💡 Не забудьте продлить конфигурацию до истечения срока!"
+    )
+    
+    return {
+        "chat_id": notice.tg_id,
+        "method": "send_message",
+        "payload": {"text": message, "parse_mode": "Markdown"}
+    }
@@ -0,0 +1,241 @@
+import asyncio
+import os
+import random
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter
+from aiogram.types import BufferedInputFile
+from . import config_store, crud, metrics, telegram
+from .database import AsyncSessionLocal, listen
+
+# Число одновременных отправок в Telegram
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "8"))
+# Общий лимит бота (Telegram допускает около 30 сообщений в секунду)
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+# Лимит на один чат (Telegram допускает около 1 сообщения в секунду)
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+# После стольких неудачных попыток сообщение помечается как failed
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# Экспоненциальная задержка между попытками: база и потолок в секундах
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+# Через сколько секунд сообщение в статусе "sending" считается брошенным упавшим отправителем
+OUTBOX_SENDING_TIMEOUT = float(os.getenv("OUTBOX_SENDING_TIMEOUT", "300"))
+# Как часто проверять outbox, если уведомления не приходят
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "30"))
+
+# Ошибки, которые не исчезнут при повторе: чат не найден, бот заблокирован, неверный запрос
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        """Не больше rate отправок в секунду с запасом capacity на всплеск"""
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self._tokens >= self.capacity and now >= self._blocked_until
+
+    def pause(self, seconds: float) -> None:
+        """Telegram вернул retry_after: отправки ждут, пока он не истечёт"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self) -> None:
+        # Все отправители работают в одном event loop, поэтому проверка и списание атомарны
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+_global_bucket = TokenBucket(OUTBOX_GLOBAL_RATE)
+_chat_buckets: dict[int, TokenBucket] = {}
+_wakeup = asyncio.Event()
+
+def _chat_bucket(chat_id: int) -> TokenBucket:
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_buckets) >= 10000:
+            # Забываем чаты, лимит которых уже полностью восстановился
+            now = time.monotonic()
+            for idle_chat_id in [key for key, value in _chat_buckets.items() if value.idle(now)]:
+                del _chat_buckets[idle_chat_id]
+        bucket = _chat_buckets[chat_id] = TokenBucket(OUTBOX_CHAT_RATE, capacity=1)
+    return bucket
+
+def _backoff(attempt: int) -> float:
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempt - 1))
+    # Разброс, чтобы повторы после общего сбоя не шли одной волной
+    return delay * random.uniform(0.5, 1)
+
+async def _send_config_document(message):
+    """
+    Отправляет файл конфигурации. Первая отправка загружает файл и запоминает его
+    file_id, следующие передают только file_id, пока содержимое не изменилось.
+    """
+    # Файл не хранится в outbox: он собирается из сегментов в момент отправки
+    payload = dict(message.payload)
+    config_id = payload.pop("config_id")
+    filename = payload.pop("filename")
+    async with AsyncSessionLocal() as db:
+        config = await crud.get_user_config(db, config_id)
+        if not config:
+            raise LookupError("Конфигурация не найдена")
+        # Отозванный за время ожидания в очереди конфиг пользователю уже не отправляется
+        if not config.is_active:
+            raise LookupError("Конфигурация отозвана")
+        segments = None
+        if config.segment_hashes is not None:
+            etag = config_store.content_etag(config.segment_hashes)
+        else:
+            segments = await crud.get_config_segments(db, config)
+            etag = config_store.segment_hash(config_store.join_segments(segments))
+        file_id = config.telegram_file_id if config.telegram_file_etag == etag else None
+        # Сегменты читаются, только если файл придётся загружать
+        if file_id is None and segments is None:
+            segments = await crud.get_config_segments(db, config)
+
+    # Соединение с БД не держится, пока идёт запрос к Telegram
+    if file_id:
+        try:
+            return await telegram.bot.send_document(chat_id=message.chat_id, document=file_id, **payload)
+        except TelegramBadRequest as e:
+            # file_id привязан к боту и мог стать недействительным: загружаем файл заново
+            print(f"file_id конфигурации {config_id} не принят Telegram ({str(e)}), загружаем файл")
+            async with AsyncSessionLocal() as db:
+                segments = await crud.get_config_segments(db, config)
+
+    if not segments:
+        raise ValueError("У конфигурации нет содержимого")
+    sent = await telegram.bot.send_document(
+        chat_id=message.chat_id,
+        document=BufferedInputFile(file=config_store.join_segments(segments).encode("utf-8"), filename=filename),
+        **payload
+    )
+    if sent.document:
+        async with AsyncSessionLocal() as db:
+            await crud.set_config_telegram_file(db, config_id, sent.document.file_id, etag)
+    return sent
+
+async def _call_bot(message):
+    if message.method == "send_message":
+        return await telegram.bot.send_message(chat_id=message.chat_id, **message.payload)
+    if message.method == "send_document":
+        return await _send_config_document(message)
+    raise ValueError(f"Неизвестный метод outbox: {message.method}")
+
+async def _deliver(message) -> None:
+    """Отправляет одно сообщение и записывает результат"""
+    await _chat_bucket(message.chat_id).acquire()
+    await _global_bucket.acquire()
+    # Ожидание в очереди и паузы retry_after могут превысить OUTBOX_SENDING_TIMEOUT:
+    # захват продлевается прямо перед отправкой, а уже возвращённое в очередь сообщение пропускается
+    async with AsyncSessionLocal() as db:
+        claimed_at = await crud.touch_outbox_message(db, message.id, message.claimed_at)
+    if claimed_at is None:
+        print(f"Сообщение outbox {message.id} возвращено в очередь, пока ждало отправки; пропускаем")
+        return
+    try:
+        await _call_bot(message)
+    except TelegramRetryAfter as e:
+        # Сообщение не виновато в превышении лимита: попытка не засчитывается.
+        # Telegram не уточняет, чей лимит превышен, поэтому притормаживаем и чат, и бота целиком
+        _chat_bucket(message.chat_id).pause(e.retry_after)
+        _global_bucket.pause(e.retry_after)
+        async with AsyncSessionLocal() as db:
+            await crud.reschedule_outbox_message(db, message.id, claimed_at, e.retry_after, str(e), count_attempt=False)
+        metrics.OUTBOX_MESSAGES.labels(message.method, "retry_after").inc()
+        return
+    except (*PERMANENT_ERRORS, LookupError, ValueError) as e:
+        async with AsyncSessionLocal() as db:
+            await crud.fail_outbox_message(db, message.id, claimed_at, str(e))
+        metrics.OUTBOX_MESSAGES.labels(message.method, "failed").inc()
+        print(f"Сообщение outbox {message.id} в чат {message.chat_id} не доставлено: {str(e)}")
+        return
+    except Exception as e:
+        attempt = message.attempts + 1
+        async with AsyncSessionLocal() as db:
+            if attempt >= OUTBOX_MAX_ATTEMPTS:
+                await crud.fail_outbox_message(db, message.id, claimed_at, str(e))
+            else:
+                await crud.reschedule_outbox_message(db, message.id, claimed_at, _backoff(attempt), str(e))
+        result = "failed" if attempt >= OUTBOX_MAX_ATTEMPTS else "retry"
+        metrics.OUTBOX_MESSAGES.labels(message.method, result).inc()
+        print(f"Ошибка отправки сообщения outbox {message.id} (попытка {attempt}): {str(e)}")
+        return
+
+    # Отметка ставится сразу после отправки: повтор возможен, только если процесс упал между ними
+    async with AsyncSessionLocal() as db:
+        await crud.mark_outbox_message_sent(db, message.id, claimed_at)
+    metrics.OUTBOX_MESSAGES.labels(message.method, "sent").inc()
+
+async def _sender(queue: asyncio.Queue) -> None:
+    while True:
+        message = await queue.get()
+        try:
+            await _deliver(message)
+        except Exception as e:
+            # Сообщение останется в "sending" и вернётся в очередь после OUTBOX_SENDING_TIMEOUT
+            print(f"Ошибка обработки сообщения outbox {message.id}: {str(e)}")
+        finally:
+            queue.task_done()
+
+def _on_outbox_notification(connection, pid, channel, payload) -> None:
+    _wakeup.set()
+
+async def run_outbox_sender() -> None:
+    """
+    Отправляет сообщения из outbox пулом из OUTBOX_SENDERS отправителей.
+
+    Лимиты Telegram считаются на бота, поэтому отправитель работает в одном
+    процессе (лидер), а параллельность даёт пул внутри него.
+    """
+    listener = asyncio.create_task(listen(crud.OUTBOX_CHANNEL, _on_outbox_notification, on_connect=_wakeup.set))
+    # Очередь не длиннее пула: забранные из БД сообщения не залёживаются в памяти
+    queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOX_SENDERS)
+    senders = [asyncio.create_task(_sender(queue)) for _ in range(OUTBOX_SENDERS)]
+    try:
+        while True:
+            try:
+                _wakeup.clear()
+                started = time.perf_counter()
+                async with AsyncSessionLocal() as db:
+                    released = await crud.release_stale_outbox_messages(db, OUTBOX_SENDING_TIMEOUT)
+                    if released:
+                        print(f"Возвращено в очередь зависших сообщений outbox: {released}")
+                    messages = await crud.claim_outbox_messages(db, OUTBOX_SENDERS)
+                    next_attempt_at = None if messages else await crud.get_next_outbox_attempt(db)
+
+                if messages:
+                    for message in messages:
+                        await queue.put(message)
+                    metrics.observe_loop("outbox_sender", started, len(messages))
+                    continue
+
+                timeout = OUTBOX_POLL_INTERVAL
+                if next_attempt_at is not None:
+                    timeout = min(timeout, max(next_attempt_at.timestamp() - time.time(), 0))
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                print(f"Ошибка в отправителе outbox: {str(e)}")
+                await asyncio.sleep(5)
+    finally:
+        listener.cancel()
+        for sender in senders:
+            sender.cancel()
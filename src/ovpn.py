@@ -1,7 +1,20 @@
-from src.ssh import SSHClient
+from src.ssh import SSH_COMMAND_TIMEOUT, get_pool
+from dotenv import load_dotenv
+import os
 import re
+import shlex
 import time
 
+load_dotenv()
+
+# Параметры SSH к VPN серверу по умолчанию
+SSH_HOST = os.getenv("SSH_HOST")
+SSH_USERNAME = os.getenv("SSH_USERNAME")
+SSH_PASSWORD = os.getenv("SSH_PASSWORD")
+SSH_PORT = int(os.getenv("SSH_PORT", "22"))
+# Сколько секунд добавлять к SSH_COMMAND_TIMEOUT на каждого клиента пакетного отзыва
+REVOKE_TIMEOUT_PER_CLIENT = float(os.getenv("REVOKE_TIMEOUT_PER_CLIENT", "10"))
+
 def wait_for_prompt(channel, prompt, timeout=30):
     """Ждёт появления строки prompt в выводе канала."""
     buffer = ""
@@ -26,12 +39,10 @@ def create_openvpn_user(client_name, hostname, username, password, port=22):
     :param port: SSH-порт (по умолчанию 22)
     :return: Строка с содержимым .ovpn файла
     """
-    ssh = SSHClient(hostname=hostname, username=username, password=password, port=port)
-    try:
-        ssh.connect()
-        
+    # Берём соединение из пула вместо нового рукопожатия на каждый вызов
+    with get_pool(hostname=hostname, username=username, password=password, port=port).session() as ssh:
         # Запускаем adduser.sh с именем клиента
-        exit_code, stdout, stderr = ssh.execute_command(f'./adduser.sh {client_name}')
+        exit_code, stdout, stderr = ssh.execute_command(f'./adduser.sh {shlex.quote(client_name)}')
         output = stdout + stderr
         print(output)
 
@@ -43,12 +54,10 @@ def create_openvpn_user(client_name, hostname, username, password, port=22):
             remote_path = f'/root/{client_name}.ovpn'
         
         # Считываем содержимое файла на сервере и возвращаем как строку
-        exit_code, file_content, file_err = ssh.execute_command(f'cat "{remote_path}"')
+        exit_code, file_content, file_err = ssh.execute_command(f'cat {shlex.quote(remote_path)}')
         if exit_code != 0:
             raise Exception(f"Ошибка при чтении .ovpn файла: {file_err}")
         return file_content
-    finally:
-        ssh.close()
 
 def revoke_openvpn_user(client_name, hostname, username, password, port=22):
     """
@@ -60,19 +69,39 @@ def revoke_openvpn_user(client_name, hostname, username, password, port=22):
     :param port: SSH-порт (по умолчанию 22)
     :return: True, если успешно, иначе False
     """
-    ssh = SSHClient(hostname=hostname, username=username, password=password, port=port)
-    try:
-        ssh.connect()
-        
+    with get_pool(hostname=hostname, username=username, password=password, port=port).session() as ssh:
         # Запускаем removeuser.sh с именем клиента
-        exit_code, stdout, stderr = ssh.execute_command(f'./removeuser.sh {client_name}')
+        exit_code, stdout, stderr = ssh.execute_command(f'./removeuser.sh {shlex.quote(client_name)}')
         output = stdout + stderr
         print(output)
 
         # Проверяем успешность удаления
         return f'Пользователь {client_name} успешно удален' in output
-    finally:
-        ssh.close()
+
+def revoke_openvpn_users(client_names, hostname, username, password, port=22):
+    """
+    Удаляет несколько OpenVPN пользователей за один вызов removeuser.sh в цикле на сервере.
+    :param client_names: Имена клиентов для удаления
+    :param hostname: IP или домен сервера
+    :param username: SSH-пользователь (обычно root)
+    :param password: SSH-пароль
+    :param port: SSH-порт (по умолчанию 22)
+    :return: Словарь {имя клиента: True, если успешно удален}
+    """
+    if not client_names:
+        return {}
+    
+    names = " ".join(shlex.quote(name) for name in client_names)
+    with get_pool(hostname=hostname, username=username, password=password, port=port).session() as ssh:
+        # removeuser.sh пересобирает CRL на каждого клиента, поэтому время растёт с размером пачки
+        exit_code, stdout, stderr = ssh.execute_command(
+            f'for c in {names}; do ./removeuser.sh "$c"; done',
+            timeout=SSH_COMMAND_TIMEOUT + REVOKE_TIMEOUT_PER_CLIENT * len(client_names)
+        )
+        output = stdout + stderr
+        print(output)
+        
+        return {name: f'Пользователь {name} успешно удален' in output for name in client_names}
 
 # Пример использования:
 # file_path = create_openvpn_user(
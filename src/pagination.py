@@ -0,0 +1,54 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import DateTime, tuple_
+
+# Наибольший размер страницы в списках администратора
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(columns, row) -> str:
+    """Непрозрачный курсор: ключ сортировки последней строки страницы"""
+    values = [getattr(row, column.key) for column in columns]
+    raw = json.dumps({
+        "k": [column.key for column in columns],
+        "v": [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    })
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(columns, cursor: str) -> list:
+    """Значения ключа сортировки из курсора; ValueError, если курсор испорчен или от другой сортировки"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        keys, values = data["k"], data["v"]
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError):
+        raise ValueError("Некорректный курсор")
+    if keys != [column.key for column in columns] or len(values) != len(columns):
+        raise ValueError("Курсор относится к другой сортировке, начните с первой страницы")
+    try:
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except (TypeError, ValueError):
+        raise ValueError("Некорректный курсор")
+
+def apply_cursor(query, columns, cursor: str | None, limit: int, descending: bool = True):
+    """
+    Keyset пагинация: вместо OFFSET условие (ключ) < (ключ последней строки),
+    поэтому страница на любой глубине читается одним проходом по индексу.
+    Выбирается limit + 1 строка, чтобы узнать, есть ли следующая страница.
+    """
+    if cursor:
+        key = tuple_(*columns)
+        bound = tuple_(*decode_cursor(columns, cursor))
+        query = query.where(key < bound if descending else key > bound)
+    return query.order_by(*(column.desc() if descending else column.asc() for column in columns)).limit(limit + 1)
+
+def page(columns, rows, limit: int):
+    """Отрезает лишнюю строку и возвращает (строки страницы, курсор следующей страницы или None)"""
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(columns, rows[-1])
@@ -0,0 +1,78 @@
+from sqlalchemy import Float, cast, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, ovpn, secrets_store
+
+async def reserve_server(db: AsyncSession, country: str):
+    """
+    Выбирает наименее загруженный активный сервер страны со свободной ёмкостью и сразу
+    занимает на нём место (active_configs + 1) в текущей транзакции. Коммит - вместе
+    с задачей создания конфигурации; при откате место освобождается само.
+    Загрузка считается по счётчику active_configs, без COUNT(*) по конфигам.
+    Серверы, выведенные из ротации проверкой здоровья (health_up), не выбираются.
+    Возвращает ID сервера или None, если свободных серверов нет.
+    """
+    load = cast(models.Server.active_configs, Float) / models.Server.capacity
+    # Сначала SKIP LOCKED: одновременные запросы расходятся по разным серверам, а не ждут
+    # друг друга на самом свободном. Если заняты все, ждём блокировку наименее загруженного
+    for skip_locked in (True, False):
+        candidate = (
+            select(models.Server.id)
+            .where(
+                models.Server.is_active == True,
+                models.Server.country == country,
+                models.Server.health_up == True,
+                models.Server.active_configs < models.Server.capacity
+            )
+            .order_by(load, models.Server.id)
+            .limit(1)
+            .with_for_update(skip_locked=skip_locked)
+            .scalar_subquery()
+        )
+        server_id = await db.scalar(
+            update(models.Server)
+            .where(models.Server.id == candidate, models.Server.active_configs < models.Server.capacity)
+            .values(active_configs=models.Server.active_configs + 1)
+            .returning(models.Server.id)
+            .execution_options(synchronize_session=False)
+        )
+        if server_id is not None:
+            return server_id
+    return None
+
+async def reserve_on_server(db: AsyncSession, server_id: int):
+    """
+    Занимает место на конкретном сервере (active_configs + 1) в текущей транзакции,
+    если он активен, прошёл проверку здоровья и не заполнен.
+    Возвращает ID сервера или None, если занять место нельзя.
+    """
+    return await db.scalar(
+        update(models.Server)
+        .where(
+            models.Server.id == server_id,
+            models.Server.is_active == True,
+            models.Server.health_up == True,
+            models.Server.active_configs < models.Server.capacity
+        )
+        .values(active_configs=models.Server.active_configs + 1)
+        .returning(models.Server.id)
+        .execution_options(synchronize_session=False)
+    )
+
+def ssh_params(server) -> dict:
+    """
+    Параметры SSH для сервера; серверы без своих учётных данных идут на SSH_HOST из окружения.
+    Пароль хранится в БД зашифрованным и расшифровывается только здесь, перед подключением.
+    """
+    if server is None or not server.ssh_username:
+        return {
+            "hostname": ovpn.SSH_HOST,
+            "username": ovpn.SSH_USERNAME,
+            "password": ovpn.SSH_PASSWORD,
+            "port": ovpn.SSH_PORT,
+        }
+    return {
+        "hostname": server.host,
+        "username": server.ssh_username,
+        "password": secrets_store.decrypt(server.ssh_password),
+        "port": server.ssh_port or 22,
+    }
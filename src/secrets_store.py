@@ -0,0 +1,33 @@
+import os
+from cryptography.fernet import Fernet, InvalidToken
+
+# Ключ шифрования SSH паролей серверов в БД (сгенерировать: Fernet.generate_key())
+SERVER_SECRET_KEY = os.getenv("SERVER_SECRET_KEY")
+
+# Метка зашифрованного значения: записи без неё сохранены до шифрования
+_PREFIX = "fernet:"
+
+_fernet = Fernet(SERVER_SECRET_KEY.encode("ascii")) if SERVER_SECRET_KEY else None
+
+def _get_fernet() -> Fernet:
+    if _fernet is None:
+        raise ValueError("SERVER_SECRET_KEY не задан: SSH пароли серверов нельзя зашифровать и прочитать")
+    return _fernet
+
+def is_encrypted(value: str | None) -> bool:
+    return value is not None and value.startswith(_PREFIX)
+
+def encrypt(value: str | None) -> str | None:
+    """Шифрует секрет для хранения в БД; в кэше и журнале запросов остаётся только шифротекст"""
+    if value is None or is_encrypted(value):
+        return value
+    return _PREFIX + _get_fernet().encrypt(value.encode("utf-8")).decode("ascii")
+
+def decrypt(value: str | None) -> str | None:
+    """Расшифровывает секрет из БД; незашифрованные старые записи возвращаются как есть"""
+    if not is_encrypted(value):
+        return value
+    try:
+        return _get_fernet().decrypt(value[len(_PREFIX):].encode("ascii")).decode("utf-8")
+    except InvalidToken:
+        raise ValueError("SSH пароль сервера зашифрован другим ключом SERVER_SECRET_KEY")
@@ -1,6 +1,21 @@
 import paramiko
 import os
-from typing import Optional, Tuple, List
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Tuple, Iterator
+from . import metrics
+
+# Параметры пула SSH соединений
+SSH_POOL_MAX_CHANNELS = int(os.getenv("SSH_POOL_MAX_CHANNELS", "4"))
+SSH_KEEPALIVE_INTERVAL = int(os.getenv("SSH_KEEPALIVE_INTERVAL", "30"))
+SSH_CONNECT_TIMEOUT = float(os.getenv("SSH_CONNECT_TIMEOUT", "10"))
+# Сколько секунд ждать завершения команды; зависшая команда обрывается вместе с соединением
+SSH_COMMAND_TIMEOUT = float(os.getenv("SSH_COMMAND_TIMEOUT", "120"))
+# Сколько секунд ждать свободного канала пула, прежде чем вернуть ошибку
+SSH_CHANNEL_WAIT_TIMEOUT = float(os.getenv("SSH_CHANNEL_WAIT_TIMEOUT", "60"))
 
 class SSHClient:
     def __init__(self, hostname: str, username: str, password: Optional[str] = None, 
@@ -24,6 +39,7 @@ class SSHClient:
 
     def connect(self) -> None:
         """Установка SSH соединения"""
+        started = time.perf_counter()
         try:
             self.client = paramiko.SSHClient()
             self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -32,30 +48,64 @@ class SSHClient:
                 username=self.username,
                 password=self.password,
                 key_filename=self.key_filename,
-                port=self.port
+                port=self.port,
+                timeout=SSH_CONNECT_TIMEOUT
             )
         except Exception as e:
+            metrics.SSH_ERRORS.labels(self.hostname, "connect").inc()
             raise ConnectionError(f"Ошибка подключения к SSH: {str(e)}")
+        finally:
+            metrics.SSH_CONNECT_LATENCY.labels(self.hostname).observe(time.perf_counter() - started)
 
-    def execute_command(self, command: str) -> Tuple[int, str, str]:
+    def is_alive(self) -> bool:
+        """Проверяет, что транспорт соединения ещё жив"""
+        if not self.client:
+            return False
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            # Дешёвый пакет без ответа: падает, если сокет уже закрыт
+            transport.send_ignore()
+        except (EOFError, OSError, paramiko.SSHException):
+            return False
+        return True
+
+    def execute_command(self, command: str, timeout: Optional[float] = None) -> Tuple[int, str, str]:
         """
         Выполнение команды на удаленном сервере
         
         Args:
             command: Команда для выполнения
+            timeout: Сколько секунд ждать завершения (по умолчанию SSH_COMMAND_TIMEOUT)
             
         Returns:
             Tuple[int, str, str]: (код возврата, stdout, stderr)
+        
+        Raises:
+            TimeoutError: команда не завершилась за timeout секунд
         """
         if not self.client:
             raise ConnectionError("Нет активного SSH соединения")
         
-        stdin, stdout, stderr = self.client.exec_command(command)
-        return (
-            stdout.channel.recv_exit_status(),
-            stdout.read().decode('utf-8'),
-            stderr.read().decode('utf-8')
-        )
+        timeout = SSH_COMMAND_TIMEOUT if timeout is None else timeout
+        started = time.perf_counter()
+        try:
+            # timeout канала ограничивает и чтение вывода
+            stdin, stdout, stderr = self.client.exec_command(command, timeout=timeout)
+            if not stdout.channel.status_event.wait(timeout):
+                stdout.channel.close()
+                raise TimeoutError(f"Команда не завершилась за {timeout} с: {command}")
+            return (
+                stdout.channel.recv_exit_status(),
+                stdout.read().decode('utf-8'),
+                stderr.read().decode('utf-8')
+            )
+        except Exception:
+            metrics.SSH_ERRORS.labels(self.hostname, "command").inc()
+            raise
+        finally:
+            metrics.SSH_COMMAND_LATENCY.labels(self.hostname).observe(time.perf_counter() - started)
 
     def upload_file(self, local_path: str, remote_path: str) -> None:
         """
@@ -92,3 +142,160 @@ class SSHClient:
         if self.client:
             self.client.close()
             self.client = None
+
+
+class _FairSemaphore:
+    """
+    Семафор, выдающий места строго в порядке очереди. У threading.Semaphore
+    освободивший место поток может сразу занять его снова, и ожидающие потоки
+    голодают; здесь место передаётся первому ожидающему.
+    """
+    def __init__(self, value: int):
+        self._value = value
+        self._lock = threading.Lock()
+        self._waiters: deque[threading.Event] = deque()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return True
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        if waiter.wait(timeout):
+            return True
+        with self._lock:
+            # Место могли передать между истечением ожидания и захватом блокировки
+            if waiter.is_set():
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._value += 1
+
+
+class SSHConnectionPool:
+    def __init__(self, hostname: str, username: str, password: Optional[str] = None,
+                 key_filename: Optional[str] = None, port: int = 22,
+                 max_channels: int = SSH_POOL_MAX_CHANNELS,
+                 keepalive_interval: int = SSH_KEEPALIVE_INTERVAL):
+        """
+        Долгоживущее SSH соединение к одному хосту, общее для всех запросов
+        
+        Paramiko умеет мультиплексировать несколько каналов поверх одного
+        транспорта, поэтому на хост держится одно соединение, а число
+        одновременно открытых каналов ограничивается семафором.
+        
+        Args:
+            hostname: Имя хоста или IP адрес
+            username: Имя пользователя
+            password: Пароль (опционально)
+            key_filename: Путь к приватному ключу (опционально)
+            port: Порт SSH (по умолчанию 22)
+            max_channels: Максимум одновременно открытых каналов
+            keepalive_interval: Интервал keepalive пакетов в секундах
+        """
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.key_filename = key_filename
+        self.port = port
+        self.keepalive_interval = keepalive_interval
+        self._client: Optional[SSHClient] = None
+        self._lock = threading.Lock()
+        self._channels = _FairSemaphore(max_channels)
+
+    def _ensure_connected(self) -> SSHClient:
+        """Возвращает живое соединение, при необходимости переподключаясь"""
+        with self._lock:
+            if self._client is not None and self._client.is_alive():
+                return self._client
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+            client = SSHClient(
+                hostname=self.hostname,
+                username=self.username,
+                password=self.password,
+                key_filename=self.key_filename,
+                port=self.port
+            )
+            client.connect()
+            client.client.get_transport().set_keepalive(self.keepalive_interval)
+            self._client = client
+            return client
+
+    def _discard(self, client: SSHClient) -> None:
+        """Закрывает сломанное соединение, чтобы следующий запрос переподключился"""
+        with self._lock:
+            if self._client is client:
+                self._client = None
+        client.close()
+
+    @contextmanager
+    def session(self) -> Iterator[SSHClient]:
+        """
+        Выдаёт соединение из пула на время выполнения команд
+        
+        Соединение не закрывается по выходу из блока. Если во время работы
+        транспорт упал или команда зависла (TimeoutError), соединение
+        выбрасывается и пересоздаётся при следующем обращении: закрытие
+        транспорта обрывает и зависшую команду на сервере.
+        
+        Raises:
+            TimeoutError: свободный канал не появился за SSH_CHANNEL_WAIT_TIMEOUT секунд
+        """
+        if not self._channels.acquire(timeout=SSH_CHANNEL_WAIT_TIMEOUT):
+            metrics.SSH_ERRORS.labels(self.hostname, "channel_wait").inc()
+            raise TimeoutError(f"Нет свободного SSH канала к {self.hostname} за {SSH_CHANNEL_WAIT_TIMEOUT} с")
+        try:
+            client = self._ensure_connected()
+            try:
+                yield client
+            # socket.error (OSError) включает TimeoutError
+            except (paramiko.SSHException, EOFError, socket.error):
+                self._discard(client)
+                raise
+        finally:
+            self._channels.release()
+
+    def close(self) -> None:
+        """Закрытие соединения пула"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+_pools: dict[tuple, SSHConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(hostname: str, username: str, password: Optional[str] = None,
+             key_filename: Optional[str] = None, port: int = 22) -> SSHConnectionPool:
+    """Возвращает пул соединений для хоста, создавая его при первом обращении"""
+    key = (hostname, port, username, password, key_filename)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SSHConnectionPool(
+                hostname=hostname,
+                username=username,
+                password=password,
+                key_filename=key_filename,
+                port=port
+            )
+            _pools[key] = pool
+        return pool
+
+def close_all_pools() -> None:
+    """Закрывает все соединения пулов (при остановке приложения)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,102 @@
+import asyncio
+import hmac
+import os
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import Message, PreCheckoutQuery, Update
+from dotenv import load_dotenv
+from fastapi import APIRouter, HTTPException, Request
+from . import crud, metrics
+from .database import AsyncSessionLocal
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+# "polling" - long polling getUpdates, "webhook" - обновления приходят HTTP запросами от Telegram
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Запускать ли бота внутри процессов API; 0, если бот работает отдельно (python bot.py)
+BOT_EMBEDDED = os.getenv("BOT_EMBEDDED", "1") == "1"
+# Публичный адрес, на который Telegram шлёт обновления в режиме webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Размер очереди обновлений и число обработчиков на процесс
+UPDATE_QUEUE_SIZE = int(os.getenv("TELEGRAM_UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_WORKERS = int(os.getenv("TELEGRAM_UPDATE_WORKERS", "8"))
+
+# Инициализация бота и диспетчера
+bot = Bot(token=BOT_TOKEN)
+bot.session.middleware(metrics.TelegramMetricsMiddleware())
+dp = Dispatcher()
+
+# Обработчик pre-checkout query
+@dp.pre_checkout_query()
+async def pre_checkout_query(query: PreCheckoutQuery):
+    await query.answer(ok=True)
+
+# Обработчик успешной оплаты
+@dp.message(F.successful_payment)
+async def successful_payment(message: Message):
+    # await bot.refund_star_payment(message.from_user.id, message.successful_payment.telegram_payment_charge_id)
+    # Ответ уходит через outbox; ключ по платежу защищает от повторной доставки апдейта
+    async with AsyncSessionLocal() as db:
+        await crud.enqueue_outbox_message(
+            db,
+            message.from_user.id,
+            "send_message",
+            {"text": "Payment successful"},
+            dedup_key=f"payment:{message.successful_payment.telegram_payment_charge_id}"
+        )
+        await db.commit()
+
+async def start_polling():
+    print("🚀 Бот запущен (polling)")
+    await bot.delete_webhook(drop_pending_updates=True)
+    await dp.start_polling(bot, handle_signals=False)
+
+# Режим webhook: обработчик отвечает Telegram сразу, а апдейт разбирают воркеры из очереди
+_updates: asyncio.Queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+
+async def setup_webhook():
+    """Регистрирует webhook в Telegram (идемпотентно, можно вызывать из каждого процесса)"""
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise RuntimeError("Для BOT_MODE=webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=100
+    )
+    print(f"🚀 Бот запущен (webhook {WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH})")
+
+async def _dispatch_worker():
+    while True:
+        data = await _updates.get()
+        try:
+            update = Update.model_validate(data, context={"bot": bot})
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            print(f"Ошибка при обработке обновления Telegram {data.get('update_id')}: {str(e)}")
+        finally:
+            _updates.task_done()
+
+async def run_webhook_dispatcher():
+    """Регистрирует webhook и обрабатывает обновления из очереди UPDATE_WORKERS воркерами"""
+    await setup_webhook()
+    await asyncio.gather(*(_dispatch_worker() for _ in range(UPDATE_WORKERS)))
+
+router = APIRouter()
+
+@router.post(WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request):
+    """Принимает обновление от Telegram и ставит его в очередь обработки"""
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not WEBHOOK_SECRET or not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail="Неверный секрет webhook")
+
+    try:
+        _updates.put_nowait(await request.json())
+    except asyncio.QueueFull:
+        # Не 2xx: Telegram повторит доставку позже, когда очередь разгрузится
+        raise HTTPException(status_code=503, detail="Очередь обновлений переполнена")
+    return {"ok": True}
@@ -0,0 +1,11 @@
+import os
+import sys
+from cryptography.fernet import Fernet
+
+# Модули src читают настройки БД при импорте; движок не подключается, пока нет запросов
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("SERVER_SECRET_KEY", Fernet.generate_key().decode("ascii"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
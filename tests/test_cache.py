@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from src import cache, crud, models
+from src.cache import LRUCache, TTLCache, protocols_cache, servers_cache, users_cache
+from src.database import Base, assert_query_count
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    for entries in cache._caches.values():
+        entries.invalidate()
+    yield
+    for entries in cache._caches.values():
+        entries.invalidate()
+
+async def _run(check):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    notifications = []
+
+    # NOTIFY в SQLite нет: pg_notify записывает уведомления, которые получили бы другие процессы
+    @event.listens_for(engine.sync_engine, "connect")
+    def add_pg_notify(connection, record):
+        connection.create_function("pg_notify", 2, lambda channel, payload: notifications.append((channel, payload)))
+
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add(models.Protocol(id=1, name="openvpn"))
+            db.add(models.Server(id=1, name="server1", host="127.0.0.1", port=1194, country="NL"))
+            await db.commit()
+            await check(db, notifications)
+    finally:
+        await engine.dispose()
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    entries = TTLCache("test", ttl=10)
+    entries.set("key", "value")
+    assert entries.get("key") == "value"
+    now[0] += 11
+    assert entries.get("key") is None
+    assert entries.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+def test_server_lookup_is_cached():
+    async def check(db, notifications):
+        server = await crud.get_server(db, 1)
+        async with assert_query_count(db, 0):
+            assert await crud.get_server(db, 1) is server
+        assert servers_cache.stats()["hits"] == 1
+
+    asyncio.run(_run(check))
+
+def test_server_change_invalidates_locally_and_notifies_others():
+    async def check(db, notifications):
+        assert [server.id for server in await crud.get_active_servers(db)] == [1]
+        await crud.create_server(db, name="server2", host="127.0.0.2", port=1194, country="DE")
+        assert notifications == [(cache.INVALIDATION_CHANNEL, "servers")]
+        assert sorted(server.id for server in await crud.get_active_servers(db)) == [1, 2]
+
+    asyncio.run(_run(check))
+
+def test_notification_from_other_process_clears_cache():
+    async def check(db, notifications):
+        await crud.get_server(db, 1)
+        await crud.get_protocol(db, 1)
+        cache._on_notification(None, 0, cache.INVALIDATION_CHANNEL, "servers")
+        assert servers_cache.stats()["size"] == 0
+        assert protocols_cache.stats()["size"] == 1
+
+    asyncio.run(_run(check))
+
+def test_lru_cache_evicts_least_recently_used():
+    entries = LRUCache("test", maxsize=2)
+    entries.set(1, "first")
+    entries.set(2, "second")
+    assert entries.get(1) == "first"
+    entries.set(3, "third")
+    assert entries.get(2) is None
+    assert entries.get(1) == "first" and entries.get(3) == "third"
+
+def test_user_trial_invalidates_only_that_user():
+    async def check(db, notifications):
+        db.add(models.User(id=1, tgId=101, username="user1", firstname="User"))
+        db.add(models.User(id=2, tgId=102, username="user2", firstname="User"))
+        await db.commit()
+        first = await crud.resolve_user(db, 101)
+        await crud.resolve_user(db, 102)
+        assert not first.free_trial_used
+
+        await crud.activate_free_trial(db, 1)
+        assert notifications == [(cache.INVALIDATION_CHANNEL, "users:101")]
+        # Запись второго пользователя осталась в кэше, первого - перечитывается
+        async with assert_query_count(db, 0):
+            await crud.resolve_user(db, 102)
+        async with assert_query_count(db, 1):
+            assert (await crud.resolve_user(db, 101)).free_trial_used
+
+    asyncio.run(_run(check))
+
+def test_user_notification_key_matches_int_key():
+    users_cache.set(101, "record")
+    # Ключ из уведомления приходит строкой
+    cache._on_notification(None, 0, cache.INVALIDATION_CHANNEL, "users:101")
+    assert users_cache.get(101) is None
@@ -0,0 +1,92 @@
+import asyncio
+import gzip
+from datetime import UTC, datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from src import config_store, database, models
+from src.database import Base
+
+CONTENT = "client\ndev tun\n<ca>\nCERT\n</ca>\n<key>\nKEY\n</key>\n"
+
+@pytest.fixture
+def client(monkeypatch):
+    # main создаёт таблицы при импорте: вместо Postgres подставляется SQLite в памяти
+    monkeypatch.setattr(database, "engine", create_engine("sqlite://"))
+    import main
+
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async def seed():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        segments = config_store.split_config(CONTENT)
+        hashes = [config_store.segment_hash(segment) for segment in segments]
+        async with session_factory() as db:
+            db.add(models.User(id=1, tgId=1, username="user", firstname="User"))
+            db.add(models.Protocol(id=1, name="openvpn"))
+            db.add(models.Server(id=1, name="server1", host="127.0.0.1", port=1194))
+            for h, segment in dict(zip(hashes, segments)).items():
+                db.add(models.ConfigSegment(hash=h, content=segment))
+            db.add(models.UserConfig(
+                id=1, user_id=1, server_id=1, protocol_id=1, config_name="config1",
+                segment_hashes=hashes, expires_at=datetime.now(UTC) + timedelta(days=1)
+            ))
+            # Старая запись: содержимое целиком в config_content
+            db.add(models.UserConfig(
+                id=2, user_id=1, server_id=1, protocol_id=1, config_name="config2",
+                config_content=CONTENT, expires_at=datetime.now(UTC) + timedelta(days=1)
+            ))
+            await db.commit()
+
+    asyncio.run(seed())
+
+    async def get_db():
+        async with session_factory() as db:
+            yield db
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    try:
+        yield TestClient(main.app)
+    finally:
+        main.app.dependency_overrides.clear()
+        asyncio.run(engine.dispose())
+
+@pytest.mark.parametrize("config_id", [1, 2])
+def test_download_returns_file_with_etag(client, config_id):
+    response = client.get(f"/api/configs/{config_id}/download", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.text == CONTENT
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["ETag"].startswith('W/"')
+    assert f"vpn_config_config{config_id}.ovpn" in response.headers["Content-Disposition"]
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", 'W/"other", {etag}', "*"])
+@pytest.mark.parametrize("config_id", [1, 2])
+def test_matching_etag_returns_304(client, if_none_match, config_id):
+    etag = client.get(f"/api/configs/{config_id}/download").headers["ETag"]
+    response = client.get(f"/api/configs/{config_id}/download", headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+def test_stale_etag_returns_file(client):
+    response = client.get("/api/configs/1/download", headers={"If-None-Match": 'W/"other"'})
+    assert response.status_code == 200
+    assert response.text == CONTENT
+
+def test_gzip_download(client):
+    response = client.get("/api/configs/1/download", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.text == CONTENT
+    # Без автоматической распаковки, чтобы проверить сами сжатые байты
+    with client.stream("GET", "/api/configs/1/download", headers={"Accept-Encoding": "gzip"}) as raw:
+        assert gzip.decompress(b"".join(raw.iter_raw())).decode("utf-8") == CONTENT
+
+def test_missing_config_is_404(client):
+    assert client.get("/api/configs/404/download").status_code == 404
@@ -0,0 +1,102 @@
+import asyncio
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from src import config_pool, config_store, crud, models, ovpn
+from src.cache import servers_cache
+from src.database import Base
+
+CONTENT = "client\ndev tun\n<ca>\nCERT\n</ca>\n"
+
+async def _run(check, monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    # Функций Postgres в SQLite нет: блокировка хранилища сегментов и NOTIFY ничего не делают
+    @event.listens_for(engine.sync_engine, "connect")
+    def add_postgres_functions(connection, record):
+        connection.create_function("pg_advisory_xact_lock_shared", 1, lambda key: None)
+        connection.create_function("pg_notify", 2, lambda channel, payload: None)
+
+    servers_cache.invalidate()
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        monkeypatch.setattr(config_pool, "AsyncSessionLocal", session_factory)
+        async with session_factory() as db:
+            db.add(models.User(id=1, tgId=1, username="user", firstname="User"))
+            db.add(models.Protocol(id=1, name="openvpn"))
+            db.add(models.Server(id=1, name="server1", host="127.0.0.1", port=1194))
+            db.add(models.Server(id=2, name="server2", host="127.0.0.2", port=1194))
+            db.add(models.Server(id=3, name="server3", host="127.0.0.3", port=1194, health_up=False))
+            await db.commit()
+            await check(db)
+    finally:
+        servers_cache.invalidate()
+        await engine.dispose()
+
+async def _active_configs(db, server_id):
+    return await db.scalar(select(models.Server.active_configs).where(models.Server.id == server_id))
+
+def test_pool_target_follows_demand_within_bounds(monkeypatch):
+    monkeypatch.setattr(config_pool, "CONFIG_POOL_MIN_SIZE", 5)
+    monkeypatch.setattr(config_pool, "CONFIG_POOL_MAX_SIZE", 50)
+    monkeypatch.setattr(config_pool, "CONFIG_POOL_HORIZON_HOURS", 2)
+    monkeypatch.setattr(config_pool, "CONFIG_POOL_DEMAND_WINDOW_HOURS", 6)
+    assert config_pool.pool_target(0) == 5
+    assert config_pool.pool_target(60) == 20
+    assert config_pool.pool_target(61) == 21
+    assert config_pool.pool_target(10000) == 50
+
+def test_take_from_pool_oldest_first(monkeypatch):
+    async def check(db):
+        await crud.add_pooled_config(db, 1, "pool1_first", CONTENT)
+        await crud.add_pooled_config(db, 1, "pool1_second", CONTENT)
+
+        config = await crud.create_user_config_from_pool(db, 1, 1, 1, "my vpn")
+        assert config.client_name == "pool1_first"
+        assert config.config_name == "my vpn"
+        assert await crud.get_config_content(db, config) == CONTENT
+        assert await _active_configs(db, 1) == 1
+
+        # Место уже занято задачей создания: счётчик сервера не меняется
+        config = await crud.create_user_config_from_pool(db, 1, 1, 1, "second", reserved=True)
+        assert config.client_name == "pool1_second"
+        assert await _active_configs(db, 1) == 1
+
+        assert await crud.create_user_config_from_pool(db, 1, 1, 1, "third") is None
+        assert await crud.get_pooled_config_counts(db) == {}
+
+    asyncio.run(_run(check, monkeypatch))
+
+def test_refill_plan_skips_full_and_unhealthy_servers(monkeypatch):
+    monkeypatch.setattr(config_pool, "CONFIG_POOL_MIN_SIZE", 2)
+
+    async def check(db):
+        for i in range(2):
+            await crud.add_pooled_config(db, 2, f"pool2_{i}", CONTENT)
+        plan = await config_pool._plan_refill()
+        # Сервер 2 уже заполнен, сервер 3 выведен из ротации проверкой здоровья
+        assert {server.id: count for server, count in plan.items()} == {1: 2}
+
+    asyncio.run(_run(check, monkeypatch))
+
+def test_refill_generates_uniquely_named_configs(monkeypatch):
+    created = []
+
+    def create_openvpn_user(client_name, hostname, username, password, port=22):
+        created.append(client_name)
+        return CONTENT
+
+    monkeypatch.setattr(ovpn, "create_openvpn_user", create_openvpn_user)
+
+    async def check(db):
+        server = await crud.get_server(db, 1)
+        await config_pool._refill_server(server, 3)
+        assert len(set(created)) == 3
+        assert all(name.startswith("pool1_") for name in created)
+        assert await crud.get_pooled_config_counts(db) == {1: 3}
+        hashes = await db.scalars(select(models.PooledConfig.segment_hashes))
+        assert all(h == [config_store.segment_hash(s) for s in config_store.split_config(CONTENT)] for h in hashes)
+        assert await db.scalar(select(func.count(models.UserConfig.id))) == 0
+
+    asyncio.run(_run(check, monkeypatch))
@@ -0,0 +1,85 @@
+from src.expiry import ExpiryHeap
+
+def make_heap(loaded_until: float = 1000.0) -> ExpiryHeap:
+    heap = ExpiryHeap()
+    heap.loaded_until = loaded_until
+    return heap
+
+def test_pop_due_returns_configs_in_deadline_order():
+    heap = make_heap()
+    heap.schedule(1, 30)
+    heap.schedule(2, 10)
+    heap.schedule(3, 20)
+
+    assert heap.pop_due(25, limit=10) == [2, 3]
+    assert heap.next_deadline() == 30
+    assert len(heap) == 1
+
+def test_pop_due_respects_limit():
+    heap = make_heap()
+    for config_id in range(5):
+        heap.schedule(config_id, 10 + config_id)
+
+    assert heap.pop_due(100, limit=2) == [0, 1]
+    assert len(heap) == 3
+
+def test_reschedule_moves_deadline_and_drops_stale_entry():
+    heap = make_heap()
+    heap.schedule(1, 10)
+    # Продление: старая запись остаётся в куче, но отбрасывается при извлечении
+    assert heap.schedule(1, 50)
+
+    assert heap.pop_due(20, limit=10) == []
+    assert heap.next_deadline() == 50
+    assert heap.pop_due(50, limit=10) == [1]
+    assert heap.next_deadline() is None
+
+def test_schedule_same_deadline_is_noop():
+    heap = make_heap()
+    assert heap.schedule(1, 10)
+    assert not heap.schedule(1, 10)
+    assert heap.pop_due(10, limit=10) == [1]
+
+def test_deadline_beyond_horizon_is_left_for_db_load():
+    heap = make_heap(loaded_until=100)
+    assert not heap.schedule(1, 200)
+    assert len(heap) == 0
+
+    # Продление за горизонт убирает конфиг из кучи: его срок подгрузится из БД позже
+    heap.schedule(2, 50)
+    assert not heap.schedule(2, 150)
+    assert heap.pop_due(1000, limit=10) == []
+
+def test_schedule_before_horizon_is_loaded_is_ignored():
+    heap = ExpiryHeap()
+    assert not heap.schedule(1, 10)
+    assert heap.next_deadline() is None
+
+def test_reschedule_returns_popped_configs():
+    heap = make_heap()
+    heap.schedule(1, 10)
+    heap.schedule(2, 20)
+    due = heap.pop_due(20, limit=10)
+    assert len(heap) == 0
+
+    heap.reschedule(due, 25)
+    assert heap.pop_due(24, limit=10) == []
+    assert sorted(heap.pop_due(25, limit=10)) == [1, 2]
+
+def test_reschedule_keeps_newer_deadline():
+    heap = make_heap()
+    heap.schedule(1, 10)
+    due = heap.pop_due(10, limit=10)
+    # Пока пачка обрабатывалась, пришло продление конфига
+    heap.schedule(1, 500)
+
+    heap.reschedule(due, 15)
+    assert heap.next_deadline() == 500
+
+def test_reset_clears_heap_and_horizon():
+    heap = make_heap()
+    heap.schedule(1, 10)
+    heap.reset()
+    assert len(heap) == 0
+    assert heap.loaded_until is None
+    assert heap.next_deadline() is None
@@ -0,0 +1,132 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from src import crud, models, outbox, telegram
+from src.database import Base
+
+class FakeBot:
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.calls = []
+
+    async def send_message(self, **kwargs):
+        self.calls.append(("send_message", kwargs))
+        if self.error:
+            raise self.error
+        return SimpleNamespace(document=None)
+
+    async def send_document(self, **kwargs):
+        self.calls.append(("send_document", kwargs))
+        if self.error:
+            raise self.error
+        return SimpleNamespace(document=SimpleNamespace(file_id="file-id"))
+
+async def _run(check, monkeypatch, bot=None):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        monkeypatch.setattr(outbox, "AsyncSessionLocal", session_factory)
+        monkeypatch.setattr(telegram, "bot", bot or FakeBot())
+        async with session_factory() as db:
+            for chat_id in (1, 2, 3):
+                db.add(models.OutboxMessage(
+                    id=chat_id, chat_id=chat_id, method="send_message", payload={"text": f"text{chat_id}"},
+                    next_attempt_at=datetime.now(UTC) - timedelta(seconds=1)
+                ))
+            await db.commit()
+            await check(session_factory)
+    finally:
+        await engine.dispose()
+
+async def _message(session_factory, message_id):
+    async with session_factory() as db:
+        return await db.get(models.OutboxMessage, message_id)
+
+def test_claim_takes_each_message_once(monkeypatch):
+    async def check(session_factory):
+        async with session_factory() as db:
+            first = await crud.claim_outbox_messages(db, 2)
+            second = await crud.claim_outbox_messages(db, 2)
+            third = await crud.claim_outbox_messages(db, 2)
+        assert [row.id for row in first] == [1, 2]
+        assert [row.id for row in second] == [3]
+        assert third == []
+
+    asyncio.run(_run(check, monkeypatch))
+
+def test_stale_sender_cannot_finish_reclaimed_message(monkeypatch):
+    async def check(session_factory):
+        async with session_factory() as db:
+            (stale, *_) = await crud.claim_outbox_messages(db, 1)
+            # Отправитель завис: сообщение возвращается в очередь и достаётся другому
+            assert await crud.release_stale_outbox_messages(db, -1) == 1
+            fresh = next(row for row in await crud.claim_outbox_messages(db, 3) if row.id == stale.id)
+
+        async with session_factory() as db:
+            assert await crud.touch_outbox_message(db, stale.id, stale.claimed_at) is None
+            await crud.mark_outbox_message_sent(db, stale.id, stale.claimed_at)
+        assert (await _message(session_factory, stale.id)).status == "sending"
+
+        async with session_factory() as db:
+            claimed_at = await crud.touch_outbox_message(db, fresh.id, fresh.claimed_at)
+            await crud.mark_outbox_message_sent(db, fresh.id, claimed_at)
+        assert (await _message(session_factory, fresh.id)).status == "sent"
+
+    asyncio.run(_run(check, monkeypatch))
+
+def test_backoff_grows_and_is_capped():
+    for attempt in range(1, 6):
+        delay = outbox._backoff(attempt)
+        full = outbox.OUTBOX_BACKOFF_BASE * 2 ** (attempt - 1)
+        assert full / 2 <= delay <= full
+    assert outbox._backoff(100) <= outbox.OUTBOX_BACKOFF_MAX
+
+def test_transient_error_reschedules_with_backoff(monkeypatch):
+    async def check(session_factory):
+        async with session_factory() as db:
+            messages = await crud.claim_outbox_messages(db, 3)
+        await outbox._deliver(messages[0])
+        message = await _message(session_factory, messages[0].id)
+        assert message.status == "pending"
+        assert message.attempts == 1
+        assert message.claimed_at is None
+        assert message.last_error == "сеть недоступна"
+        assert message.next_attempt_at.replace(tzinfo=UTC) > datetime.now(UTC)
+
+        # Последняя попытка не откладывается, а помечает сообщение как failed
+        monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 1)
+        await outbox._deliver(messages[1])
+        assert (await _message(session_factory, messages[1].id)).status == "failed"
+
+    asyncio.run(_run(check, monkeypatch, FakeBot(ConnectionError("сеть недоступна"))))
+
+def test_revoked_config_is_not_sent(monkeypatch):
+    bot = FakeBot()
+
+    async def check(session_factory):
+        async with session_factory() as db:
+            db.add(models.User(id=1, tgId=1, username="user", firstname="User"))
+            db.add(models.Protocol(id=1, name="openvpn"))
+            db.add(models.Server(id=1, name="server1", host="127.0.0.1", port=1194))
+            db.add(models.UserConfig(
+                id=1, user_id=1, server_id=1, protocol_id=1, config_name="config1",
+                is_active=False, expires_at=datetime.now(UTC)
+            ))
+            db.add(models.OutboxMessage(
+                id=10, chat_id=10, method="send_document",
+                payload={"config_id": 1, "filename": "config1.ovpn"},
+                next_attempt_at=datetime.now(UTC) - timedelta(seconds=1)
+            ))
+            await db.commit()
+            messages = await crud.claim_outbox_messages(db, 10)
+        await outbox._deliver(next(message for message in messages if message.id == 10))
+
+        message = await _message(session_factory, 10)
+        assert message.status == "failed"
+        assert message.last_error == "Конфигурация отозвана"
+        assert bot.calls == []
+
+    asyncio.run(_run(check, monkeypatch, bot))
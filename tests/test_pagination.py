@@ -0,0 +1,82 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from src import crud, models, pagination
+from src.database import Base
+
+NOW = datetime(2026, 1, 1, tzinfo=UTC)
+
+def test_cursor_round_trip():
+    columns = [models.UserConfig.expires_at, models.UserConfig.id]
+    row = SimpleNamespace(expires_at=NOW, id=42)
+    cursor = pagination.encode_cursor(columns, row)
+    assert pagination.decode_cursor(columns, cursor) == [NOW, 42]
+
+def test_cursor_from_other_sort_is_rejected():
+    cursor = pagination.encode_cursor([models.UserConfig.id], SimpleNamespace(id=42))
+    with pytest.raises(ValueError):
+        pagination.decode_cursor([models.UserConfig.expires_at, models.UserConfig.id], cursor)
+
+@pytest.mark.parametrize("cursor", ["", "не base64", "bm90IGpzb24", "eyJrIjogWyJpZCJdfQ"])
+def test_broken_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor([models.UserConfig.id], cursor)
+
+def test_page_cuts_extra_row():
+    columns = [models.UserConfig.id]
+    rows, cursor = pagination.page(columns, [SimpleNamespace(id=i) for i in (5, 4, 3)], 2)
+    assert [row.id for row in rows] == [5, 4]
+    assert pagination.decode_cursor(columns, cursor) == [4]
+    rows, cursor = pagination.page(columns, [SimpleNamespace(id=2)], 2)
+    assert cursor is None
+
+async def _walk(db, limit, **filters):
+    ids, cursor = [], None
+    while True:
+        rows, cursor = await crud.list_configs(db, cursor=cursor, limit=limit, **filters)
+        ids.extend(row["id"] for row in rows)
+        if cursor is None:
+            return ids
+
+async def _run(check):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add(models.User(id=1, tgId=1, username="user", firstname="User"))
+            db.add(models.Protocol(id=1, name="openvpn"))
+            for server_id in (1, 2):
+                db.add(models.Server(id=server_id, name=f"server{server_id}", host="127.0.0.1", port=1194))
+            for config_id in range(1, 24):
+                db.add(models.UserConfig(
+                    id=config_id, user_id=1, server_id=config_id % 2 + 1, protocol_id=1,
+                    config_name=f"config{config_id}", is_active=config_id % 3 != 0,
+                    # Одинаковые сроки у соседних конфигов: порядок решает второй ключ id
+                    expires_at=NOW + timedelta(days=config_id // 2)
+                ))
+            await db.commit()
+            await check(db)
+    finally:
+        await engine.dispose()
+
+def test_list_configs_pages_cover_all_rows_once():
+    async def check(db):
+        assert await _walk(db, 5) == list(range(23, 0, -1))
+
+    asyncio.run(_run(check))
+
+def test_list_configs_filters_hold_across_pages():
+    async def check(db):
+        ids = await _walk(db, 4, server_id=1, is_active=True)
+        assert ids == [i for i in range(23, 0, -1) if i % 2 == 0 and i % 3 != 0]
+
+        after, before = NOW + timedelta(days=3), NOW + timedelta(days=9)
+        ids = await _walk(db, 3, expires_after=after, expires_before=before)
+        # С фильтром по сроку - в порядке истечения, при равных сроках по id
+        assert ids == list(range(6, 18))
+
+    asyncio.run(_run(check))
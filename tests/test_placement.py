@@ -0,0 +1,72 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from src import models, placement
+from src.database import Base
+
+async def _run(check):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        async with session_factory() as db:
+            servers = [
+                # id, страна, ёмкость, занято, активен, здоров
+                (1, "NL", 2, 1, True, True),
+                (2, "NL", 4, 1, True, True),
+                (3, "NL", 10, 0, False, True),
+                (4, "NL", 10, 0, True, False),
+                (5, "DE", 1, 1, True, True),
+            ]
+            for server_id, country, capacity, active_configs, is_active, health_up in servers:
+                db.add(models.Server(
+                    id=server_id, name=f"server{server_id}", host="127.0.0.1", port=1194, country=country,
+                    capacity=capacity, active_configs=active_configs, is_active=is_active, health_up=health_up
+                ))
+            await db.commit()
+            await check(db)
+    finally:
+        await engine.dispose()
+
+async def _active_configs(db):
+    rows = await db.execute(select(models.Server.id, models.Server.active_configs))
+    return dict(rows.all())
+
+def test_reserve_server_fills_least_loaded_until_full():
+    async def check(db):
+        # Загрузка 1/2 и 1/4: место берётся на менее загруженном, при равной загрузке - по id
+        reserved = [await placement.reserve_server(db, "NL") for _ in range(5)]
+        assert reserved == [2, 1, 2, 2, None]
+        counts = await _active_configs(db)
+        assert counts[1] == 2 and counts[2] == 4
+        # Выключенный и не прошедший проверку здоровья серверы не выбираются
+        assert counts[3] == 0 and counts[4] == 0
+
+    asyncio.run(_run(check))
+
+def test_reserve_server_without_capacity_returns_none():
+    async def check(db):
+        assert await placement.reserve_server(db, "DE") is None
+        assert await placement.reserve_server(db, "FI") is None
+
+    asyncio.run(_run(check))
+
+def test_reserve_on_server_takes_only_that_server():
+    async def check(db):
+        assert await placement.reserve_on_server(db, 1) == 1
+        assert await placement.reserve_on_server(db, 1) is None
+        counts = await _active_configs(db)
+        assert counts[1] == 2 and counts[2] == 1
+        for server_id in (3, 4, 5):
+            assert await placement.reserve_on_server(db, server_id) is None
+
+    asyncio.run(_run(check))
+
+def test_rollback_releases_reservation():
+    async def check(db):
+        assert await placement.reserve_on_server(db, 2) == 2
+        await db.rollback()
+        assert (await _active_configs(db))[2] == 1
+
+    asyncio.run(_run(check))
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from src import crud, models
+from src.database import Base, assert_query_count
+
+async def _run(check):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add(models.User(id=1, tgId=1, username="user", firstname="User"))
+            db.add(models.Protocol(id=1, name="openvpn"))
+            for server_id in (1, 2):
+                db.add(models.Server(id=server_id, name=f"server{server_id}", host="127.0.0.1", port=1194))
+            now = datetime.now(UTC)
+            for config_id in range(1, 7):
+                db.add(models.UserConfig(
+                    id=config_id, user_id=1, server_id=config_id % 2 + 1, protocol_id=1,
+                    config_name=f"config{config_id}", is_active=config_id % 3 != 0,
+                    expires_at=now + timedelta(days=config_id)
+                ))
+            await db.commit()
+            await check(db)
+    finally:
+        await engine.dispose()
+
+def test_user_active_configs_is_one_query():
+    async def check(db):
+        async with assert_query_count(db, 1):
+            configs = await crud.get_user_active_configs(db, 1)
+        assert len(configs) == 4
+        assert {config["protocol"] for config in configs} == {"openvpn"}
+        assert {config["server_name"] for config in configs} == {"server1", "server2"}
+
+    asyncio.run(_run(check))
+
+def test_user_all_configs_is_one_query():
+    async def check(db):
+        async with assert_query_count(db, 1):
+            configs = await crud.get_user_all_configs(db, 1)
+        assert len(configs) == 6
+
+    asyncio.run(_run(check))
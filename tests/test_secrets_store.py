@@ -0,0 +1,30 @@
+import pytest
+from src import placement, secrets_store
+from src.cache import ServerRecord
+
+def test_encrypt_roundtrip_hides_password():
+    encrypted = secrets_store.encrypt("s3cret")
+    assert "s3cret" not in encrypted
+    assert secrets_store.is_encrypted(encrypted)
+    assert secrets_store.decrypt(encrypted) == "s3cret"
+    # Повторное шифрование не оборачивает шифротекст ещё раз
+    assert secrets_store.encrypt(encrypted) == encrypted
+
+def test_plaintext_from_before_encryption_is_returned_as_is():
+    assert secrets_store.decrypt("legacy") == "legacy"
+    assert secrets_store.decrypt(None) is None
+    assert secrets_store.encrypt(None) is None
+
+def test_foreign_key_is_reported():
+    with pytest.raises(ValueError):
+        secrets_store.decrypt("fernet:not-a-token")
+
+def test_ssh_params_decrypts_password():
+    server = ServerRecord(
+        id=1, name="nl1", host="10.0.0.1", port=1194, country="NL", is_active=True,
+        created_at=None, capacity=10, ssh_username="root",
+        ssh_password=secrets_store.encrypt("s3cret"), ssh_port=2222, openvpn_proto="udp"
+    )
+    assert placement.ssh_params(server) == {
+        "hostname": "10.0.0.1", "username": "root", "password": "s3cret", "port": 2222
+    }
@@ -0,0 +1,30 @@
+import pytest
+from src import database
+
+@pytest.mark.parametrize("statement", [
+    "SELECT users.id FROM users WHERE users.id = $1::INTEGER",
+    "SELECT count(*) AS count_1 FROM user_configs WHERE user_configs.user_id IN ($1, $2)",
+    "SELECT CAST(servers.active_configs AS FLOAT) / CAST(servers.capacity AS NUMERIC) FROM servers",
+    "SELECT id FROM user_configs WHERE (expires_at, id) < ($1, $2) AND config_name = 'pg_notify(x)'",
+])
+def test_plain_reads_are_analyzed(statement):
+    assert database._can_analyze(statement)
+
+@pytest.mark.parametrize("statement", [
+    "SELECT pg_try_advisory_lock($1) AS pg_try_advisory_lock_1",
+    "SELECT pg_notify($1, $2) AS pg_notify_1",
+    "SELECT nextval('user_configs_id_seq')",
+    "SELECT provisioning_jobs.id FROM provisioning_jobs WHERE status = $1 FOR UPDATE SKIP LOCKED",
+    "SELECT id FROM servers FOR NO KEY UPDATE",
+    "UPDATE servers SET active_configs = active_configs + 1",
+    "SELECT 1; DELETE FROM users",
+])
+def test_side_effecting_statements_are_not_analyzed(statement):
+    assert not database._can_analyze(statement)
+
+def test_parameters_are_redacted_by_default(monkeypatch):
+    monkeypatch.setattr(database, "SLOW_QUERY_LOG_PARAMETERS", False)
+    assert database._short_parameters(("s3cret", 42)) == ["<str>", "<int>"]
+
+    monkeypatch.setattr(database, "SLOW_QUERY_LOG_PARAMETERS", True)
+    assert database._short_parameters({"password": "s3cret"}) == ["s3cret"]
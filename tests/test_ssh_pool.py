@@ -0,0 +1,56 @@
+import threading
+import time
+import pytest
+from benchmarks.fake_ssh_host import FakeOpenVPNHost
+from src import ssh
+
+def test_fair_semaphore_hands_slots_out_in_order():
+    semaphore = ssh._FairSemaphore(1)
+    assert semaphore.acquire(timeout=0)
+    order = []
+
+    def waiter(name):
+        assert semaphore.acquire(timeout=5)
+        order.append(name)
+        semaphore.release()
+
+    threads = []
+    for name in ("first", "second", "third"):
+        thread = threading.Thread(target=waiter, args=(name,))
+        thread.start()
+        threads.append(thread)
+        # Ожидающие встают в очередь в порядке запуска
+        time.sleep(0.05)
+    semaphore.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["first", "second", "third"]
+
+def test_fair_semaphore_acquire_times_out():
+    semaphore = ssh._FairSemaphore(1)
+    assert semaphore.acquire()
+    assert not semaphore.acquire(timeout=0.05)
+    # Ожидавший по таймауту поток не занимает место
+    semaphore.release()
+    assert semaphore.acquire(timeout=0)
+
+@pytest.fixture
+def slow_host():
+    with FakeOpenVPNHost(adduser_latency=2, jitter=0) as host:
+        yield host
+
+def test_hung_command_times_out_and_drops_connection(slow_host):
+    pool = ssh.SSHConnectionPool(**slow_host.ssh_params(), max_channels=1)
+    try:
+        with pytest.raises(TimeoutError):
+            with pool.session() as client:
+                client.execute_command("./adduser.sh hung", timeout=0.2)
+        # Соединение с зависшей командой выброшено, а канал пула освобождён
+        assert pool._client is None
+        assert pool._channels.acquire(timeout=0)
+        pool._channels.release()
+
+        with pool.session() as client:
+            assert client.execute_command('cat "/root/missing.ovpn"')[0] == 1
+    finally:
+        pool.close()
@@ -0,0 +1,43 @@
+"""
+Фоновый воркер: сверка и точное истечение конфигов, уведомления об истечении,
+пул готовых конфигураций и очередь создания конфигураций.
+
+    python -m worker
+
+API (main.py) при этом только обслуживает HTTP запросы. Процесс воркера
+держит свой пул соединений с БД: WORKER_DB_POOL_SIZE и WORKER_DB_MAX_OVERFLOW
+переопределяют DB_POOL_SIZE и DB_MAX_OVERFLOW. Параллелизм задаётся
+PROVISIONING_WORKERS, EXPIRY_SWEEP_BATCH_SIZE и т.д. в окружении воркера.
+"""
+import asyncio
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+for name in ("DB_POOL_SIZE", "DB_MAX_OVERFLOW"):
+    if os.getenv(f"WORKER_{name}"):
+        os.environ[name] = os.environ[f"WORKER_{name}"]
+
+from prometheus_client import start_http_server
+from src import background, metrics, ssh
+from src.database import async_engine
+
+# Порт, на котором воркер отдаёт /metrics для Prometheus
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
+
+async def main():
+    metrics.instrument_engine(async_engine.sync_engine)
+    start_http_server(WORKER_METRICS_PORT)
+    print(f"🚀 Воркер запущен (метрики на порту {WORKER_METRICS_PORT})")
+
+    background.start_shared_tasks()
+    background.start_worker_tasks()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        ssh.close_all_pools()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())